@@ -21,8 +21,11 @@
 # SOFTWARE.
 # ================================================================
 
+import math
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class BaseAutoencoder(nn.Module):
@@ -30,6 +33,10 @@ class BaseAutoencoder(nn.Module):
     Provides some common functionality across the different autoencoder
     model architectures.
     """
+    # Inputs are processed in blocks of this many pixels, along each side.
+    ALIGNMENT = 1
+    # Whether the model's layers all have int8 versions, for `quantize.py`.
+    QUANTIZABLE = True
 
     def forward(self, x):
         """
@@ -43,22 +50,28 @@ class BaseAutoencoder(nn.Module):
 
         return decoded_x
 
-    def load(self):
+    def load(self, fpath=None):
         """
         Load in any existing weights belonging to this model.
+        Args:
+            fpath (str): Optionally, the weights to load. Default is the
+                model's own `FPATH`.
         """
         try:
-            self.load_state_dict(torch.load(self.FPATH))
+            self.load_state_dict(torch.load(fpath or self.FPATH))
             self.eval()
         except FileNotFoundError:
             msg = "No existing model to initialize from. Creating new one ..."
             print(msg)
 
-    def save(self):
+    def save(self, fpath=None):
         """
         Save the current state of this model.
+        Args:
+            fpath (str): Optionally, where to save it. Default is the model's
+                own `FPATH`.
         """
-        torch.save(self.state_dict(), self.FPATH)
+        torch.save(self.state_dict(), fpath or self.FPATH)
 
     def resize(self, sample):
         """
@@ -66,9 +79,62 @@ class BaseAutoencoder(nn.Module):
         Conv2D layer. We need to do this, as PyTorch our input
         is expected in the following shape:
             (batch_size, n_channels, height, width)
+        Note, float (or quantized) samples are assumed to have already been
+        prepared (e.g. by `data.ToTensorCollate`), & are passed through as-is.
         """
+        if sample.is_floating_point() or sample.is_quantized:
+            return sample
+
         return sample.permute(0, 3, 1, 2).type("torch.FloatTensor")
 
+    def receptive_margin(self):
+        """
+        Get how far, in pixels, each output pixel can see past itself into
+        the input, along any side. Output pixels closer than this to the edge
+        of a crop of an image are affected by the crop, so this is how much
+        overlapping context tiles need. Note, layers are walked in the order
+        they're registered, which must be the order they're applied in.
+        With strided layers, this is an upper bound, which holds for crops
+        aligned to `ALIGNMENT`.
+        """
+        margin = 0
+        for dim in (0, 1):
+            # `jump` is the number of input pixels per pixel of the current
+            # layer's input.
+            low = high = 0
+            jump = 1
+            for layer in self.modules():
+                if not isinstance(layer, (nn.Conv2d, nn.ConvTranspose2d)):
+                    continue
+
+                stride = layer.stride[dim]
+                extent = layer.dilation[dim] * (layer.kernel_size[dim] - 1)
+                padding = layer.padding
+                if padding == "valid":
+                    padding = 0
+                elif padding == "same":
+                    padding = extent // 2
+                else:
+                    padding = padding[dim]
+
+                # A convolution's output pixel `i` sees inputs
+                # [i * stride - padding, i * stride - padding + extent], while
+                # a transposed convolution's sees the inputs `j` where
+                # j * stride is in [i + padding - extent, i + padding]. Any
+                # stride also blurs where a pixel lands by up to stride - 1.
+                if isinstance(layer, nn.Conv2d):
+                    low -= (padding + stride - 1) * jump
+                    high += (extent - padding) * jump
+                    jump *= stride
+                else:
+                    jump /= stride
+                    low += (padding - extent - stride + 1) * jump
+                    high += padding * jump
+
+            margin = max(margin, math.ceil(-low), math.ceil(high))
+
+        return margin
+
 
 class ARCH0Autoencoder(BaseAutoencoder):
     """
@@ -213,3 +279,362 @@ class ARCH2Autoencoder(BaseAutoencoder):
             ),
             nn.ReLU(inplace=True)
         )
+
+
+class ARCH3Autoencoder(BaseAutoencoder):
+    """
+    Student architecture, to be distilled from ARCH2 (see `distill.py`).
+    It has the same shape as ARCH2, but with a quarter of the channels in
+    each layer, so it takes around 1/16th of the compute.
+    """
+    KERNEL_SIZE = 3
+    STRIDE = 1
+    FPATH = "arch_3.pt"
+
+    def __init__(self, inpt_shape):
+        super().__init__()
+        _, _, inpt_channels = inpt_shape
+        self.encoder = nn.Sequential(
+            nn.Conv2d(
+                in_channels=inpt_channels,
+                out_channels=16,
+                kernel_size=self.KERNEL_SIZE,
+                stride=self.STRIDE
+            ),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(
+                in_channels=16,
+                out_channels=32,
+                kernel_size=self.KERNEL_SIZE,
+                stride=self.STRIDE
+            ),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(
+                in_channels=32,
+                out_channels=64,
+                kernel_size=self.KERNEL_SIZE,
+                stride=self.STRIDE
+            ),
+            nn.ReLU(inplace=True)
+        )
+        self.decoder = nn.Sequential(
+            nn.ConvTranspose2d(
+                in_channels=64,
+                out_channels=32,
+                kernel_size=self.KERNEL_SIZE
+            ),
+            nn.ReLU(inplace=True),
+            nn.ConvTranspose2d(
+                in_channels=32,
+                out_channels=16,
+                kernel_size=self.KERNEL_SIZE
+            ),
+            nn.ReLU(inplace=True),
+            nn.ConvTranspose2d(
+                in_channels=16,
+                out_channels=inpt_channels,
+                kernel_size=self.KERNEL_SIZE
+            ),
+            nn.ReLU(inplace=True)
+        )
+
+
+class ConvAutoencoder(BaseAutoencoder):
+    """
+    Autoencoder with the same plain layout as ARCH0-3 (a stack of
+    convolutions, mirrored by a stack of transposed convolutions), but with
+    any number of channels in each layer. This is what channel pruning
+    leaves of those architectures (see `prune.py`), so rather than being
+    registered by name, it's built to fit a set of weights. Its weights are
+    saved along with its widths, which marks them as pruned for
+    `inference.load_model()`.
+    """
+    KERNEL_SIZE = 3
+    FPATH = "conv.pt"
+
+    def __init__(
+        self,
+        inpt_shape,
+        encoder_widths,
+        decoder_widths,
+        kernel_size=None
+    ):
+        """
+        Args:
+            inpt_shape (tuple of int): The (H, W, C) shape of the input.
+            encoder_widths (list of int): The output channels of each of the
+                encoder's convolutions.
+            decoder_widths (list of int): The output channels of each of the
+                decoder's transposed convolutions, except the last, which
+                always outputs as many channels as the input has.
+            kernel_size (int): The size of every kernel. Default is
+                `KERNEL_SIZE`.
+        """
+        super().__init__()
+        _, _, inpt_channels = inpt_shape
+        kernel_size = kernel_size or self.KERNEL_SIZE
+        self.encoder_widths = list(encoder_widths)
+        self.decoder_widths = list(decoder_widths)
+
+        encoder = []
+        widths = [inpt_channels] + self.encoder_widths
+        for in_channels, out_channels in zip(widths, widths[1:]):
+            encoder.append(nn.Conv2d(
+                in_channels=in_channels,
+                out_channels=out_channels,
+                kernel_size=kernel_size
+            ))
+            encoder.append(nn.ReLU(inplace=True))
+        self.encoder = nn.Sequential(*encoder)
+
+        decoder = []
+        widths = widths[-1:] + self.decoder_widths + [inpt_channels]
+        for in_channels, out_channels in zip(widths, widths[1:]):
+            decoder.append(nn.ConvTranspose2d(
+                in_channels=in_channels,
+                out_channels=out_channels,
+                kernel_size=kernel_size
+            ))
+            decoder.append(nn.ReLU(inplace=True))
+        self.decoder = nn.Sequential(*decoder)
+
+    def load(self, fpath=None):
+        """
+        Load in any existing weights belonging to this model.
+        Args:
+            fpath (str): Optionally, the weights to load. Default is the
+                model's own `FPATH`.
+        """
+        try:
+            self.load_state_dict(torch.load(fpath or self.FPATH)["model"])
+            self.eval()
+        except FileNotFoundError:
+            msg = "No existing model to initialize from. Creating new one ..."
+            print(msg)
+
+    def save(self, fpath=None):
+        """
+        Save the current state of this model, along with its widths.
+        Args:
+            fpath (str): Optionally, where to save it. Default is the model's
+                own `FPATH`.
+        """
+        torch.save(
+            {"model": self.state_dict(), "widths": self.widths},
+            fpath or self.FPATH
+        )
+
+    @property
+    def widths(self):
+        # Saved alongside the weights, to mark them as not fitting their
+        # architecture as is.
+        return {
+            "encoder": self.encoder_widths,
+            "decoder": self.decoder_widths
+        }
+
+    @classmethod
+    def from_state_dict(cls, state_dict, assign=False):
+        """
+        Build a model shaped to fit the given weights, & load them. The
+        weights must be laid out as in ARCH0-3.
+        Args:
+            state_dict (dict of Tensor): The weights to load.
+            assign (bool): Whether the model should take the given tensors
+                as its weights, rather than copying them. Its own weights
+                are then never allocated.
+        """
+        def weights(prefix):
+            layers = {}
+            for key, value in state_dict.items():
+                parts = key.split(".")
+                if len(parts) == 3 and parts[::2] == [prefix, "weight"]:
+                    layers[int(parts[1])] = value
+
+            return [layers[index] for index in sorted(layers)]
+
+        encoder, decoder = weights("encoder"), weights("decoder")
+        if not encoder or not decoder:
+            raise ValueError(
+                "Expected the weights of a plain convolutional autoencoder."
+            )
+
+        # Convolution weights are (out, in, ...), while transposed
+        # convolution weights are (in, out, ...).
+        with torch.device("meta" if assign else "cpu"):
+            model = cls(
+                inpt_shape=(None, None, encoder[0].shape[1]),
+                encoder_widths=[weight.shape[0] for weight in encoder],
+                decoder_widths=[weight.shape[1] for weight in decoder[:-1]],
+                kernel_size=encoder[0].shape[-1]
+            )
+        model.load_state_dict(state_dict, assign=assign)
+        return model
+
+
+class _UpBlock(nn.Module):
+    """
+    A single level of a U-Net's decoder. Upsamples its input, & merges it
+    with the encoder's features at the same level.
+    """
+
+    def __init__(self, in_channels, out_channels, kernel_size):
+        super().__init__()
+        self.up = nn.ConvTranspose2d(
+            in_channels=in_channels,
+            out_channels=out_channels,
+            kernel_size=2,
+            stride=2
+        )
+        self.merge = nn.Sequential(
+            nn.Conv2d(
+                in_channels=2 * out_channels,
+                out_channels=out_channels,
+                kernel_size=kernel_size,
+                padding=kernel_size // 2
+            ),
+            nn.ReLU(inplace=True)
+        )
+
+    def forward(self, x, skip):
+        return self.merge(torch.cat([self.up(x), skip], dim=1))
+
+
+class UNetAutoencoder(BaseAutoencoder):
+    """
+    U-Net style autoencoder architecture. Unlike the other architectures,
+    each level of the encoder halves the resolution (with a strided
+    convolution) & doubles the channels, so the bottleneck is 2 ** DEPTH
+    times smaller along each side than the input. The decoder mirrors the
+    encoder, & merges in the encoder's features at each level through skip
+    connections, so that fine detail isn't lost through the bottleneck.
+    Inputs of any size are padded up to a multiple of 2 ** DEPTH, & the
+    output is cropped back to match.
+    """
+    KERNEL_SIZE = 3
+    WIDTH = 16
+    DEPTH = 3
+    FPATH = "unet.pt"
+    # Note, there's no int8 version of replicate padding.
+    QUANTIZABLE = False
+
+    def __init__(self, inpt_shape, width=None, depth=None):
+        """
+        Args:
+            inpt_shape (tuple of int): The (H, W, C) shape of the input.
+            width (int): The number of channels at full resolution. Default
+                is `WIDTH`.
+            depth (int): The number of times to halve the resolution.
+                Default is `DEPTH`.
+        """
+        super().__init__()
+        _, _, inpt_channels = inpt_shape
+        width = width or self.WIDTH
+        depth = depth or self.DEPTH
+        padding = self.KERNEL_SIZE // 2
+
+        # Note, layers are registered in the order they're applied, for
+        # `receptive_margin()`.
+        self.stem = nn.Sequential(
+            nn.Conv2d(
+                in_channels=inpt_channels,
+                out_channels=width,
+                kernel_size=self.KERNEL_SIZE,
+                padding=padding
+            ),
+            nn.ReLU(inplace=True)
+        )
+        self.encoder = nn.ModuleList([
+            nn.Sequential(
+                nn.Conv2d(
+                    in_channels=width * 2 ** level,
+                    out_channels=width * 2 ** (level + 1),
+                    kernel_size=self.KERNEL_SIZE,
+                    stride=2,
+                    padding=padding
+                ),
+                nn.ReLU(inplace=True),
+                nn.Conv2d(
+                    in_channels=width * 2 ** (level + 1),
+                    out_channels=width * 2 ** (level + 1),
+                    kernel_size=self.KERNEL_SIZE,
+                    padding=padding
+                ),
+                nn.ReLU(inplace=True)
+            )
+            for level in range(depth)
+        ])
+        self.decoder = nn.ModuleList([
+            _UpBlock(
+                in_channels=width * 2 ** (level + 1),
+                out_channels=width * 2 ** level,
+                kernel_size=self.KERNEL_SIZE
+            )
+            for level in reversed(range(depth))
+        ])
+        self.head = nn.Sequential(
+            nn.Conv2d(
+                in_channels=width,
+                out_channels=inpt_channels,
+                kernel_size=1
+            ),
+            nn.ReLU(inplace=True)
+        )
+
+    @property
+    def ALIGNMENT(self):
+        # Each level of the encoder halves the resolution.
+        return 2 ** len(self.encoder)
+
+    def forward(self, x):
+        """
+        Perform the forward pass on the given input.
+        Args:
+            x (Tensor): The input to perform the forward pass on.
+        """
+        x = self.resize(x)
+        height, width = x.shape[-2:]
+        x = F.pad(
+            x,
+            (0, -width % self.ALIGNMENT, 0, -height % self.ALIGNMENT),
+            mode="replicate"
+        )
+
+        x = self.stem(x)
+        skips = []
+        for level in self.encoder:
+            skips.append(x)
+            x = level(x)
+        for level, skip in zip(self.decoder, reversed(skips)):
+            x = level(x, skip)
+
+        return self.head(x)[..., :height, :width]
+
+
+class UNET0Autoencoder(UNetAutoencoder):
+    """
+    Small U-Net, with 16 channels at full resolution, & 3 levels.
+    """
+    WIDTH = 16
+    DEPTH = 3
+    FPATH = "unet_0.pt"
+
+
+class UNET1Autoencoder(UNetAutoencoder):
+    """
+    Larger U-Net, with 32 channels at full resolution, & 4 levels.
+    """
+    WIDTH = 32
+    DEPTH = 4
+    FPATH = "unet_1.pt"
+
+
+# Every architecture, by name.
+ARCHITECTURES = {
+    "ARCH0": ARCH0Autoencoder,
+    "ARCH1": ARCH1Autoencoder,
+    "ARCH2": ARCH2Autoencoder,
+    "ARCH3": ARCH3Autoencoder,
+    "UNET0": UNET0Autoencoder,
+    "UNET1": UNET1Autoencoder
+}
@@ -0,0 +1,395 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import numpy
+import torch
+
+from PIL import Image
+from torch.utils.data import DataLoader
+
+from autoencoder import ARCHITECTURES
+from data import (
+    DSGenerator,
+    DeWatermarkerDataset,
+    ShardWriter,
+    ToTensorCollate
+)
+from trainer import Trainer
+
+
+WATERMARK_FNAME = "data/getty-watermark.png"
+BASELINE_FNAME = "benchmarks/baseline.json"
+
+
+def _images(resolution, n_images, seed=0):
+    """
+    Get a fixed set of synthetic (resolution, resolution) RGB images, so
+    that every run times exactly the same inputs.
+    """
+    rng = numpy.random.default_rng(seed)
+    return [
+        Image.fromarray(
+            rng.integers(0, 256, (resolution, resolution, 3), numpy.uint8)
+        )
+        for _ in range(n_images)
+    ]
+
+
+def _batch(resolution, batch_size, seed=0):
+    """
+    Get a fixed synthetic batch, as collated by `ToTensorCollate`.
+    """
+    rng = numpy.random.default_rng(seed)
+    shape = (batch_size, 3, resolution, resolution)
+    return {
+        "watermarked": torch.from_numpy(rng.random(shape, numpy.float32)),
+        "original": torch.from_numpy(rng.random(shape, numpy.float32))
+    }
+
+
+def _dataset_dir(tmp_dir, resolution, n_images):
+    """
+    Write a fixed sharded dataset of the given resolution, returning its
+    directory. It's only written once per resolution & size.
+    """
+    root_dir = os.path.join(tmp_dir, "set-{}-{}".format(resolution, n_images))
+    if not os.path.exists(root_dir):
+        with ShardWriter(root_dir=root_dir) as writer:
+            for image in _images(resolution, 2 * n_images):
+                writer.write({
+                    "watermarked": numpy.asarray(image),
+                    "original": numpy.asarray(image)
+                })
+
+    return root_dir
+
+
+def _generate_cases(resolution, batch_size, tmp_dir):
+    """
+    Generate a dataset of `batch_size` images, in each format.
+    """
+    watermark = Image.open(WATERMARK_FNAME)
+    images = _images(resolution, batch_size)
+
+    def generate(sharded):
+        # The generator always writes to its class-level paths, so we point
+        # them at our temporary directory for the duration.
+        fname, root_dir = DSGenerator.TRAINING_FNAME, DSGenerator.TRAINING_DIR
+        DSGenerator.TRAINING_FNAME = os.path.join(tmp_dir, "generated.pkl")
+        DSGenerator.TRAINING_DIR = os.path.join(tmp_dir, "generated")
+        try:
+            DSGenerator.generate_dataset(
+                watermark=watermark,
+                images=images,
+                sharded=sharded
+            )
+        finally:
+            DSGenerator.TRAINING_FNAME = fname
+            DSGenerator.TRAINING_DIR = root_dir
+
+    yield "generate_dataset/pickle", lambda: generate(sharded=False)
+    yield "generate_dataset/sharded", lambda: generate(sharded=True)
+
+
+def _loading_cases(resolution, batch_size, tmp_dir):
+    """
+    Load a batch worth of samples, one by one & through a DataLoader.
+    """
+    dataset = DeWatermarkerDataset(
+        root_dir=_dataset_dir(tmp_dir, resolution, batch_size)
+    )
+
+    def getitem():
+        for index in range(batch_size):
+            dataset[index]
+
+    def iterate():
+        dataloader = DataLoader(
+            dataset,
+            batch_size=batch_size,
+            collate_fn=ToTensorCollate()
+        )
+        for _ in dataloader:
+            pass
+
+    yield "getitem", getitem
+    yield "dataloader", iterate
+
+
+def _model_cases(resolution, batch_size, tmp_dir):
+    """
+    Take a single optimizer step, & run inference, with each architecture.
+    """
+    batch = _batch(resolution, batch_size)
+    for arch, cls in ARCHITECTURES.items():
+        torch.manual_seed(0)
+        model = cls((resolution, resolution, 3))
+        trainer = Trainer(
+            model=model,
+            optimizer=torch.optim.Adam(model.parameters()),
+            dataloader=None,
+            checkpoint_dir=tmp_dir
+        )
+
+        def infer(model=model):
+            model.eval()
+            with torch.no_grad():
+                model(batch["watermarked"])
+
+        yield "train_step/{}".format(arch), \
+            lambda trainer=trainer: trainer.train_step(batch)
+        yield "inference/{}".format(arch), infer
+        # Note, every case has been timed by the time we're resumed here.
+        trainer.close()
+
+
+# Every group of benchmarks, by name. Each yields (name, fn) pairs for a
+# given resolution & batch size, where `fn` is what we time.
+BENCHMARKS = {
+    "generate": _generate_cases,
+    "loading": _loading_cases,
+    "model": _model_cases
+}
+
+
+def _time(fn, n_runs, n_warmup=1):
+    """
+    Time the given function, after a few warm-up calls.
+    """
+    for _ in range(n_warmup):
+        fn()
+
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "median": statistics.median(times),
+        "min": min(times),
+        "runs": n_runs
+    }
+
+
+def run_suite(
+    groups=None,
+    resolutions=(64, 128),
+    batch_sizes=(1, 4),
+    n_runs=5,
+    log=None
+):
+    """
+    Run the benchmark suite. Returns the results, along with a description
+    of the machine they were measured on. Each result is keyed by its
+    benchmark, resolution & batch size, e.g. "inference/ARCH1/128/4", &
+    holds the median & minimum time of a call, in seconds.
+    Args:
+        groups (list of str): The groups in `BENCHMARKS` to run. Default is
+            all of them.
+        resolutions (iterable of int): The image sizes to run at.
+        batch_sizes (iterable of int): The batch sizes to run at.
+        n_runs (int): The number of timed runs of each benchmark.
+        log (callable): Optional function to report each result to.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for group in groups or BENCHMARKS:
+            for resolution in resolutions:
+                for batch_size in batch_sizes:
+                    cases = BENCHMARKS[group](resolution, batch_size, tmp_dir)
+                    for name, fn in cases:
+                        key = "{}/{}/{}".format(name, resolution, batch_size)
+                        results[key] = _time(fn, n_runs=n_runs)
+                        if log:
+                            log(key, results[key])
+
+    return {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "threads": torch.get_num_threads()
+        },
+        "results": results
+    }
+
+
+def compare(results, baseline, threshold=0.1, thresholds=None):
+    """
+    Compare benchmark results against a baseline. Returns the regressions,
+    as a list of (key, baseline time, time) for every benchmark whose
+    median time grew by more than its threshold. Benchmarks missing from
+    either side are skipped.
+    Args:
+        results (dict): The results, as returned by `run_suite()`.
+        baseline (dict): The baseline results, in the same format.
+        threshold (float): The relative slowdown we tolerate by default,
+            e.g. 0.1 for 10%.
+        thresholds (dict of float): Optional per-benchmark thresholds, by
+            key prefix, e.g. {"generate_dataset": 0.5}. The longest matching
+            prefix wins.
+    """
+    thresholds = thresholds or {}
+    regressions = []
+    for key, result in results["results"].items():
+        if key not in baseline["results"]:
+            continue
+
+        prefixes = [prefix for prefix in thresholds if key.startswith(prefix)]
+        limit = thresholds[max(prefixes, key=len)] if prefixes else threshold
+        before = baseline["results"][key]["median"]
+        if result["median"] > before * (1 + limit):
+            regressions.append((key, before, result["median"]))
+
+    return regressions
+
+
+def _threshold(value):
+    """
+    Parse a "prefix=threshold" argument.
+    """
+    prefix, _, threshold = value.rpartition("=")
+    if not prefix:
+        raise argparse.ArgumentTypeError(
+            "Expected PREFIX=THRESHOLD, e.g. train_step=0.25."
+        )
+
+    return prefix, float(threshold)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark data generation, loading, training & "
+        "inference, & compare against a baseline."
+    )
+    parser.add_argument(
+        "--groups",
+        nargs="+",
+        choices=BENCHMARKS,
+        help="The benchmark groups to run. Default is all of them."
+    )
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=int,
+        default=[64, 128]
+    )
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="CPU threads to use. Pinned by default, so that results are "
+        "comparable between machines with different core counts."
+    )
+    parser.add_argument("--out", help="The file to write the results to.")
+    parser.add_argument("--baseline", default=BASELINE_FNAME)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Save the results as the new baseline, rather than comparing."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="The relative slowdown to flag as a regression."
+    )
+    parser.add_argument(
+        "--benchmark-threshold",
+        action="append",
+        type=_threshold,
+        default=[],
+        metavar="PREFIX=THRESHOLD",
+        help="Override the threshold for benchmarks starting with PREFIX."
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Run the suite, returning a non-zero exit status if anything regressed.
+    """
+    args = parse_args(argv)
+    torch.set_num_threads(args.threads)
+    results = run_suite(
+        groups=args.groups,
+        resolutions=args.resolutions,
+        batch_sizes=args.batch_sizes,
+        n_runs=args.runs,
+        log=lambda key, result: print("{:<40} {:10.3f}ms".format(
+            key,
+            result["median"] * 1000
+        ))
+    )
+    if args.out:
+        with open(args.out, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fp:
+            json.dump(results, fp, indent=2)
+        print("Saved baseline to {}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        # Note, a missing baseline fails the run, rather than passing it
+        # without having checked anything.
+        print(
+            "No baseline at {0}, so there's nothing to compare against. "
+            "Record one on a quiet machine with `python -m benchmarks "
+            "--save-baseline --baseline {0}`, & commit it.".format(
+                args.baseline
+            )
+        )
+        return 1
+
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)
+
+    regressions = compare(
+        results=results,
+        baseline=baseline,
+        threshold=args.threshold,
+        thresholds=dict(args.benchmark_threshold)
+    )
+    for key, before, after in regressions:
+        print("REGRESSION {}: {:.3f}ms -> {:.3f}ms ({:+.0%})".format(
+            key,
+            before * 1000,
+            after * 1000,
+            after / before - 1
+        ))
+
+    return 1 if regressions else 0
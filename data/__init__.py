@@ -1,3 +1,9 @@
 from .generator import DSGenerator
 from .dataset import DeWatermarkerDataset
+from .shards import ShardReader, ShardWriter
+from .watermarks import WatermarkCache
+from .compositor import BatchCompositor
+from .synthetic import SyntheticDataset
+from .patches import PatchDataset
+from .transforms import DEFAULT_SCALE, ToTensorCollate
 
@@ -0,0 +1,194 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+
+from .watermarks import WatermarkCache
+
+
+class BatchCompositor:
+    """
+    Adds a watermark to a whole batch of same-sized images at once, with a
+    different position, opacity & scale for each image. Rather than pasting
+    image by image, we gather the region under each watermark into a single
+    array, & alpha-blend the whole batch in one vectorized pass.
+    """
+    DEFAULT_SCALE = 0.5
+    # Random scales are drawn from this many evenly spaced steps, so that
+    # resized watermarks are reused from `WATERMARK_CACHE`.
+    SCALE_STEPS = 8
+    WATERMARK_CACHE = WatermarkCache(maxsize=64)
+
+    @classmethod
+    def composite(
+        cls,
+        images,
+        watermark,
+        positions,
+        opacities=None,
+        scales=None,
+        resample=None
+    ):
+        """
+        Composite a watermark onto a batch of images. Returns the watermarked
+        images, along with the box each watermark ended up in, as rows of
+        (left, top, right, bottom).
+        Args:
+            images (ndarray): A (N, H, W, C) uint8 array of images, where C
+                is 3 (RGB) or 4 (RGBA). The array itself isn't modified.
+            watermark (Image): The watermark to add to each image.
+            positions (array-like): A (N, 2) array of the (x, y) position of
+                each watermark's top-left corner. Positions are clamped so
+                that each watermark lies entirely within its image.
+            opacities (array-like): Optional (N,) array of watermark
+                opacities, in [0, 1]. Default is fully opaque.
+            scales (array-like): Optional (N,) array of watermark scales.
+                Each watermark is resized to fit within this fraction of the
+                image's dimensions. Default is 0.5, as in `DSGenerator`.
+            resample (int): The resampling filter to resize watermarks with.
+        """
+        images = numpy.asarray(images)
+        if images.ndim != 4 or images.shape[-1] not in (3, 4):
+            raise ValueError("Expected a (N, H, W, 3 or 4) batch of images.")
+
+        n_images, height, width = images.shape[:3]
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        positions = positions.reshape(n_images, 2)
+        opacities = numpy.broadcast_to(
+            numpy.asarray(1 if opacities is None else opacities, numpy.float32),
+            (n_images,)
+        )
+        scales = numpy.broadcast_to(
+            cls.DEFAULT_SCALE if scales is None else scales,
+            (n_images,)
+        )
+
+        # Resize the watermark once per distinct scale, & stack the resized
+        # watermarks, padded with transparency up to the largest of them.
+        layers, sizes, variants = cls._watermark_layers(
+            watermark=watermark,
+            image_size=(width, height),
+            scales=scales,
+            resample=resample
+        )
+        _, wm_height, wm_width, _ = layers.shape
+        sizes = sizes[variants]
+
+        left = numpy.clip(positions[:, 0], 0, width - sizes[:, 0])
+        top = numpy.clip(positions[:, 1], 0, height - sizes[:, 1])
+        boxes = numpy.stack([left, top, left + sizes[:, 0], top + sizes[:, 1]])
+
+        # Gather the (wm_height, wm_width) window under each watermark. Only
+        # the transparent padding can hang over the edge of an image, so we
+        # clamp it to the edge when gathering, & drop it when scattering.
+        rows = top[:, None] + numpy.arange(wm_height)
+        cols = left[:, None] + numpy.arange(wm_width)
+        inside = (rows < height)[:, :, None] & (cols < width)[:, None, :]
+        batch = numpy.arange(n_images)[:, None, None]
+        rows = numpy.minimum(rows, height - 1)[:, :, None]
+        cols = numpy.minimum(cols, width - 1)[:, None, :]
+        windows = images[batch, rows, cols, :3].astype(numpy.float32)
+
+        layers = layers[variants]
+        alpha = layers[..., 3:] * (opacities[:, None, None, None] / 255)
+        windows += alpha * (layers[..., :3] - windows)
+        blended = numpy.rint(windows).astype(numpy.uint8)
+
+        watermarked = images.copy()
+        batch, rows, cols = numpy.broadcast_arrays(batch, rows, cols)
+        watermarked[batch[inside], rows[inside], cols[inside], :3] = \
+            blended[inside]
+
+        return watermarked, boxes.T
+
+    @classmethod
+    def random_placements(
+        cls,
+        n_images,
+        image_size,
+        rng=None,
+        scale_range=(0.25, 0.5),
+        opacity_range=(0.5, 1.0),
+        scale_steps=None
+    ):
+        """
+        Sample random watermark positions, opacities & scales for a batch,
+        for use with `composite()`.
+        Args:
+            n_images (int): The number of images in the batch.
+            image_size (tuple of int): The (width, height) of the images.
+            rng (Generator): Optional NumPy random generator to sample with.
+            scale_range (tuple of float): The range to sample scales from.
+            opacity_range (tuple of float): The range to sample opacities from.
+            scale_steps (int): The number of evenly spaced scales across the
+                range to sample from. Default is `SCALE_STEPS`. Note, with 0
+                scales are continuous, so every watermark is resized afresh,
+                bypassing `WATERMARK_CACHE`.
+        """
+        rng = rng or numpy.random.default_rng()
+        width, height = image_size
+        scale_steps = cls.SCALE_STEPS if scale_steps is None else scale_steps
+        if scale_steps:
+            steps = numpy.linspace(*scale_range, num=scale_steps)
+            scales = steps[rng.integers(scale_steps, size=n_images)]
+        else:
+            scales = rng.uniform(*scale_range, size=n_images)
+        opacities = rng.uniform(*opacity_range, size=n_images)
+
+        # A watermark at scale `s` is at most `s` of the image along each
+        # dimension, so this is the range of positions where it will fit.
+        max_positions = numpy.stack([width, height]) * (1 - scales[:, None])
+        positions = rng.uniform(size=(n_images, 2)) * (max_positions + 1)
+        return positions.astype(numpy.int64), opacities, scales
+
+    @classmethod
+    def _watermark_layers(cls, watermark, image_size, scales, resample):
+        """
+        Build a (K, h, w, 4) stack of the watermark, resized for each of the
+        K distinct scales. Returns the stack as float32, the (width, height)
+        of each resized watermark, & which layer each scale maps to.
+        """
+        width, height = image_size
+        unique_scales, variants = numpy.unique(scales, return_inverse=True)
+        resized = [
+            numpy.asarray(cls.WATERMARK_CACHE.get(
+                watermark=watermark,
+                dim_boundary=(
+                    max(int(width * scale), 1),
+                    max(int(height * scale), 1)
+                ),
+                resize_ratio=1,
+                resample=resample
+            )[0])
+            for scale in unique_scales
+        ]
+
+        sizes = numpy.array([(wm.shape[1], wm.shape[0]) for wm in resized])
+        layers = numpy.zeros(
+            (len(resized), sizes[:, 1].max(), sizes[:, 0].max(), 4),
+            dtype=numpy.float32
+        )
+        for layer, wm in zip(layers, resized):
+            layer[:wm.shape[0], :wm.shape[1]] = wm
+
+        return layers, sizes, variants.reshape(-1)
@@ -21,10 +21,13 @@
 # SOFTWARE.
 # ================================================================
 
+import os
 import _pickle as cPickle
 
 from torch.utils.data import Dataset
 
+from .shards import ShardReader
+
 
 class DeWatermarkerDataset(Dataset):
     """
@@ -34,14 +37,18 @@ class DeWatermarkerDataset(Dataset):
     def __init__(self, root_dir, transform=None):
         """
         Args:
-            root_dir ()
+            root_dir (str): Either a sharded dataset directory, which we'll
+                memory-map, or a pickled dataset file.
             transform (callable): Optional ransform function to apply
                 to samples.
         """
         self.root_dir = root_dir
         self.transform = transform
-        with open(root_dir, "rb") as fp:
-            self.dewatermarker_frame = cPickle.load(fp)
+        if os.path.isdir(root_dir):
+            self.dewatermarker_frame = ShardReader(root_dir=root_dir)
+        else:
+            with open(root_dir, "rb") as fp:
+                self.dewatermarker_frame = cPickle.load(fp)
 
     def __len__(self):
         return len(self.dewatermarker_frame)
@@ -21,12 +21,54 @@
 # SOFTWARE.
 # ================================================================
 
+import collections
 import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
 import numpy
 import _pickle as cPickle
 
 from PIL import Image
 
+from .shards import (
+    INDEX_FNAME,
+    ShardReader,
+    ShardWriter,
+    fsync_dir,
+    remove_unreferenced_shards,
+    write_shard
+)
+from .watermarks import WatermarkCache
+
+
+# Per-process state for parallel dataset generation. This is set once per
+# worker, so that we don't re-send the watermark with every batch.
+_worker_state = {}
+
+
+def _init_worker(generator, watermark):
+    _worker_state["generator"] = generator
+    _worker_state["watermark"] = watermark
+
+
+def _generate_shard(images, fname):
+    """
+    Generate the datapoints for a batch of images, & write them straight
+    to the given (reserved) shard file.
+    """
+    generator = _worker_state["generator"]
+    datapoints = (
+        generator._generate_datapoint(
+            watermark=_worker_state["watermark"],
+            image=generator._load_image(image=image)
+        )
+        for image in images
+    )
+    return write_shard(fname=fname, datapoints=datapoints)
+
 
 class DSGenerator:
     """
@@ -35,10 +77,15 @@ class DSGenerator:
     """
     RESAMPLING_FILTER = Image.BICUBIC
     TRAINING_FNAME = "data/training/set.pkl"
+    TRAINING_DIR = "data/training/set"
+    MANIFEST_FNAME = "manifest.json"
     WATERMARK_PREFIX = "wm"
+    WATERMARK_POSITION = (0, 0)
+    RESIZE_RATIO = 2
+    WATERMARK_CACHE = WatermarkCache(maxsize=32)
 
     @classmethod
-    def generate_dataset(cls, watermark, images):
+    def generate_dataset(cls, watermark, images, sharded=False):
         """
         Generate a dataset for the given watermark on the given images.
         Each entry in our dataset will consist of two elements -- the
@@ -48,23 +95,318 @@ class DSGenerator:
             watermark (Image): The watermark to generate the dataset for.
             images (list of Image): The images that will make up our
                 new dataset.
+            sharded (bool): Whether to save the dataset in the sharded,
+                memory-mappable format, rather than as a single pickle.
         """
         # Create a dataset, and save it.
         training_set = []
         for image in images:
-            raw_image = copy.deepcopy(image)
-            watermarked_image = cls._add_watermark(
+            datapoint = cls._generate_datapoint(
                 watermark=watermark,
-                image=raw_image
+                image=image
             )
+            training_set.append(datapoint)
+
+        if sharded:
+            cls._save_shards(dataset=training_set, root_dir=cls.TRAINING_DIR)
+        else:
+            cls._save_dataset(dataset=training_set, fname=cls.TRAINING_FNAME)
 
-            datapoint = cls._create_datapoint(
-                watermarked=watermarked_image,
-                original=image
+    @classmethod
+    def generate_stream(
+        cls,
+        watermark,
+        images,
+        root_dir=None,
+        batch_size=64,
+        workers=1
+    ):
+        """
+        Generate a dataset for the given watermark, streaming each datapoint
+        to a sharded dataset on disk as soon as it's created. Unlike
+        `generate_dataset()`, we only ever hold one image in memory, and
+        if we're interrupted, calling this again with the same images will
+        resume from the last committed datapoint.
+        Args:
+            watermark (Image): The watermark to generate the dataset for.
+            images (iterable of Image or str): The images, or paths to the
+                images, that will make up our dataset.
+            root_dir (str): The sharded dataset directory to write to.
+                Defaults to `TRAINING_DIR`.
+            batch_size (int): The number of datapoints to write between
+                commits. This bounds how much work an interruption can lose.
+            workers (int): The number of processes to generate datapoints
+                with. Note, the output is identical no matter how many
+                workers we use.
+        """
+        root_dir = root_dir or cls.TRAINING_DIR
+        with ShardWriter(root_dir=root_dir) as writer:
+            # Skip over any images we've already committed datapoints for.
+            images = itertools.islice(images, writer.n_committed, None)
+            if workers > 1:
+                cls._generate_parallel(
+                    watermark=watermark,
+                    images=images,
+                    writer=writer,
+                    batch_size=batch_size,
+                    workers=workers
+                )
+                return len(writer)
+
+            for image in images:
+                image = cls._load_image(image=image)
+                datapoint = cls._generate_datapoint(
+                    watermark=watermark,
+                    image=image
+                )
+                writer.write(datapoint)
+                if len(writer) - writer.n_committed >= batch_size:
+                    writer.commit()
+
+            return len(writer)
+
+    @classmethod
+    def _generate_parallel(
+        cls,
+        watermark,
+        images,
+        writer,
+        batch_size,
+        workers
+    ):
+        """
+        Generate datapoints across a pool of processes. Each batch of images
+        gets its own reserved shard, which the worker decodes, watermarks &
+        writes directly, so only image paths & index records ever pass
+        through this process. Batches are committed in submission order, so
+        the dataset is laid out exactly as it would be serially.
+        Args:
+            watermark (Image): The watermark to generate the dataset for.
+            images (iterable of Image or str): The images to generate from.
+            writer (ShardWriter): The dataset to write to.
+            batch_size (int): The number of images in each shard.
+            workers (int): The number of processes to use.
+        """
+        images = iter(images)
+        batches = iter(lambda: list(itertools.islice(images, batch_size)), [])
+        with multiprocessing.Pool(
+            processes=workers,
+            initializer=_init_worker,
+            initargs=(cls, watermark)
+        ) as pool:
+            # We keep a bounded number of batches in flight, so we never
+            # pull more of `images` into memory than the workers can use.
+            in_flight = collections.deque()
+            for batch in batches:
+                shard, fname = writer.reserve_shard()
+                result = pool.apply_async(_generate_shard, (batch, fname))
+                in_flight.append((shard, result))
+                if len(in_flight) >= 2 * workers:
+                    shard, result = in_flight.popleft()
+                    writer.add_shard(shard=shard, records=result.get())
+                    writer.commit()
+
+            while in_flight:
+                shard, result = in_flight.popleft()
+                writer.add_shard(shard=shard, records=result.get())
+                writer.commit()
+
+    @classmethod
+    def update_dataset(
+        cls,
+        watermark,
+        images,
+        root_dir=None,
+        hash_contents=True
+    ):
+        """
+        Bring a sharded dataset up to date with the given watermark &
+        images, only generating the datapoints whose inputs have changed.
+        Each datapoint is keyed by a hash of everything that went into it
+        (the watermark, the image & our generation parameters), & these
+        keys are kept in a manifest next to the dataset. Datapoints whose
+        key is already in the manifest are reused as they are on disk.
+        Returns the number of datapoints reused, & the number generated.
+        Args:
+            watermark (Image): The watermark to generate the dataset for.
+            images (iterable of Image or str): The images, or paths to the
+                images, that will make up our dataset.
+            root_dir (str): The sharded dataset directory to update.
+                Defaults to `TRAINING_DIR`.
+            hash_contents (bool): Whether to key image files by their
+                contents. If not, we'll key them by their path, size &
+                modification time, which is cheaper, but less robust.
+        """
+        root_dir = root_dir or cls.TRAINING_DIR
+        images = list(images)
+        params_key = cls._params_key(watermark=watermark)
+        keys = [
+            cls._datapoint_key(
+                image=image,
+                params_key=params_key,
+                hash_contents=hash_contents
             )
-            training_set.append(datapoint)
+            for image in images
+        ]
+
+        # The index & manifest can't be replaced in one atomic step, so the
+        # manifest records a hash of the index it describes. If we crashed
+        # between replacing the two, they won't match, & we can't trust
+        # the manifest, so we regenerate everything.
+        manifest_fname = os.path.join(root_dir, cls.MANIFEST_FNAME)
+        index_fname = os.path.join(root_dir, INDEX_FNAME)
+        old_keys = []
+        if os.path.exists(manifest_fname):
+            with open(manifest_fname) as fp:
+                manifest = json.load(fp)
+            if manifest.get("index") == cls._index_key(index_fname):
+                old_keys = manifest["keys"]
 
-        cls._save_dataset(dataset=training_set, fname=cls.TRAINING_FNAME)
+        old_records = numpy.empty(0)
+        if os.path.exists(index_fname):
+            old_records = numpy.array(ShardReader(root_dir).index)
+        old_keys = old_keys[:len(old_records)]
+        if old_keys == keys:
+            return len(keys), 0
+
+        # Build the new index alongside the old one, writing any new data
+        # to fresh shards, so that the old dataset stays intact until we
+        # swap the new index in. The writer only creates a shard once it
+        # has something to write to it.
+        old_datapoints = {key: index for index, key in enumerate(old_keys)}
+        new_index_name = INDEX_FNAME + ".new"
+        new_index_fname = os.path.join(root_dir, new_index_name)
+        if os.path.exists(new_index_fname):
+            os.remove(new_index_fname)
+
+        first_shard = 0
+        if len(old_records):
+            first_shard = int(old_records["shard"].max()) + 1
+        n_reused = 0
+        with ShardWriter(
+            root_dir=root_dir,
+            index_name=new_index_name,
+            first_shard=first_shard
+        ) as writer:
+            for key, image in zip(keys, images):
+                if key in old_datapoints:
+                    writer.add_records([old_records[old_datapoints[key]]])
+                    n_reused += 1
+                    continue
+
+                datapoint = cls._generate_datapoint(
+                    watermark=watermark,
+                    image=cls._load_image(image=image)
+                )
+                writer.write(datapoint)
+
+        with open(manifest_fname + ".new", "w") as fp:
+            json.dump({
+                "params": params_key,
+                "keys": keys,
+                "index": cls._index_key(new_index_fname)
+            }, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(new_index_fname, index_fname)
+        os.replace(manifest_fname + ".new", manifest_fname)
+        fsync_dir(root_dir)
+        # Only now that the new index is in place can we drop the shards
+        # it no longer points into.
+        remove_unreferenced_shards(root_dir)
+
+        return n_reused, len(keys) - n_reused
+
+    @classmethod
+    def _params_key(cls, watermark):
+        """
+        Hash the watermark, & every parameter that affects how we add it
+        to an image.
+        Args:
+            watermark (Image): The watermark to generate the dataset for.
+        """
+        params = (
+            int(cls.RESAMPLING_FILTER),
+            cls.RESIZE_RATIO,
+            cls.WATERMARK_POSITION,
+            watermark.mode,
+            watermark.size
+        )
+        digest = hashlib.sha256(repr(params).encode())
+        digest.update(watermark.tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def _index_key(cls, fname):
+        """
+        Hash the contents of an index file, if there is one.
+        """
+        if not os.path.exists(fname):
+            return None
+
+        with open(fname, "rb") as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+
+    @classmethod
+    def _datapoint_key(cls, image, params_key, hash_contents=True):
+        """
+        Hash all of the inputs to a single datapoint.
+        Args:
+            image (Image or str): The image, or a path to it.
+            params_key (str): The key from `_params_key()`.
+            hash_contents (bool): Whether to hash an image file's contents,
+                rather than its path, size & modification time.
+        """
+        digest = hashlib.sha256(params_key.encode())
+        if not isinstance(image, (str, os.PathLike)):
+            digest.update(repr((image.mode, image.size)).encode())
+            digest.update(image.tobytes())
+        elif hash_contents:
+            with open(image, "rb") as fp:
+                for chunk in iter(lambda: fp.read(2 ** 20), b""):
+                    digest.update(chunk)
+        else:
+            stat = os.stat(image)
+            digest.update(repr(
+                (os.path.abspath(image), stat.st_size, stat.st_mtime_ns)
+            ).encode())
+
+        return digest.hexdigest()
+
+    @classmethod
+    def _load_image(cls, image):
+        """
+        Load an image, if we've been given a path to one.
+        Args:
+            image (Image or str): The image, or a path to it.
+        """
+        if isinstance(image, (str, os.PathLike)):
+            with Image.open(image) as fp:
+                fp.load()
+                return fp
+
+        return image
+
+    @classmethod
+    def _generate_datapoint(cls, watermark, image):
+        """
+        Create a single datapoint, by adding the watermark to a copy of
+        the given image.
+        Args:
+            watermark (Image): The watermark to add.
+            image (Image): The original image.
+        """
+        raw_image = copy.deepcopy(image)
+        watermarked_image = cls._add_watermark(
+            watermark=watermark,
+            image=raw_image
+        )
+
+        return cls._create_datapoint(
+            watermarked=watermarked_image,
+            original=image,
+            box=cls._watermark_box(watermark=watermark, image=image)
+        )
 
     @classmethod
     def _add_watermark(cls, watermark, image):
@@ -76,24 +418,42 @@ class DSGenerator:
         """
         # We'll need to resize our logo to ensure that it actually fits
         # on the given image.
-        cls._resize_watermark(
+        watermark, mask = cls._resize_watermark(
             watermark=watermark,
             dim_boundary=image.size,
-            resize_ratio=2
+            resize_ratio=cls.RESIZE_RATIO
         )
 
         # TODO: Perform this step with variable positions, rather than
-        # one hard set.
-        POSITION = (0, 0)
-        image.paste(im=watermark, box=POSITION, mask=watermark)
+        # one hard set. See `BatchCompositor` for a vectorized version.
+        image.paste(im=watermark, box=cls.WATERMARK_POSITION, mask=mask)
         return image
 
+    @classmethod
+    def _watermark_box(cls, watermark, image):
+        """
+        Get the box (left, top, right, bottom) that `_add_watermark()` adds
+        the watermark to the given image in.
+        Args:
+            watermark (Image): The watermark being added.
+            image (Image): The image it's being added to.
+        """
+        resized, _ = cls._resize_watermark(
+            watermark=watermark,
+            dim_boundary=image.size,
+            resize_ratio=cls.RESIZE_RATIO
+        )
+        left, top = cls.WATERMARK_POSITION
+        return (left, top, left + resized.width, top + resized.height)
+
     @classmethod
     def _resize_watermark(cls, watermark, dim_boundary, resize_ratio=2):
         """
         Resize the given watermark so that it fits within a set target
         dimension. Note, we'll want to ensure that we keep the aspect
-        ratio of the watermark.
+        ratio of the watermark. Returns the resized watermark (as RGBA),
+        & its alpha mask. Resized watermarks are cached per target size,
+        & the given watermark is never modified.
         Args:
             watermark (Image): The watermark to resize.
             dim_boundary (tuple of int): These are just the dimensions of
@@ -106,20 +466,23 @@ class DSGenerator:
         # defacto standard, Lanczos resampling, as the trade-off between
         # quality and speed simply makes sense. We don't need super HD
         # watermarks, and we __do__ want fast dataset generation.
-        max_width, max_height = dim_boundary
-        watermark.thumbnail(
-            size=(max_width // resize_ratio, max_height // resize_ratio),
+        return cls.WATERMARK_CACHE.get(
+            watermark=watermark,
+            dim_boundary=dim_boundary,
+            resize_ratio=resize_ratio,
             resample=cls.RESAMPLING_FILTER
         )
 
-        return watermark
-
     @classmethod
-    def _create_datapoint(cls, watermarked, original):
-        return {
+    def _create_datapoint(cls, watermarked, original, box=None):
+        datapoint = {
             "watermarked": numpy.asarray(watermarked),
             "original": numpy.asarray(original)
         }
+        if box is not None:
+            datapoint["box"] = numpy.array(box)
+
+        return datapoint
 
     @classmethod
     def _save_dataset(cls, dataset, fname):
@@ -134,3 +497,17 @@ class DSGenerator:
         """
         with open(fname, "wb") as fp:
             cPickle.dump(dataset, fp)
+
+    @classmethod
+    def _save_shards(cls, dataset, root_dir):
+        """
+        Save a dataset in the sharded format, replacing any existing dataset
+        in the given directory.
+        Args:
+            dataset (list of dict of ndarray): A list of datapoints, where
+                each contains a watermarked image, and its original.
+            root_dir (str): The directory to save the dataset to.
+        """
+        with ShardWriter(root_dir=root_dir, overwrite=True) as writer:
+            for datapoint in dataset:
+                writer.write(datapoint)
@@ -0,0 +1,127 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+
+from torch.utils.data import Dataset
+
+
+class PatchDataset(Dataset):
+    """
+    Wraps a DeWatermarker dataset, returning fixed-size random crops of
+    its datapoints rather than whole images. Training on patches keeps the
+    memory & time of a step the same no matter the image resolution, which
+    lets us train with much larger batches.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        patch_size=128,
+        watermark_bias=0.5,
+        patches_per_sample=1,
+        seed=0
+    ):
+        """
+        Args:
+            dataset (Dataset): The dataset to crop patches from. Datapoints
+                with a "box" are biased towards patches of their watermark.
+            patch_size (int or tuple of int): The (height, width) of each
+                patch, or a single size for square patches.
+            watermark_bias (float): The probability that a patch is chosen to
+                overlap the watermark, rather than uniformly over the image.
+            patches_per_sample (int): The number of patches to take from
+                each datapoint in an epoch.
+            seed (int): The seed that every patch's seed is derived from.
+        """
+        if isinstance(patch_size, int):
+            patch_size = (patch_size, patch_size)
+
+        self.dataset = dataset
+        self.patch_size = tuple(patch_size)
+        self.watermark_bias = watermark_bias
+        self.patches_per_sample = patches_per_sample
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.dataset) * self.patches_per_sample
+
+    def __getitem__(self, index):
+        """
+        Get a patch of a datapoint.
+        Args:
+            index (int): The index of the patch we're accessing.
+        """
+        sample = self.dataset[index // self.patches_per_sample]
+        height, width = sample["watermarked"].shape[:2]
+        patch_height, patch_width = self.patch_size
+        if height < patch_height or width < patch_width:
+            raise ValueError(
+                "Datapoint {} is smaller than the patch size.".format(index)
+            )
+
+        rng = numpy.random.default_rng([self.seed, self.epoch, index])
+        box = sample.get("box")
+        if box is not None and rng.uniform() < self.watermark_bias:
+            left, top, right, bottom = (int(edge) for edge in box)
+            y = self._sample_overlapping(rng, top, bottom, patch_height, height)
+            x = self._sample_overlapping(rng, left, right, patch_width, width)
+        else:
+            y = int(rng.integers(height - patch_height + 1))
+            x = int(rng.integers(width - patch_width + 1))
+
+        patch = {
+            key: sample[key][y:y + patch_height, x:x + patch_width]
+            for key in ("watermarked", "original")
+        }
+        if box is not None:
+            # Move the box into the patch's coordinates. Note, if the patch
+            # doesn't overlap the watermark, this will be an empty box.
+            box = numpy.asarray(box) - [x, y, x, y]
+            patch["box"] = numpy.clip(box, 0, [patch_width, patch_height] * 2)
+
+        return patch
+
+    def set_epoch(self, epoch):
+        """
+        Move on to a new epoch, so that we take a fresh set of patches.
+        Args:
+            epoch (int): The epoch we're about to start.
+        """
+        self.epoch = epoch
+        if hasattr(self.dataset, "set_epoch"):
+            self.dataset.set_epoch(epoch)
+
+    @classmethod
+    def _sample_overlapping(cls, rng, start, end, patch_length, length):
+        """
+        Sample a patch offset along one dimension, such that the patch
+        overlaps [start, end). If no such offset exists, sample uniformly.
+        """
+        low = max(start - patch_length + 1, 0)
+        high = min(end - 1, length - patch_length)
+        if low > high:
+            low, high = 0, length - patch_length
+
+        return int(rng.integers(low, high + 1))
@@ -0,0 +1,540 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import glob
+import os
+
+import numpy
+
+
+# On-disk layout of a sharded dataset. A dataset is a directory holding a
+# number of raw uint8 shard files, plus an index file of a header followed
+# by fixed-size records. Each record points at a single datapoint, where the watermarked
+# image is stored at `offset`, and the original immediately after it. The
+# record also holds the box the watermark was added in, if it's known.
+INDEX_FNAME = "index.bin"
+SHARD_FNAME = "shard-{:05d}.bin"
+SHARD_GLOB = "shard-*.bin"
+RECORD_DTYPE = numpy.dtype([
+    ("shard", "<i8"),
+    ("offset", "<i8"),
+    ("height", "<i8"),
+    ("width", "<i8"),
+    ("channels", "<i8"),
+    ("left", "<i8"),
+    ("top", "<i8"),
+    ("right", "<i8"),
+    ("bottom", "<i8")
+])
+NO_BOX = (-1, -1, -1, -1)
+
+# The index starts with a header, holding the version of the record layout
+# it was written with. The first version had no header, & no watermark
+# box, so its records are only the first 5 fields.
+INDEX_MAGIC = b"DWSHARDS"
+INDEX_VERSION = 2
+HEADER_DTYPE = numpy.dtype([("magic", "S8"), ("version", "<i8")])
+V1_RECORD_DTYPE = numpy.dtype(RECORD_DTYPE.descr[:5])
+
+
+def fsync_dir(path):
+    """
+    Sync a directory, so that files created, renamed or removed in it are
+    durable, & not only their contents.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def remove_unreferenced_shards(root_dir, index_name=INDEX_FNAME):
+    """
+    Delete the shards of a dataset that none of its index's records point
+    into, e.g. those left behind once an updated index has replaced the
+    old one. Returns the number of shards deleted.
+    Args:
+        root_dir (str): The dataset directory.
+        index_name (str): The name of the index file.
+    """
+    index_fname = os.path.join(root_dir, index_name)
+    _check_version(index_fname)
+    records = numpy.fromfile(
+        index_fname,
+        dtype=RECORD_DTYPE,
+        offset=HEADER_DTYPE.itemsize
+    )
+    referenced = {
+        SHARD_FNAME.format(shard) for shard in numpy.unique(records["shard"])
+    }
+
+    n_removed = 0
+    for fname in glob.glob(os.path.join(root_dir, SHARD_GLOB)):
+        if os.path.basename(fname) not in referenced:
+            os.remove(fname)
+            n_removed += 1
+
+    if n_removed:
+        fsync_dir(root_dir)
+    return n_removed
+
+
+def _index_header():
+    return numpy.array([(INDEX_MAGIC, INDEX_VERSION)], HEADER_DTYPE).tobytes()
+
+
+def index_version(fname):
+    """
+    Get the version of the record layout the given index was written with.
+    An index too short to hold a header is empty, so it's as good as the
+    current version.
+    """
+    with open(fname, "rb") as fp:
+        header = fp.read(HEADER_DTYPE.itemsize)
+    if len(header) < HEADER_DTYPE.itemsize:
+        return INDEX_VERSION
+    if not header.startswith(INDEX_MAGIC):
+        return 1
+
+    return int(numpy.frombuffer(header, dtype=HEADER_DTYPE)["version"][0])
+
+
+def _check_version(fname):
+    """
+    Refuse to read or append to an index with a record layout other than
+    the current one, as its records would be misread.
+    """
+    version = index_version(fname)
+    if version == 1:
+        raise ValueError(
+            "{} was written with an older record layout. Upgrade it with "
+            "`data.shards.migrate_index()`.".format(fname)
+        )
+    if version != INDEX_VERSION:
+        raise ValueError(
+            "{} has unsupported record layout version {}.".format(
+                fname,
+                version
+            )
+        )
+
+
+def migrate_index(root_dir):
+    """
+    Upgrade a dataset's index from an older record layout to the current
+    one, in place. Only the index is rewritten, as the shards' layout
+    hasn't changed. Returns whether the index needed upgrading.
+    Args:
+        root_dir (str): The dataset directory to upgrade.
+    """
+    fname = os.path.join(root_dir, INDEX_FNAME)
+    version = index_version(fname)
+    if version == INDEX_VERSION:
+        return False
+    if version != 1:
+        _check_version(fname)
+
+    # Any partial record at the end was never committed, so it's dropped.
+    n_records = os.path.getsize(fname) // V1_RECORD_DTYPE.itemsize
+    old_records = numpy.fromfile(
+        fname,
+        dtype=V1_RECORD_DTYPE,
+        count=n_records
+    )
+    records = numpy.empty(n_records, dtype=RECORD_DTYPE)
+    for field in V1_RECORD_DTYPE.names:
+        records[field] = old_records[field]
+    for field, edge in zip(("left", "top", "right", "bottom"), NO_BOX):
+        records[field] = edge
+
+    with open(fname + ".new", "wb") as fp:
+        fp.write(_index_header())
+        fp.write(records.tobytes())
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(fname + ".new", fname)
+    fsync_dir(root_dir)
+    return True
+
+
+def _record_shape(record):
+    """
+    Get the array shape described by an index record. Note, single channel
+    images are stored with `channels == 0`, as they have no channel axis.
+    """
+    height, width = int(record["height"]), int(record["width"])
+    channels = int(record["channels"])
+    if channels == 0:
+        return (height, width)
+
+    return (height, width, channels)
+
+
+def _write_datapoint(fp, datapoint):
+    """
+    Serialize a datapoint to the given file, returning the image dimensions
+    & watermark box to record in the index.
+    """
+    watermarked = numpy.ascontiguousarray(datapoint["watermarked"])
+    original = numpy.ascontiguousarray(datapoint["original"])
+    if watermarked.dtype != numpy.uint8 or original.dtype != numpy.uint8:
+        raise ValueError("Sharded datasets only support uint8 images.")
+    if watermarked.shape != original.shape:
+        raise ValueError(
+            "Watermarked & original images must have the same shape."
+        )
+    if watermarked.ndim not in (2, 3):
+        raise ValueError("Expected a 2D or 3D image array.")
+
+    fp.write(watermarked.data)
+    fp.write(original.data)
+    height, width = watermarked.shape[:2]
+    channels = watermarked.shape[2] if watermarked.ndim == 3 else 0
+    box = datapoint.get("box")
+    box = NO_BOX if box is None else tuple(int(edge) for edge in box)
+    return (height, width, channels) + box
+
+
+def write_shard(fname, datapoints):
+    """
+    Write a complete shard file, returning its records (without the shard
+    number) for `ShardWriter.add_shard()`. The file is synced to disk
+    before we return, so that it's safe to commit the records.
+    Args:
+        fname (str): The shard file to write.
+        datapoints (iterable of dict of ndarray): The datapoints to write.
+    """
+    records = []
+    with open(fname, "wb") as fp:
+        for datapoint in datapoints:
+            offset = fp.tell()
+            records.append((offset,) + _write_datapoint(fp, datapoint))
+
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    return records
+
+
+def _record_nbytes(records):
+    """
+    Get the size of a single image, for each of the given index records.
+    """
+    channels = numpy.maximum(records["channels"], 1)
+    return records["height"] * records["width"] * channels
+
+
+class ShardWriter:
+    """
+    Writes datapoints to a sharded, memory-mappable dataset directory.
+    Datapoints are appended to the current shard until it's full, and only
+    become visible to readers once they've been committed to the index.
+    """
+    SHARD_SIZE = 256 * 2 ** 20
+
+    def __init__(
+        self,
+        root_dir,
+        shard_size=None,
+        overwrite=False,
+        index_name=INDEX_FNAME,
+        first_shard=0
+    ):
+        """
+        Args:
+            root_dir (str): The dataset directory to write to.
+            shard_size (int): Optional maximum size of a shard, in bytes.
+                A datapoint larger than this will get a shard to itself.
+            overwrite (bool): Whether to discard any existing dataset in
+                `root_dir`. By default we'll append to it.
+            index_name (str): The name of the index file to write. This is
+                only needed to build a new index next to an existing one.
+            first_shard (int): The shard to start writing to, if the index
+                is empty.
+        """
+        self.root_dir = root_dir
+        self.shard_size = shard_size or self.SHARD_SIZE
+        self.index_fname = os.path.join(root_dir, index_name)
+        os.makedirs(root_dir, exist_ok=True)
+        if overwrite:
+            self._remove_dataset()
+
+        self._pending = []
+        self._n_committed = self._recover(first_shard=first_shard)
+        # The current shard is only opened once there's data to write to it,
+        # so that a writer that only reuses records leaves no empty shard.
+        self._fp = None
+
+    def __len__(self):
+        return self._n_committed + len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def n_committed(self):
+        return self._n_committed
+
+    def write(self, datapoint):
+        """
+        Append a datapoint to the dataset. Note, it won't be visible until
+        the next call to `commit()`.
+        Args:
+            datapoint (dict of ndarray): A datapoint containing a watermarked
+                image, and its original.
+        """
+        # Start a new shard if this datapoint would overflow the current one.
+        nbytes = 2 * numpy.asarray(datapoint["watermarked"]).nbytes
+        if self._offset and self._offset + nbytes > self.shard_size:
+            self._next_shard()
+        if self._fp is None:
+            self._fp = open(self._shard_fname(self._shard), "ab")
+
+        dims = _write_datapoint(fp=self._fp, datapoint=datapoint)
+        self._pending.append((self._shard, self._offset) + dims)
+        self._offset += nbytes
+
+    def reserve_shard(self):
+        """
+        Reserve a new shard to be filled outside of this writer, e.g. by
+        another process using `write_shard()`. The reserved shard's records
+        are added with `add_shard()`, and anything written with `write()`
+        afterwards will go to a later shard.
+        """
+        self._close_shard()
+        self._shard += 1
+        self._offset = self.shard_size
+        return self._shard, self._shard_fname(self._shard)
+
+    def add_shard(self, shard, records):
+        """
+        Append the datapoints of a reserved shard to the dataset. As with
+        `write()`, they won't be visible until the next call to `commit()`.
+        Args:
+            shard (int): The reserved shard, as returned by `reserve_shard()`.
+            records (list of tuple): The records returned by `write_shard()`.
+        """
+        self.add_records((shard,) + tuple(record) for record in records)
+
+    def add_records(self, records):
+        """
+        Append existing index records to the dataset, e.g. to reuse data
+        that's already in one of its shards. As with `write()`, they won't be
+        visible until the next call to `commit()`.
+        Args:
+            records (iterable of tuple): Complete index records.
+        """
+        self._pending.extend(tuple(record) for record in records)
+
+    def commit(self):
+        """
+        Make all datapoints written so far durable, and visible to readers.
+        The shard data is always synced before the index records that point
+        at it, so a crash can never leave the index referencing missing data.
+        """
+        if not self._pending:
+            return self._n_committed
+
+        if self._fp is not None and not self._fp.closed:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+        records = numpy.array(self._pending, dtype=RECORD_DTYPE)
+        with open(self.index_fname, "ab") as fp:
+            fp.write(records.tobytes())
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        # New shards & the index may have only just been created, so their
+        # directory entries need syncing too.
+        fsync_dir(self.root_dir)
+
+        self._n_committed += len(self._pending)
+        self._pending = []
+        return self._n_committed
+
+    def close(self):
+        """
+        Commit any pending datapoints, and close the current shard.
+        """
+        self.commit()
+        if self._fp is not None:
+            self._fp.close()
+
+    def _shard_fname(self, shard):
+        return os.path.join(self.root_dir, SHARD_FNAME.format(shard))
+
+    def _close_shard(self):
+        """
+        Close the current shard. Pending records may still point into it,
+        so its data is synced first, as `commit()` only syncs the shard
+        we're writing to.
+        """
+        if self._fp is not None and not self._fp.closed:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._fp.close()
+
+    def _next_shard(self):
+        self._close_shard()
+        self._shard += 1
+        self._offset = 0
+        self._fp = open(self._shard_fname(self._shard), "wb")
+
+    def _recover(self, first_shard):
+        """
+        Pick up from the end of the committed data of an existing dataset.
+        Anything written after it (i.e. a partial index record, or shard
+        data that was never committed) is discarded.
+        """
+        n_committed = 0
+        self._shard, self._offset = first_shard, 0
+        header_size = HEADER_DTYPE.itemsize
+        if os.path.exists(self.index_fname) and \
+                os.path.getsize(self.index_fname) >= header_size:
+            _check_version(self.index_fname)
+            n_committed = os.path.getsize(self.index_fname) - header_size
+            n_committed //= RECORD_DTYPE.itemsize
+            os.truncate(
+                self.index_fname,
+                header_size + n_committed * RECORD_DTYPE.itemsize
+            )
+        else:
+            with open(self.index_fname, "wb") as fp:
+                fp.write(_index_header())
+                fp.flush()
+                os.fsync(fp.fileno())
+
+        # Note, records needn't be in shard order (e.g. if they've been
+        # reused with `add_records()`), so we look for the furthest one.
+        if n_committed:
+            records = numpy.fromfile(
+                self.index_fname,
+                dtype=RECORD_DTYPE,
+                offset=header_size
+            )
+            records = records[records["shard"] == records["shard"].max()]
+            ends = records["offset"] + 2 * _record_nbytes(records)
+            self._shard = int(records["shard"][0])
+            self._offset = int(ends.max())
+
+        shard_fname = self._shard_fname(self._shard)
+        if os.path.exists(shard_fname):
+            os.truncate(shard_fname, self._offset)
+
+        return n_committed
+
+    def _remove_dataset(self):
+        fnames = glob.glob(os.path.join(self.root_dir, SHARD_GLOB))
+        fnames.append(self.index_fname)
+        for fname in fnames:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+
+class ShardReader:
+    """
+    Read-only, memory-mapped view over a sharded dataset directory. Opening
+    a dataset doesn't read any image data, & samples are returned as views
+    onto the mapped shards, so they're only paged in as they're accessed.
+    """
+
+    def __init__(self, root_dir):
+        """
+        Args:
+            root_dir (str): The dataset directory to read from.
+        """
+        self.root_dir = root_dir
+        index_fname = os.path.join(root_dir, INDEX_FNAME)
+        _check_version(index_fname)
+        n_records = os.path.getsize(index_fname) - HEADER_DTYPE.itemsize
+        self._open(max(n_records // RECORD_DTYPE.itemsize, 0))
+
+    def __len__(self):
+        return self._n_records
+
+    def __getitem__(self, index):
+        """
+        Get a datapoint from the dataset.
+        Args:
+            index (int): The index of the datapoint we're accessing.
+        """
+        record = self.index[index]
+        shape = _record_shape(record)
+        nbytes = int(numpy.prod(shape))
+        offset = int(record["offset"])
+        shard = self._get_shard(int(record["shard"]))
+
+        watermarked = shard[offset:offset + nbytes]
+        original = shard[offset + nbytes:offset + 2 * nbytes]
+        sample = {
+            "watermarked": watermarked.reshape(shape),
+            "original": original.reshape(shape)
+        }
+        box = record[["left", "top", "right", "bottom"]].tolist()
+        if box != NO_BOX:
+            sample["box"] = numpy.array(box)
+
+        return sample
+
+    def __getstate__(self):
+        # Memory maps would otherwise be pickled as full in-memory copies
+        # when we're sent to a DataLoader worker, so we re-open them there.
+        return {"root_dir": self.root_dir, "n_records": self._n_records}
+
+    def __setstate__(self, state):
+        self.root_dir = state["root_dir"]
+        self._open(state["n_records"])
+
+    def _open(self, n_records):
+        self._n_records = n_records
+        self._shards = {}
+        if n_records:
+            self.index = numpy.memmap(
+                os.path.join(self.root_dir, INDEX_FNAME),
+                dtype=RECORD_DTYPE,
+                mode="r",
+                offset=HEADER_DTYPE.itemsize,
+                shape=(n_records,)
+            )
+        else:
+            self.index = numpy.empty(0, dtype=RECORD_DTYPE)
+
+    def _get_shard(self, shard):
+        """
+        Lazily map a shard. We map copy-on-write, so that the returned
+        views are writable (which PyTorch expects), while the underlying
+        pages stay shared between every process reading the dataset.
+        """
+        if shard not in self._shards:
+            fname = os.path.join(self.root_dir, SHARD_FNAME.format(shard))
+            self._shards[shard] = numpy.memmap(
+                fname,
+                dtype=numpy.uint8,
+                mode="c"
+            ).view(numpy.ndarray)
+
+        return self._shards[shard]
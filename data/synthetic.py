@@ -0,0 +1,168 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import itertools
+import os
+
+import numpy
+
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .compositor import BatchCompositor
+
+
+class SyntheticDataset(IterableDataset):
+    """
+    DeWatermarker dataset, generated on the fly. Rather than reading
+    datapoints from disk, each one is made by compositing a random watermark
+    onto a random clean image, at a random position, opacity & scale.
+    Every datapoint is derived from its own seed, so datapoint `i` is the
+    same no matter which worker makes it, or when.
+    """
+
+    def __init__(
+        self,
+        images,
+        watermarks,
+        length=None,
+        seed=0,
+        scale_range=(0.25, 0.5),
+        opacity_range=(0.5, 1.0),
+        scale_steps=None,
+        transform=None
+    ):
+        """
+        Args:
+            images (list of Image, str or ndarray): The pool of clean images,
+                or paths to them. Paths are only loaded once they're needed.
+            watermarks (list of Image or str): The pool of watermarks, or
+                paths to them.
+            length (int): Optional number of datapoints in an epoch. If not
+                given, we'll generate datapoints forever.
+            seed (int): The seed that every datapoint's seed is derived from.
+            scale_range (tuple of float): The range of watermark scales.
+            opacity_range (tuple of float): The range of watermark opacities.
+            scale_steps (int): The number of distinct watermark scales. See
+                `BatchCompositor.random_placements()`.
+            transform (callable): Optional transform function to apply
+                to samples.
+        """
+        self.images = list(images)
+        self.watermarks = list(watermarks)
+        self.length = length
+        self.seed = seed
+        self.scale_range = scale_range
+        self.opacity_range = opacity_range
+        self.scale_steps = scale_steps
+        self.transform = transform
+        self.epoch = 0
+
+    def __len__(self):
+        if self.length is None:
+            raise TypeError("An infinite SyntheticDataset has no length.")
+
+        return self.length
+
+    def __iter__(self):
+        # Each worker takes every `num_workers`th datapoint, so that between
+        # them, the workers generate each datapoint exactly once.
+        start, step = 0, 1
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            start, step = worker_info.id, worker_info.num_workers
+
+        if self.length is None:
+            indices = itertools.count(start, step)
+        else:
+            indices = range(start, self.length, step)
+
+        for index in indices:
+            yield self[index]
+
+    def __getitem__(self, index):
+        """
+        Generate a datapoint.
+        Args:
+            index (int): The index of the datapoint we're generating.
+        """
+        rng = numpy.random.default_rng([self.seed, self.epoch, index])
+        image = self._get_image(int(rng.integers(len(self.images))))
+        watermark = self._get_watermark(
+            int(rng.integers(len(self.watermarks)))
+        )
+
+        height, width = image.shape[:2]
+        positions, opacities, scales = BatchCompositor.random_placements(
+            n_images=1,
+            image_size=(width, height),
+            rng=rng,
+            scale_range=self.scale_range,
+            opacity_range=self.opacity_range,
+            scale_steps=self.scale_steps
+        )
+        watermarked, boxes = BatchCompositor.composite(
+            images=image[None],
+            watermark=watermark,
+            positions=positions,
+            opacities=opacities,
+            scales=scales
+        )
+
+        sample = {
+            "watermarked": watermarked[0],
+            "original": image,
+            "box": boxes[0]
+        }
+        if self.transform:
+            sample = self.transform(sample)
+
+        return sample
+
+    def set_epoch(self, epoch):
+        """
+        Move on to a new epoch. Datapoints are seeded by epoch as well as by
+        index, so each epoch sees a fresh set of datapoints.
+        Args:
+            epoch (int): The epoch we're about to start.
+        """
+        self.epoch = epoch
+
+    def _get_image(self, index):
+        image = self.images[index]
+        if not isinstance(image, numpy.ndarray):
+            if isinstance(image, (str, os.PathLike)):
+                image = Image.open(image)
+            image = numpy.asarray(image.convert("RGB"))
+            self.images[index] = image
+
+        return image
+
+    def _get_watermark(self, index):
+        watermark = self.watermarks[index]
+        if isinstance(watermark, (str, os.PathLike)):
+            watermark = Image.open(watermark)
+            watermark.load()
+            self.watermarks[index] = watermark
+
+        return watermark
@@ -0,0 +1,95 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+import torch
+
+from torch.utils.data.dataloader import default_collate
+
+
+# The scale we train on. Images are mapped from [0, 255] into [0, 1].
+DEFAULT_SCALE = 1 / 255
+
+
+class ToTensorCollate:
+    """
+    DataLoader collate function, which turns a batch of uint8 (H, W, C)
+    images straight into a contiguous (N, C, H, W) float batch, ready to be
+    fed to a model. As collate functions run in the DataLoader workers,
+    this takes the conversion off of the training process entirely.
+    """
+    IMAGE_KEYS = ("watermarked", "original")
+
+    def __init__(self, scale=DEFAULT_SCALE, channels_last=False):
+        """
+        Args:
+            scale (float): The factor to scale pixel values by. Use 1 to
+                keep the original [0, 255] range.
+            channels_last (bool): Whether to lay batches out in the
+                channels-last memory format, rather than contiguous NCHW.
+        """
+        self.scale = scale
+        self.channels_last = channels_last
+
+    def __call__(self, batch):
+        """
+        Collate a batch of samples.
+        Args:
+            batch (list of dict): The samples to collate. Any entries other
+                than the images are collated as usual.
+        """
+        collated = {}
+        for key in batch[0]:
+            values = [sample[key] for sample in batch]
+            if key in self.IMAGE_KEYS:
+                collated[key] = self._collate_images(images=values)
+            else:
+                collated[key] = default_collate(values)
+
+        return collated
+
+    def _collate_images(self, images):
+        images = [numpy.asarray(image) for image in images]
+        images = [
+            image[..., None] if image.ndim == 2 else image for image in images
+        ]
+        height, width, channels = images[0].shape
+        memory_format = torch.contiguous_format
+        if self.channels_last:
+            memory_format = torch.channels_last
+
+        # Each image is cast & written into its place in the batch in one
+        # go, through an (N, H, W, C) view of the output.
+        batch = torch.empty(
+            (len(images), channels, height, width),
+            dtype=torch.float32,
+            memory_format=memory_format
+        )
+        batch_view = batch.permute(0, 2, 3, 1).numpy()
+        for index, image in enumerate(images):
+            batch_view[index] = image
+
+        if self.scale != 1:
+            batch.mul_(self.scale)
+
+        return batch
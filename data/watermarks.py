@@ -0,0 +1,113 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import collections
+import threading
+
+from PIL import Image
+
+
+def resize_watermark(watermark, dim_boundary, resize_ratio=2, resample=None):
+    """
+    Resize the given watermark so that it fits within a set target
+    dimension, keeping its aspect ratio. Note, the given watermark is left
+    untouched, & the resized copy is always RGBA.
+    Args:
+        watermark (Image): The watermark to resize.
+        dim_boundary (tuple of int): The dimensions of the image we're
+            adding the watermark to.
+        resize_ratio (int): The ratio to resize. Default is 2 (50%).
+        resample (int): The resampling filter to use. Default is bicubic.
+    """
+    max_width, max_height = dim_boundary
+    resized = watermark.convert("RGBA")
+    resized.thumbnail(
+        size=(max_width // resize_ratio, max_height // resize_ratio),
+        resample=Image.BICUBIC if resample is None else resample
+    )
+
+    return resized
+
+
+class WatermarkCache:
+    """
+    LRU cache of resized watermarks. Datasets tend to be made up of only a
+    handful of distinct image sizes, so rather than resampling the watermark
+    for every image, we keep each size we've resampled it to around, along
+    with its alpha mask, ready for pasting.
+    Note, watermarks are cached by identity, so a watermark shouldn't be
+    modified in place once it's been used. The cache can be shared between
+    threads.
+    """
+
+    def __init__(self, maxsize=32):
+        """
+        Args:
+            maxsize (int): The maximum number of resized watermarks to keep.
+        """
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, watermark, dim_boundary, resize_ratio=2, resample=None):
+        """
+        Get the given watermark resized to fit within a target dimension,
+        as an RGBA image & its alpha mask. Takes the same arguments as
+        `resize_watermark()`.
+        """
+        max_width, max_height = dim_boundary
+        size = (max_width // resize_ratio, max_height // resize_ratio)
+        key = (id(watermark), size, resize_ratio, resample)
+
+        # We hold on to the watermark itself in each entry, so that its id
+        # can't be reused by another watermark while it's cached.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is watermark:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+
+        # We resize outside of the lock, so that threads only wait on each
+        # other for the bookkeeping. At worst, two threads resize the same
+        # watermark at once, & the last one's is kept.
+        resized = resize_watermark(
+            watermark=watermark,
+            dim_boundary=dim_boundary,
+            resize_ratio=resize_ratio,
+            resample=resample
+        )
+        mask = resized.getchannel("A")
+        with self._lock:
+            self._entries[key] = (watermark, resized, mask)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        return resized, mask
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,365 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import collections
+import glob
+import os
+import sys
+
+import numpy
+import torch
+
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from autoencoder import ARCHITECTURES
+from inference import Dewatermarker, load_model
+
+
+# De-watermark whole directories of images with a trained autoencoder, e.g.
+#   python dewatermark.py photos/ "scans/*.jpg" --out cleaned/ \
+#       --arch ARCH1 --checkpoint arch_1.pt
+#
+# Images are decoded, run through the model & encoded as overlapping
+# pipeline stages. Decoding & encoding happen on a pool of I/O threads
+# (PIL releases the GIL while it works), so the model never has to wait on
+# them, while same-sized images are batched together for the model. Given
+# the watermark itself (--watermark), we locate it in each image, & only
+# run the model on the region it's in, leaving every other pixel untouched.
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+
+def find_images(inputs):
+    """
+    Find the images to de-watermark. Returns (path, output name) pairs,
+    where images found in a directory keep their path relative to it, &
+    images matched by a glob pattern keep their path relative to the
+    pattern's leading directories, e.g. "scans/*/page.png" matches
+    "scans/a/page.png" as "a/page.png". Images found more than once are
+    only returned once, & a ValueError is raised if two images would be
+    written to the same output name.
+    Args:
+        inputs (list of str): Image files, directories or glob patterns.
+    """
+    images = []
+    for pattern in inputs:
+        root_dir = _glob_root(pattern)
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if not os.path.isdir(path):
+                images.append((path, os.path.relpath(path, root_dir)))
+                continue
+
+            for dir_path, _, fnames in sorted(os.walk(path)):
+                for fname in sorted(fnames):
+                    if fname.lower().endswith(IMAGE_EXTENSIONS):
+                        fpath = os.path.join(dir_path, fname)
+                        images.append((fpath, os.path.relpath(fpath, path)))
+
+    # Images are written under their output name, so two images sharing one
+    # would overwrite each other, & an image found twice is only done once.
+    paths = {}
+    for path, name in images:
+        other = paths.setdefault(name, path)
+        if os.path.realpath(other) != os.path.realpath(path):
+            raise ValueError(
+                "Both {} & {} would be written to {}. Pass their common "
+                "parent directory, or a glob pattern, instead.".format(
+                    other, path, name
+                )
+            )
+
+    return [(path, name) for name, path in paths.items()]
+
+
+def _glob_root(pattern):
+    """
+    Get the directory a glob pattern's matches are relative to: its
+    leading directories, up to the first with a wildcard in it.
+    """
+    root_dir = os.path.dirname(pattern)
+    while glob.has_magic(root_dir):
+        root_dir = os.path.dirname(root_dir)
+
+    return root_dir or "."
+
+
+def decode(path):
+    """
+    Load an image as an (H, W, 3) uint8 array, or None if it can't be read.
+    """
+    try:
+        with Image.open(path) as image:
+            return numpy.asarray(image.convert("RGB"))
+    except OSError as e:
+        print("Skipping {}: {}".format(path, e), file=sys.stderr)
+        return None
+
+
+def encode(pixels, fname, quality=95):
+    """
+    Save an image, in the format given by its extension. Images with an
+    extension we can read, but not write, are saved as PNGs instead, with
+    ".png" added to their name. We write to a temporary file first, so
+    that an interrupted run never leaves a truncated image behind.
+    """
+    os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+    image_format = Image.registered_extensions().get(
+        os.path.splitext(fname)[1].lower()
+    )
+    if image_format not in Image.SAVE:
+        print(
+            "Can't write {}, saving it as a PNG.".format(fname),
+            file=sys.stderr
+        )
+        image_format, fname = "PNG", fname + ".png"
+
+    Image.fromarray(pixels).save(
+        fname + ".tmp",
+        format=image_format,
+        quality=quality
+    )
+    os.replace(fname + ".tmp", fname)
+
+
+def prefetch(executor, fn, items, depth):
+    """
+    Map a function over some items on an executor, yielding the results in
+    order. At most `depth` items are in flight at once, so that we never
+    get too far ahead of the consumer.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, executor.submit(fn, item)))
+        if len(pending) >= depth:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def batch_by_size(decoded, batch_size, max_buffered=None):
+    """
+    Group decoded images into batches of the same size. A batch is yielded
+    as soon as it's full, or once more than `max_buffered` images are
+    waiting, in which case the fullest batch goes first.
+    Args:
+        decoded (iterable of tuple): (item, pixels) pairs.
+        batch_size (int): The maximum number of images per batch.
+        max_buffered (int): The maximum number of images to hold on to.
+            Default is 4 batches' worth.
+    """
+    max_buffered = max_buffered or 4 * batch_size
+    buckets = collections.OrderedDict()
+    n_buffered = 0
+    for item, pixels in decoded:
+        if pixels is None:
+            continue
+
+        bucket = buckets.setdefault(pixels.shape, [])
+        bucket.append((item, pixels))
+        n_buffered += 1
+        if len(bucket) == batch_size:
+            del buckets[pixels.shape]
+        elif n_buffered > max_buffered:
+            bucket = buckets.pop(max(buckets, key=lambda k: len(buckets[k])))
+        else:
+            continue
+
+        n_buffered -= len(bucket)
+        yield bucket
+
+    yield from buckets.values()
+
+
+def dewatermark(
+    dewatermarker,
+    images,
+    output_dir,
+    batch_size=8,
+    io_workers=4,
+    quality=95
+):
+    """
+    De-watermark images, writing the results under `output_dir`. Returns
+    the number of images written.
+    Args:
+        dewatermarker (Dewatermarker): The model to de-watermark with.
+        images (list of tuple): (path, output name) pairs to de-watermark,
+            as returned by `find_images()`.
+        output_dir (str): The directory to write the results to.
+        batch_size (int): The maximum number of images per batch.
+        io_workers (int): The number of threads to decode & encode with.
+        quality (int): The quality to encode lossy formats at.
+    """
+    def load(item):
+        # Locating the watermark is mostly FFTs, which release the GIL, so
+        # we do it here, rather than holding up the model.
+        pixels = decode(item[0])
+        box = None if pixels is None else dewatermarker.locate(pixels)
+        return item + (box,), pixels
+
+    n_written = 0
+    with ThreadPoolExecutor(max_workers=io_workers) as executor:
+        decoded = prefetch(
+            executor=executor,
+            fn=load,
+            items=images,
+            depth=2 * batch_size + io_workers
+        )
+        decoded = (result for _, result in decoded)
+        encoding = collections.deque()
+        for batch in batch_by_size(decoded=decoded, batch_size=batch_size):
+            outputs = dewatermarker(
+                images=[pixels for _, pixels in batch],
+                boxes=[box for (_, _, box), _ in batch]
+            )
+            for ((_, name, _), _), pixels in zip(batch, outputs):
+                encoding.append(executor.submit(
+                    encode,
+                    pixels=pixels,
+                    fname=os.path.join(output_dir, name),
+                    quality=quality
+                ))
+
+            # Don't let encoding fall too far behind, either.
+            while len(encoding) > batch_size + io_workers:
+                encoding.popleft().result()
+                n_written += 1
+
+        for future in encoding:
+            future.result()
+            n_written += 1
+
+    return n_written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Remove watermarks from images with a trained model."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="Image files, directories or glob patterns to de-watermark."
+    )
+    parser.add_argument("--out", required=True, help="The output directory.")
+    parser.add_argument("--arch", default="ARCH1", choices=ARCHITECTURES)
+    parser.add_argument(
+        "--checkpoint",
+        help="The weights to use. Default is the architecture's FPATH."
+    )
+    parser.add_argument(
+        "--quantized",
+        action="store_true",
+        help="Use int8 weights, as saved by quantize.py."
+    )
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="Threads to decode & encode images with."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="Torch threads to run the model with. Default is torch's own."
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=0,
+        help="Run the model on tiles of this size, to bound its memory use "
+             "on large images. Default is whole images."
+    )
+    parser.add_argument("--tile-batch-size", type=int, default=4)
+    parser.add_argument(
+        "--tile-workers",
+        type=int,
+        default=1,
+        help="Threads to run tiles on."
+    )
+    parser.add_argument(
+        "--watermark",
+        help="The watermark to remove. If given, only the region of each "
+             "image that it's found in is run through the model."
+    )
+    parser.add_argument(
+        "--watermark-scales",
+        type=float,
+        nargs="+",
+        help="Scales to look for the watermark at, relative to the image. "
+             "Default is the size the dataset generator adds it at."
+    )
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=0.5,
+        help="How well the watermark must match to only de-watermark its "
+             "region. Below this, the whole image is de-watermarked."
+    )
+    parser.add_argument("--quality", type=int, default=95)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = load_model(
+        arch=args.arch,
+        checkpoint=args.checkpoint,
+        quantized=args.quantized
+    )
+    watermark = None
+    if args.watermark:
+        watermark = Image.open(args.watermark)
+        watermark.load()
+    images = find_images(args.inputs)
+    n_written = dewatermark(
+        dewatermarker=Dewatermarker(
+            model=model,
+            tile_size=args.tile_size,
+            tile_batch_size=args.tile_batch_size,
+            workers=args.tile_workers,
+            watermark=watermark,
+            watermark_scales=args.watermark_scales,
+            min_score=args.min_score
+        ),
+        images=images,
+        output_dir=args.out,
+        batch_size=args.batch_size,
+        io_workers=args.io_workers,
+        quality=args.quality
+    )
+    print("De-watermarked {} of {} images.".format(n_written, len(images)))
+    return n_written
+
+
+if __name__ == "__main__":
+    main()
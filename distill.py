@@ -0,0 +1,184 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+
+import torch
+
+from torch.utils.data import DataLoader
+
+from autoencoder import ARCHITECTURES
+from data import DeWatermarkerDataset, ToTensorCollate
+from inference import load_model
+from quantize import evaluate
+from trainer import Trainer
+
+
+# Knowledge distillation: a trained (large, slow) teacher supervises a
+# small, fast student, which learns to match both the teacher's output &
+# the original images, e.g.
+#   python distill.py --teacher ARCH2 --teacher-checkpoint arch_2.pt \
+#       --student ARCH3 --dataset data/training/set
+# The student's best weights are saved to its usual FPATH, so it loads
+# like any other model, & we finish by reporting how much quality we keep
+# against how much faster it is.
+
+
+class DistillationTrainer(Trainer):
+    """
+    Trains a student model on a mix of the teacher's output, & the ground
+    truth. Everything else (checkpoints, resuming, previews) works just as
+    it does for `Trainer`, & only the student is checkpointed.
+    """
+
+    def __init__(self, model, teacher, alpha=0.5, **kwargs):
+        """
+        Args:
+            model (BaseAutoencoder): The student model to train.
+            teacher (BaseAutoencoder): The trained teacher model.
+            alpha (float): The weight of the teacher's loss, in [0, 1]. The
+                ground truth's loss is weighted by `1 - alpha`.
+            **kwargs: Any other arguments to `Trainer`.
+        """
+        super().__init__(model=model, **kwargs)
+        self.teacher = teacher.eval()
+        self.alpha = alpha
+        for parameter in self.teacher.parameters():
+            parameter.requires_grad_(False)
+
+    def compute_loss(self, output, batch):
+        """
+        Compute the student's loss against both the teacher's output on the
+        same batch, & the original images.
+        Args:
+            output (Tensor): The student's output.
+            batch (dict of Tensor): The batch the output was produced from.
+        """
+        with torch.no_grad():
+            target = self.teacher(batch["watermarked"])
+
+        teacher_loss = self.criterion(output, target)
+        truth_loss = self.criterion(output, batch["original"])
+        return self.alpha * teacher_loss + (1 - self.alpha) * truth_loss
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Distill a trained autoencoder into a smaller one."
+    )
+    parser.add_argument("--teacher", default="ARCH2", choices=ARCHITECTURES)
+    parser.add_argument(
+        "--teacher-checkpoint",
+        help="The teacher's weights. Default is its FPATH."
+    )
+    parser.add_argument("--student", default="ARCH3", choices=ARCHITECTURES)
+    parser.add_argument(
+        "--weights",
+        help="Where to save the student's best weights. Default is its "
+             "FPATH."
+    )
+    parser.add_argument("--dataset", default="data/training/set")
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.5,
+        help="The weight of the teacher's loss, against the ground truth's."
+    )
+    parser.add_argument("--epochs", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--eta", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-5)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument("--checkpoint-dir", default="checkpoints/distill")
+    parser.add_argument("--checkpoint-every", type=int, default=100)
+    parser.add_argument(
+        "--eval-batches",
+        type=int,
+        default=32,
+        help="The number of batches to compare the models on."
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    dataset = DeWatermarkerDataset(root_dir=args.dataset)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.num_workers,
+        collate_fn=ToTensorCollate()
+    )
+
+    channels = dataset[0]["watermarked"].shape[-1]
+    teacher = load_model(
+        arch=args.teacher,
+        checkpoint=args.teacher_checkpoint,
+        channels=channels
+    )
+    student = ARCHITECTURES[args.student](inpt_shape=(None, None, channels))
+    if args.weights:
+        student.FPATH = args.weights
+
+    trainer = DistillationTrainer(
+        model=student,
+        teacher=teacher,
+        alpha=args.alpha,
+        optimizer=torch.optim.Adam(
+            student.parameters(),
+            lr=args.eta,
+            weight_decay=args.weight_decay
+        ),
+        dataloader=dataloader,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_every=args.checkpoint_every
+    )
+    trainer.resume()
+    trainer.fit(n_epochs=args.epochs)
+    trainer.wait()
+
+    # Report on the best student, as saved, rather than the last one.
+    student.load()
+    results = evaluate(
+        models={args.teacher: teacher, args.student: student},
+        dataloader=dataloader,
+        n_batches=args.eval_batches
+    )
+    for result in results:
+        print("{:>6}  MSE {:.6f}  PSNR {:6.2f}dB  latency {:8.2f}ms".format(
+            result["model"],
+            result["mse"],
+            result["psnr"],
+            result["latency"] * 1000
+        ))
+    teacher_result, student_result = results
+    print("PSNR drop {:.2f}dB, {:.1f}x faster".format(
+        teacher_result["psnr"] - student_result["psnr"],
+        teacher_result["latency"] / student_result["latency"]
+    ))
+    return student, results
+
+
+if __name__ == "__main__":
+    main()
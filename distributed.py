@@ -0,0 +1,263 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import glob
+import os
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from autoencoder import ARCHITECTURES
+from data import DeWatermarkerDataset, ToTensorCollate
+from instrumentation import TrainingMonitor
+from trainer import Trainer
+
+
+# Data-parallel training across processes, on one machine or several. Each
+# process trains a replica of the model on its own shard of the dataset, &
+# gradients are averaged across processes (with the gloo backend, as we
+# train on CPU) after every backward pass.
+#
+# To train with 4 processes on this machine:
+#   python distributed.py --nprocs 4 --dataset data/training/set
+# To train across 2 machines, run on each (with --node-rank 0 on the first):
+#   python distributed.py --nprocs 2 --nnodes 2 --node-rank <0|1> \
+#       --master-addr <first machine's address> --dataset data/training/set
+
+
+def numa_cpus():
+    """
+    Get the CPUs of each NUMA node on this machine that we're allowed to run
+    on, or all of our CPUs as a single node if there's no NUMA information.
+    """
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for fname in sorted(glob.glob("/sys/devices/system/node/node*/cpulist")):
+        cpus = set()
+        with open(fname) as fp:
+            for cpu_range in fp.read().strip().split(","):
+                if cpu_range:
+                    start, _, end = cpu_range.partition("-")
+                    cpus.update(range(int(start), int(end or start) + 1))
+        if cpus & allowed:
+            nodes.append(sorted(cpus & allowed))
+
+    return nodes or [sorted(allowed)]
+
+
+def process_cpus(local_rank, nprocs):
+    """
+    Choose the CPUs for a process. With one process per NUMA node, each
+    process gets its own node. Otherwise, we split our CPUs evenly.
+    Args:
+        local_rank (int): The rank of the process on this machine.
+        nprocs (int): The number of processes on this machine.
+    """
+    nodes = numa_cpus()
+    if len(nodes) == nprocs:
+        return nodes[local_rank]
+
+    cpus = sorted(cpu for node in nodes for cpu in node)
+    per_process = max(len(cpus) // nprocs, 1)
+    start = (local_rank * per_process) % len(cpus)
+    return cpus[start:start + per_process]
+
+
+def setup(rank, world_size, master_addr, master_port):
+    """
+    Join the process group.
+    Args:
+        rank (int): The global rank of this process.
+        world_size (int): The total number of processes.
+        master_addr (str): The address of the rank 0 process's machine.
+        master_port (int): The port to rendezvous on.
+    """
+    os.environ["MASTER_ADDR"] = master_addr
+    os.environ["MASTER_PORT"] = str(master_port)
+    dist.init_process_group(backend="gloo", rank=rank, world_size=world_size)
+
+
+def resume(trainer, rank):
+    """
+    Resume every replica from rank 0's latest checkpoint, if it has one.
+    Only rank 0 writes checkpoints, & the checkpoint directory needn't be
+    shared between machines, so rank 0 loads the training state & sends it
+    to the other ranks, which must all resume from the same epoch, with the
+    same optimizer state. Note, this must happen before the model is
+    wrapped with `DistributedDataParallel`.
+    Args:
+        trainer (Trainer): The trainer of this process's replica.
+        rank (int): The global rank of this process.
+    """
+    state = [trainer.latest_checkpoint() if rank == 0 else None]
+    dist.broadcast_object_list(state, src=0)
+    if state[0] is None:
+        return False
+
+    trainer.load_state_dict(state[0])
+    return True
+
+
+def train(local_rank, args):
+    """
+    Train a single replica of the model. This is the entry point of each
+    process.
+    Args:
+        local_rank (int): The rank of this process on this machine.
+        args (Namespace): The parsed command line arguments.
+    """
+    rank = args.node_rank * args.nprocs + local_rank
+    world_size = args.nnodes * args.nprocs
+    if args.pin:
+        cpus = process_cpus(local_rank=local_rank, nprocs=args.nprocs)
+        os.sched_setaffinity(0, cpus)
+        torch.set_num_threads(len(cpus))
+    else:
+        # Split our cores between the processes, to avoid oversubscribing.
+        n_cpus = len(os.sched_getaffinity(0))
+        torch.set_num_threads(args.threads or max(n_cpus // args.nprocs, 1))
+
+    setup(
+        rank=rank,
+        world_size=world_size,
+        master_addr=args.master_addr,
+        master_port=args.master_port
+    )
+    try:
+        dataset = DeWatermarkerDataset(root_dir=args.dataset)
+        sampler = DistributedSampler(
+            dataset,
+            num_replicas=world_size,
+            rank=rank,
+            shuffle=True,
+            seed=args.seed
+        )
+        dataloader = DataLoader(
+            dataset,
+            batch_size=args.batch_size,
+            sampler=sampler,
+            num_workers=args.num_workers,
+            collate_fn=ToTensorCollate()
+        )
+
+        torch.manual_seed(args.seed)
+        model = ARCHITECTURES[args.arch](
+            inpt_shape=dataset[0]["watermarked"].shape
+        )
+        if args.weights:
+            model.FPATH = args.weights
+        optimizer = torch.optim.Adam(
+            model.parameters(),
+            lr=args.eta,
+            weight_decay=args.weight_decay
+        )
+
+        monitor = None
+        if args.metrics:
+            monitor = TrainingMonitor(fname=args.metrics.format(rank=rank))
+
+        trainer = Trainer(
+            model=model,
+            optimizer=optimizer,
+            dataloader=dataloader,
+            checkpoint_dir=args.checkpoint_dir,
+            checkpoint_every=args.checkpoint_every,
+            main_process=rank == 0,
+            monitor=monitor
+        )
+        resume(trainer=trainer, rank=rank)
+
+        # Every replica must start from the same weights. DDP broadcasts
+        # rank 0's weights when it wraps the model.
+        trainer.model = DistributedDataParallel(model)
+        trainer.fit(n_epochs=args.epochs)
+        return trainer
+    finally:
+        dist.destroy_process_group()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Data-parallel autoencoder training on CPU."
+    )
+    parser.add_argument("--dataset", default="data/training/set")
+    parser.add_argument("--arch", default="ARCH1", choices=ARCHITECTURES)
+    parser.add_argument("--epochs", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--eta", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-5)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--checkpoint-dir", default="checkpoints/distributed")
+    parser.add_argument(
+        "--weights",
+        help="Where to save the best weights. Default is the model's FPATH."
+    )
+    parser.add_argument("--checkpoint-every", type=int, default=100)
+    parser.add_argument(
+        "--metrics",
+        help="Optional file to record training metrics to, per rank, e.g. "
+             "metrics-{rank}.jsonl"
+    )
+    parser.add_argument(
+        "--nprocs",
+        type=int,
+        default=len(numa_cpus()),
+        help="Processes per machine. Default is one per NUMA node."
+    )
+    parser.add_argument("--nnodes", type=int, default=1)
+    parser.add_argument("--node-rank", type=int, default=0)
+    parser.add_argument("--master-addr", default="127.0.0.1")
+    parser.add_argument("--master-port", type=int, default=29500)
+    parser.add_argument(
+        "--pin",
+        action="store_true",
+        help="Pin each process to its own NUMA node, or share of CPUs."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="Torch threads per process, if not pinning. Default is an "
+             "even share of this machine's CPUs."
+    )
+    return parser.parse_args(argv)
+
+
+def launch(args):
+    """
+    Start this machine's training processes, & wait for them to finish.
+    Args:
+        args (Namespace): The parsed command line arguments.
+    """
+    mp.spawn(train, args=(args,), nprocs=args.nprocs, join=True)
+
+
+if __name__ == "__main__":
+    launch(parse_args())
@@ -0,0 +1,246 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy
+import torch
+import torch.nn as nn
+
+from autoencoder import ARCHITECTURES
+from data import DEFAULT_SCALE
+from inference import Dewatermarker, load_model
+from runtime import ExportedModel
+
+
+# Export trained autoencoders for serving with `runtime.ExportedModel`, e.g.
+#   python export.py --arch ARCH1 --checkpoint arch_1.pt --format onnx
+# & compare the exported model's startup time & latency with the eager one:
+#   python export.py --arch ARCH1 --checkpoint arch_1.pt --compare
+# Note, ONNX export needs the onnx package, & running ONNX models needs
+# onnxruntime. TorchScript only needs torch.
+EXTENSIONS = {"torchscript": ".torchscript.pt", "onnx": ".onnx"}
+
+
+class InferenceGraph(nn.Module):
+    """
+    Wraps an autoencoder with everything it needs to go from watermarked
+    to de-watermarked pixels, so that it can be exported as one graph. It
+    takes & returns (N, H, W, C) uint8 images, folding in `resize()`, the
+    scaling to & from the training scale, & the rounding.
+    """
+
+    def __init__(self, model, scale=DEFAULT_SCALE):
+        """
+        Args:
+            model (BaseAutoencoder): The trained model.
+            scale (float): The scale that pixel values were trained on.
+        """
+        super().__init__()
+        self.model = model.eval()
+        self.scale = scale
+
+    def forward(self, images):
+        batch = images.permute(0, 3, 1, 2).float() * self.scale
+        output = self.model(batch) / self.scale
+        output = output.clamp(0, 255).round().to(torch.uint8)
+        return output.permute(0, 2, 3, 1).contiguous()
+
+
+def _example_input(model, height=32, width=32):
+    channels = next(model.parameters()).shape[1]
+    return torch.randint(0, 256, (1, height, width, channels)).to(torch.uint8)
+
+
+def export_torchscript(model, fname, scale=DEFAULT_SCALE):
+    """
+    Export a model to TorchScript, frozen for inference. Every layer is
+    shape-agnostic, so the traced graph takes images of any size.
+    Args:
+        model (BaseAutoencoder): The trained model.
+        fname (str): Where to save the exported model.
+        scale (float): The scale that pixel values were trained on.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(
+            InferenceGraph(model, scale=scale).eval(),
+            _example_input(model)
+        )
+    torch.jit.save(torch.jit.freeze(traced), fname)
+    return fname
+
+
+def export_onnx(model, fname, scale=DEFAULT_SCALE, opset_version=17):
+    """
+    Export a model to ONNX, with dynamic batch, height & width axes.
+    Args:
+        model (BaseAutoencoder): The trained model.
+        fname (str): Where to save the exported model.
+        scale (float): The scale that pixel values were trained on.
+        opset_version (int): The ONNX opset to target.
+    """
+    axes = {0: "batch", 1: "height", 2: "width"}
+    with torch.no_grad():
+        torch.onnx.export(
+            InferenceGraph(model, scale=scale).eval(),
+            (_example_input(model),),
+            fname,
+            input_names=["watermarked"],
+            output_names=["dewatermarked"],
+            dynamic_axes={"watermarked": axes, "dewatermarked": axes},
+            opset_version=opset_version,
+            dynamo=False
+        )
+    return fname
+
+
+def _startup_time(code):
+    """
+    Time how long it takes a fresh interpreter to run some code.
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+def _latency(fn, images, n_runs):
+    fn(images)
+    times = []
+    for _ in range(n_runs):
+        start = time.perf_counter()
+        fn(images)
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def compare(
+    arch,
+    checkpoint,
+    fnames,
+    image_size=(256, 256),
+    batch_size=1,
+    n_runs=10
+):
+    """
+    Compare the startup time & latency of the eager model with exported
+    models. Returns a row of results per model.
+    Args:
+        arch (str): The name of the architecture.
+        checkpoint (str): The eager model's weights.
+        fnames (list of str): The exported models.
+        image_size (tuple of int): The (height, width) of images to time.
+        batch_size (int): The number of images per batch.
+        n_runs (int): The number of runs to take the median latency over.
+    """
+    model = load_model(arch=arch, checkpoint=checkpoint)
+    images = numpy.random.default_rng(0).integers(
+        0, 256, (batch_size,) + tuple(image_size) + (3,), dtype=numpy.uint8
+    )
+    results = [{
+        "model": "eager",
+        "startup": _startup_time(
+            "from inference import load_model; "
+            "load_model(arch={!r}, checkpoint={!r})".format(arch, checkpoint)
+        ),
+        "latency": _latency(Dewatermarker(model), list(images), n_runs)
+    }]
+    for fname in fnames:
+        results.append({
+            "model": os.path.basename(fname),
+            "startup": _startup_time(
+                "from runtime import ExportedModel; "
+                "ExportedModel({!r})".format(fname)
+            ),
+            "latency": _latency(ExportedModel(fname), images, n_runs)
+        })
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export a trained autoencoder for serving."
+    )
+    parser.add_argument("--arch", default="ARCH1", choices=ARCHITECTURES)
+    parser.add_argument(
+        "--checkpoint",
+        help="The weights to export. Default is the architecture's FPATH."
+    )
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        default=["torchscript"],
+        choices=EXTENSIONS
+    )
+    parser.add_argument(
+        "--out-dir",
+        default=".",
+        help="Where to write the exported models."
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Compare the exported models' startup time & latency with the "
+             "eager model's."
+    )
+    parser.add_argument("--image-size", type=int, nargs=2, default=(256, 256))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    model = load_model(arch=args.arch, checkpoint=args.checkpoint)
+    name, _ = os.path.splitext(os.path.basename(args.checkpoint or model.FPATH))
+    exporters = {"torchscript": export_torchscript, "onnx": export_onnx}
+
+    fnames = []
+    for fmt in args.format:
+        fname = os.path.join(args.out_dir, name + EXTENSIONS[fmt])
+        fnames.append(exporters[fmt](model=model, fname=fname))
+        print("Exported {}".format(fname))
+
+    if args.compare:
+        results = compare(
+            arch=args.arch,
+            checkpoint=args.checkpoint or model.FPATH,
+            fnames=fnames,
+            image_size=args.image_size
+        )
+        for result in results:
+            print("{:>32}  startup {:7.3f}s  latency {:8.2f}ms".format(
+                result["model"],
+                result["startup"],
+                result["latency"] * 1000
+            ))
+
+    return fnames
+
+
+if __name__ == "__main__":
+    main()
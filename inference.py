@@ -0,0 +1,535 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import collections
+import math
+import zipfile
+
+import numpy
+import torch
+
+from concurrent.futures import ThreadPoolExecutor
+
+from autoencoder import ARCHITECTURES, ConvAutoencoder
+from data import DEFAULT_SCALE, DSGenerator, ToTensorCollate, WatermarkCache
+from quantize import QuantizedAutoencoder
+
+
+# The default size of the tiles for tiled inference, for models whose
+# receptive field allows it. See `default_tile_size()`.
+TILE_SIZE = 256
+# Resized watermark templates, for locating watermarks.
+WATERMARK_CACHE = WatermarkCache(maxsize=32)
+
+
+def load_model(
+    arch,
+    checkpoint=None,
+    channels=3,
+    quantized=False,
+    mmap=False
+):
+    """
+    Build one of our autoencoders & load its trained weights, ready for
+    inference.
+    Args:
+        arch (str): The name of the architecture, as in `ARCHITECTURES`.
+        checkpoint (str): The weights to load. Either the best weights saved
+            during training, or a full `Trainer` checkpoint. Default is the
+            architecture's own `FPATH`. Weights pruned from the architecture
+            (see `prune.py`) can be loaded, too, & are recognized by the
+            widths saved with them.
+        channels (int): The number of channels the model takes.
+        quantized (bool): Whether to load int8 weights, as saved by
+            `quantize.py`, instead. Their default is the quantized `FPATH`.
+        mmap (bool): Whether to memory-map the weights, rather than read
+            them in. The model then uses the mapped file as its weights, so
+            loading is nearly free, pages are only read as they're used, &
+            processes loading the same file share them. Not supported for
+            int8 weights. Weights saved in torch's legacy (non-zip) format
+            can't be mapped, so they're read in instead.
+    """
+    if quantized:
+        model = ARCHITECTURES[arch](inpt_shape=(None, None, channels))
+        model = QuantizedAutoencoder(model)
+        model.FPATH = checkpoint or model.FPATH
+        model.load()
+        return model
+
+    fname = checkpoint or ARCHITECTURES[arch].FPATH
+    mmap = mmap and zipfile.is_zipfile(fname)
+    state = torch.load(
+        fname,
+        map_location="cpu",
+        weights_only=False,
+        mmap=mmap
+    )
+    pruned = "widths" in state
+    if "model" in state:
+        state = state["model"]
+
+    # Pruned weights keep their architecture's layers, but with fewer
+    # channels, so we build a model to fit them instead. Otherwise, weights
+    # that don't fit are an error.
+    if pruned:
+        model = ConvAutoencoder.from_state_dict(state, assign=mmap)
+    else:
+        # When memory-mapping, the weights we'd initialize would only be
+        # thrown away, so we don't allocate them at all.
+        with torch.device("meta" if mmap else "cpu"):
+            model = ARCHITECTURES[arch](inpt_shape=(None, None, channels))
+        model.load_state_dict(state, assign=mmap)
+
+    model.eval()
+    return model
+
+
+def to_pixels(output, scale=DEFAULT_SCALE):
+    """
+    Convert a model's (N, C, H, W) output back to (N, H, W, C) uint8 pixels.
+    Args:
+        output (Tensor): The model's output.
+        scale (float): The scale that pixel values were trained on.
+    """
+    pixels = output.detach().permute(0, 2, 3, 1) / scale
+    return pixels.clamp(0, 255).round().to(torch.uint8).numpy()
+
+
+def _tile_starts(length, tile_size, overlap, alignment=1):
+    """
+    Get the start of each tile along one axis, with consecutive tiles
+    overlapping by at least `overlap`, & the last reaching the end. Tiles
+    start on a multiple of `alignment`, so that a strided model sees each
+    tile on the same grid as the whole image. The last tile may then hang
+    over the end, in which case it's cut short.
+    """
+    if tile_size >= length:
+        return [0]
+
+    step = max((tile_size - overlap) // alignment * alignment, alignment)
+    starts = list(range(0, length - tile_size, step))
+    return starts + [-(-(length - tile_size) // alignment) * alignment]
+
+
+def _window(tile_size, margin, overlap, at_start, at_end):
+    """
+    Get the blending weights of a tile along one axis. Pixels within
+    `margin` of an edge that's inside the image are wrong, so they get no
+    weight, & are followed by a Hann ramp, which sums to 1 with the ramp
+    of the next tile wherever they overlap exactly.
+    """
+    window = torch.ones(tile_size)
+    ramp_size = overlap - 2 * margin
+    ramp = torch.sin(
+        (torch.arange(ramp_size) + 0.5) / ramp_size * math.pi / 2
+    ) ** 2
+    if not at_start:
+        window[:margin] = 0
+        window[margin:margin + ramp_size] = ramp
+    if not at_end:
+        window[tile_size - margin:] = 0
+        window[tile_size - margin - ramp_size:tile_size - margin] *= \
+            ramp.flip(0)
+
+    return window
+
+
+def default_tile_size(model, overlap=None):
+    """
+    Get the size of the tiles to run a model on by default: `TILE_SIZE`,
+    unless the model's receptive margin calls for a larger overlap than
+    that leaves room for, in which case we use the smallest tile that's at
+    least twice the overlap, rounded up to the model's alignment.
+    Args:
+        model (BaseAutoencoder): The model to run.
+        overlap (int): How far consecutive tiles overlap. Default is as in
+            `tiled_forward()`.
+    """
+    overlap = 4 * model.receptive_margin() if overlap is None else overlap
+    alignment = model.ALIGNMENT
+    return max(TILE_SIZE, -(-2 * overlap // alignment) * alignment)
+
+
+def tiled_forward(
+    model,
+    batch,
+    tile_size=None,
+    overlap=None,
+    batch_size=4,
+    workers=1
+):
+    """
+    Run a model over a batch of images tile by tile, so that its
+    activations are only ever as large as `batch_size` tiles, rather than
+    a whole image. Tiles overlap by more than the model's receptive margin,
+    & are blended together, so the result matches running the model on the
+    whole image, up to floating point error.
+    Args:
+        model (BaseAutoencoder): The model to run. Its output must be the
+            same size as its input.
+        batch (Tensor): A (N, C, H, W) batch of images.
+        tile_size (int): The size of the (square) tiles. Images smaller than
+            this along an axis get a single tile along it. Default is given
+            by `default_tile_size()`.
+        overlap (int): How far consecutive tiles overlap. Default is twice
+            the receptive margin, plus as much again to blend over.
+        batch_size (int): The number of tiles to run the model on at once.
+        workers (int): The number of threads to run batches of tiles on.
+            Note, each thread uses torch's intra-op thread pool, so it's
+            worth lowering `torch.set_num_threads()` to match.
+    """
+    margin = model.receptive_margin()
+    alignment = model.ALIGNMENT
+    overlap = 4 * margin if overlap is None else overlap
+    if overlap < 2 * margin:
+        raise ValueError(
+            "Tiles must overlap by at least twice the receptive margin of "
+            "{} pixels.".format(margin)
+        )
+
+    tile_size = tile_size or default_tile_size(model=model, overlap=overlap)
+    n_images, _, height, width = batch.shape
+    if tile_size < max(height, width) and tile_size < 2 * overlap:
+        raise ValueError(
+            "Tiles must be at least twice the overlap in size, i.e. {} "
+            "pixels.".format(2 * overlap)
+        )
+
+    # Tiles at the end of an axis may be cut short, & only same-sized tiles
+    # can be batched together, so we group them by size.
+    tiles = sorted(
+        (
+            (index, top, left, min(tile_size, height - top),
+             min(tile_size, width - left))
+            for index in range(n_images)
+            for top in _tile_starts(height, tile_size, overlap, alignment)
+            for left in _tile_starts(width, tile_size, overlap, alignment)
+        ),
+        key=lambda tile: tile[3:]
+    )
+    chunks = [
+        tiles[start:start + batch_size]
+        for start in range(0, len(tiles), batch_size)
+    ]
+    chunks = [
+        [tile for tile in chunk if tile[3:] == size]
+        for chunk in chunks
+        for size in sorted({tile[3:] for tile in chunk})
+    ]
+    output = None
+    weights = torch.zeros(n_images, 1, height, width)
+
+    def run(chunk):
+        crops = torch.stack([
+            batch[index, :, top:top + tile_height, left:left + tile_width]
+            for index, top, left, tile_height, tile_width in chunk
+        ])
+        with torch.no_grad():
+            return chunk, model(crops)
+
+    def blend(chunk, crops):
+        nonlocal output
+        if output is None:
+            output = torch.zeros(n_images, crops.shape[1], height, width)
+
+        for (index, top, left, tile_height, tile_width), crop in zip(
+            chunk,
+            crops
+        ):
+            window = _window(
+                tile_size=tile_height,
+                margin=margin,
+                overlap=overlap,
+                at_start=top == 0,
+                at_end=top + tile_height == height
+            )[:, None] * _window(
+                tile_size=tile_width,
+                margin=margin,
+                overlap=overlap,
+                at_start=left == 0,
+                at_end=left + tile_width == width
+            )
+            rows = slice(top, top + tile_height)
+            cols = slice(left, left + tile_width)
+            output[index, :, rows, cols] += crop * window
+            weights[index, :, rows, cols] += window
+
+    # Only a batch or so per worker is ever in flight, to bound memory.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(run, chunk))
+            if len(pending) > workers:
+                blend(*pending.popleft().result())
+
+        while pending:
+            blend(*pending.popleft().result())
+
+    return output / weights
+
+
+def _correlate(image, kernel):
+    """
+    Cross-correlate a 2D image with a smaller kernel, via the FFT. Only the
+    positions where the kernel lies entirely within the image are kept.
+    """
+    height, width = image.shape
+    kernel_height, kernel_width = kernel.shape
+    shape = (height + kernel_height - 1, width + kernel_width - 1)
+    correlated = numpy.fft.irfft2(
+        numpy.fft.rfft2(image, shape) *
+        numpy.fft.rfft2(kernel[::-1, ::-1], shape),
+        shape
+    )
+    return correlated[kernel_height - 1:height, kernel_width - 1:width]
+
+
+def _box_sums(image, height, width):
+    """
+    Sum an image over a (height, width) window at every position where the
+    window lies entirely within it, with a summed-area table.
+    """
+    table = numpy.zeros((image.shape[0] + 1, image.shape[1] + 1))
+    table[1:, 1:] = image.cumsum(axis=0).cumsum(axis=1)
+    return (
+        table[height:, width:] - table[:-height, width:] -
+        table[height:, :-width] + table[:-height, :-width]
+    )
+
+
+def _match_template(image, template):
+    """
+    Normalized cross-correlation of a template against every position in
+    an image. Returns the best score, & its (x, y) position.
+    """
+    height, width = template.shape
+    n_pixels = height * width
+    template = template - template.mean()
+    template_energy = (template ** 2).sum()
+
+    # The image's own energy, under the template at each position.
+    image_sums = _box_sums(image, height, width)
+    image_energy = _box_sums(image ** 2, height, width)
+    image_energy -= image_sums ** 2 / n_pixels
+    denominator = numpy.sqrt(numpy.maximum(image_energy, 0) * template_energy)
+
+    # Flat regions (or a flat template) can't be matched at all.
+    scores = _correlate(image, template)
+    scores = numpy.where(
+        denominator > 1e-6 * n_pixels,
+        scores / numpy.maximum(denominator, 1e-12),
+        0
+    )
+
+    top, left = numpy.unravel_index(numpy.argmax(scores), scores.shape)
+    return float(scores[top, left]), (int(left), int(top))
+
+
+def locate_watermark(image, watermark, scales=None):
+    """
+    Estimate where a known watermark has been added to an image, by
+    matching the watermark, alpha-blended onto a plain background, against
+    the image as a template. Returns the best match's score, in [-1, 1], &
+    its box, as (left, top, right, bottom).
+    Args:
+        image (ndarray): The (H, W, C) uint8 watermarked image.
+        watermark (Image): The watermark that was added.
+        scales (list of float): The scales to look for the watermark at, as
+            in `BatchCompositor`. By default, we look for it at the size
+            that `DSGenerator` adds it at.
+    """
+    image = numpy.asarray(image, dtype=numpy.float64)
+    if image.ndim == 3:
+        image = image[..., :3].mean(axis=-1)
+    height, width = image.shape
+
+    if scales is None:
+        boundaries = [((width, height), DSGenerator.RESIZE_RATIO)]
+    else:
+        boundaries = [
+            ((max(int(width * scale), 1), max(int(height * scale), 1)), 1)
+            for scale in scales
+        ]
+
+    best_score, best_box = -numpy.inf, None
+    for dim_boundary, resize_ratio in boundaries:
+        resized, _ = WATERMARK_CACHE.get(
+            watermark=watermark,
+            dim_boundary=dim_boundary,
+            resize_ratio=resize_ratio
+        )
+        resized = numpy.asarray(resized, dtype=numpy.float64)
+        template_height, template_width = resized.shape[:2]
+        if template_height > height or template_width > width:
+            continue
+
+        alpha = resized[..., 3] / 255
+        template = alpha * resized[..., :3].mean(axis=-1) + (1 - alpha) * 128
+        score, (left, top) = _match_template(image=image, template=template)
+        if score > best_score:
+            best_score = score
+            best_box = (
+                left,
+                top,
+                left + template_width,
+                top + template_height
+            )
+
+    return best_score, best_box
+
+
+class Dewatermarker:
+    """
+    Removes watermarks from batches of images with a trained autoencoder,
+    taking care of converting to & from the model's input format. Where we
+    know (or can find) the box a watermark is in, only that region is run
+    through the model, & the rest of the image is left untouched.
+    """
+
+    def __init__(
+        self,
+        model,
+        scale=DEFAULT_SCALE,
+        tile_size=None,
+        tile_batch_size=4,
+        workers=1,
+        watermark=None,
+        watermark_scales=None,
+        min_score=0.5
+    ):
+        """
+        Args:
+            model (Module): The trained model.
+            scale (float): The scale that pixel values were trained on.
+            tile_size (int): Optionally, run the model tile by tile with
+                `tiled_forward()`, to bound its memory use on large images.
+            tile_batch_size (int): The number of tiles to run at once.
+            workers (int): The number of threads to run tiles on.
+            watermark (Image): Optionally, the watermark to remove. If
+                given, we locate it in each image with `locate_watermark()`,
+                & only de-watermark the region it's in.
+            watermark_scales (list of float): The scales to look for the
+                watermark at. See `locate_watermark()`.
+            min_score (float): How well the watermark has to match for us to
+                trust its location. Below this, we de-watermark the whole
+                image instead.
+        """
+        self.model = model.eval()
+        self.scale = scale
+        self.tile_size = tile_size
+        self.tile_batch_size = tile_batch_size
+        self.workers = workers
+        self.watermark = watermark
+        self.watermark_scales = watermark_scales
+        self.min_score = min_score
+        self.margin = model.receptive_margin()
+        self.alignment = model.ALIGNMENT
+        self.collate = ToTensorCollate(scale=scale)
+
+    def __call__(self, images, boxes=None):
+        """
+        De-watermark a batch of images.
+        Args:
+            images (list of ndarray): Same-sized (H, W, C) uint8 images.
+            boxes (list of tuple): Optionally, the box (left, top, right,
+                bottom) of each image's watermark, or None where it isn't
+                known. Only the box (plus the model's receptive margin) is
+                run through the model, & the pixels outside it are returned
+                unchanged. By default, we locate each watermark ourselves,
+                if we've been given one.
+        """
+        if boxes is None:
+            boxes = [self.locate(image) for image in images]
+
+        outputs = [None] * len(images)
+        whole = [index for index, box in enumerate(boxes) if box is None]
+        if whole:
+            pixels = self._forward([images[index] for index in whole])
+            for index, output in zip(whole, pixels):
+                outputs[index] = output
+
+        for index, box in enumerate(boxes):
+            if box is not None:
+                outputs[index] = self._dewatermark_region(images[index], box)
+
+        return outputs
+
+    def locate(self, image):
+        """
+        Get the box of the watermark in an image, or None if we don't have
+        a watermark to look for, or can't find it.
+        Args:
+            image (ndarray): The (H, W, C) uint8 image.
+        """
+        if self.watermark is None:
+            return None
+
+        score, box = locate_watermark(
+            image=image,
+            watermark=self.watermark,
+            scales=self.watermark_scales
+        )
+        return box if score >= self.min_score else None
+
+    def _forward(self, images):
+        batch = self.collate([{"watermarked": image} for image in images])
+        batch = batch["watermarked"]
+        if self.tile_size:
+            output = tiled_forward(
+                model=self.model,
+                batch=batch,
+                tile_size=self.tile_size,
+                batch_size=self.tile_batch_size,
+                workers=self.workers
+            )
+        else:
+            with torch.no_grad():
+                output = self.model(batch)
+
+        return list(to_pixels(output, scale=self.scale))
+
+    def _dewatermark_region(self, image, box):
+        """
+        De-watermark only the given box of an image. The model sees the box
+        plus its receptive margin, so the box comes out exactly as it would
+        if we'd run the model on the whole image. The crop starts on a
+        multiple of the model's alignment, for the same reason.
+        """
+        height, width = image.shape[:2]
+        left, top = max(int(box[0]), 0), max(int(box[1]), 0)
+        right, bottom = min(int(box[2]), width), min(int(box[3]), height)
+        crop_left = max(left - self.margin, 0)
+        crop_left -= crop_left % self.alignment
+        crop_top = max(top - self.margin, 0)
+        crop_top -= crop_top % self.alignment
+        crop_right = min(right + self.margin, width)
+        crop_bottom = min(bottom + self.margin, height)
+
+        crop = image[crop_top:crop_bottom, crop_left:crop_right]
+        output = self._forward([crop])[0]
+        pixels = numpy.array(image, copy=True)
+        pixels[top:bottom, left:right] = output[
+            top - crop_top:bottom - crop_top,
+            left - crop_left:right - crop_left
+        ]
+        return pixels
@@ -0,0 +1,219 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import collections
+import csv
+import json
+import os
+import resource
+import time
+
+from torch import nn
+from torch.autograd.graph import register_multi_grad_hook
+
+
+def _peak_rss_mb(who):
+    # Note, Linux reports `ru_maxrss` in kilobytes.
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class TrainingMonitor:
+    """
+    Records where the time goes in a training run: throughput, how long we
+    wait on the DataLoader vs. how long we spend computing, the forward time
+    of each layer & the backward time of the encoder & decoder, along with
+    peak memory. One record is written per epoch, as a JSON line or a CSV
+    row. Everything is timed with a couple of `perf_counter()` calls, so
+    this is cheap enough to leave on.
+    """
+    BACKWARD_MODULES = ("encoder", "decoder")
+
+    def __init__(self, fname, profile_modules=True):
+        """
+        Args:
+            fname (str): The file to write records to. Files ending in
+                ".csv" are written as CSV, & anything else as JSON lines.
+            profile_modules (bool): Whether to time individual modules.
+        """
+        self.fname = fname
+        self.profile_modules = profile_modules
+        os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+        self._fp = open(fname, "a", newline="")
+        self._csv_writer = None
+        self._handles = []
+        self._started = {}
+        self._reset()
+
+    def attach(self, model):
+        """
+        Hook into a model's `encoder` & `decoder`, to time the forward pass
+        of each of their layers, & the backward pass of each as a whole.
+        Note, we can't hook the backward pass of individual layers, as
+        backward hooks don't allow the in-place ReLUs that follow them, so
+        we time each whole from the gradient of its output arriving, until
+        the gradients of its input & parameters have all been computed.
+        Where the encoder or decoder is a `ModuleList` of levels, as in a
+        U-Net, it's never called itself, so we time each level instead,
+        e.g. as "encoder.0".
+        Args:
+            model (BaseAutoencoder): The model to hook into.
+        """
+        if not self.profile_modules:
+            return
+
+        for name in self.BACKWARD_MODULES:
+            module = getattr(model, name)
+            if isinstance(module, nn.ModuleList):
+                for level_name, level in module.named_children():
+                    self._hook_module(level, "{}.{}".format(name, level_name))
+            else:
+                self._hook_module(module, name)
+
+    def detach(self):
+        """
+        Remove all of our hooks from the model.
+        """
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def record_step(self, n_samples, wait_time, compute_time):
+        """
+        Record a training step.
+        Args:
+            n_samples (int): The number of samples in the step's batch.
+            wait_time (float): The seconds spent waiting on the DataLoader.
+            compute_time (float): The seconds spent on the step itself.
+        """
+        self._steps += 1
+        self._samples += n_samples
+        self._wait_time += wait_time
+        self._compute_time += compute_time
+
+    def end_epoch(self, epoch, **extra):
+        """
+        Write the record for an epoch, & start afresh for the next one.
+        Args:
+            epoch (int): The epoch that just finished.
+            extra (dict): Any other values to include in the record, e.g.
+                the loss.
+        """
+        elapsed = self._wait_time + self._compute_time
+        record = {
+            "epoch": epoch,
+            "time": time.time(),
+            "steps": self._steps,
+            "samples": self._samples,
+            "samples_per_sec": self._samples / elapsed if elapsed else 0.0,
+            "loader_wait_s": self._wait_time,
+            "compute_s": self._compute_time,
+            "loader_wait_fraction": self._wait_time / elapsed if elapsed else 0,
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN)
+        }
+        record.update(extra)
+        for phase, times in self._times.items():
+            for name, seconds in times.items():
+                record["{}_s.{}".format(phase, name)] = seconds
+
+        self._write(record)
+        self._reset()
+        return record
+
+    def close(self):
+        self.detach()
+        self._fp.close()
+
+    def _write(self, record):
+        if self.fname.endswith(".csv"):
+            if self._csv_writer is None:
+                self._csv_writer = csv.DictWriter(
+                    self._fp,
+                    fieldnames=list(record),
+                    extrasaction="ignore"
+                )
+                if self._fp.tell() == 0:
+                    self._csv_writer.writeheader()
+            self._csv_writer.writerow(record)
+        else:
+            self._fp.write(json.dumps(record) + "\n")
+
+        self._fp.flush()
+
+    def _reset(self):
+        self._steps = 0
+        self._samples = 0
+        self._wait_time = 0.0
+        self._compute_time = 0.0
+        self._times = {
+            "forward": collections.defaultdict(float),
+            "backward": collections.defaultdict(float)
+        }
+
+    def _hook_module(self, module, name):
+        for layer_name, layer in module.named_children():
+            self._hook_forward(layer, "{}.{}".format(name, layer_name))
+
+        self._handles.append(module.register_forward_hook(
+            self._backward_hook(name)
+        ))
+
+    def _hook_forward(self, module, name):
+        self._handles.append(module.register_forward_pre_hook(
+            self._start_hook(name)
+        ))
+        self._handles.append(module.register_forward_hook(
+            self._stop_hook(name, "forward")
+        ))
+
+    def _backward_hook(self, name):
+        # Module backward hooks fire as soon as their input's gradient is
+        # known, which for the encoder is immediately, as the input doesn't
+        # require one, so we hook the graph of each forward pass instead.
+        # Only the first input counts, as any others, like a U-Net's skip
+        # connections, also feed into layers we don't want to wait on.
+        def hook(module, inputs, output):
+            if not output.requires_grad:
+                return
+            tensors = [
+                tensor for tensor in inputs[:1] + tuple(module.parameters())
+                if tensor.requires_grad
+            ]
+            output.register_hook(self._start_hook(name))
+            register_multi_grad_hook(
+                tensors,
+                self._stop_hook(name, "backward")
+            )
+        return hook
+
+    def _start_hook(self, name):
+        def hook(*args):
+            self._started[name] = time.perf_counter()
+        return hook
+
+    def _stop_hook(self, name, phase):
+        def hook(*args):
+            started = self._started.pop(name, None)
+            if started is not None:
+                self._times[phase][name] += time.perf_counter() - started
+        return hook
@@ -24,9 +24,11 @@
 import torch
 from torch.utils.data import DataLoader
 
-from data import DeWatermarkerDataset
+from data import DeWatermarkerDataset, ToTensorCollate
 from autoencoder import ARCH0Autoencoder, ARCH1Autoencoder, ARCH2Autoencoder
-from utils import display 
+from instrumentation import TrainingMonitor
+from preview import PreviewSink
+from trainer import Trainer
 
 
 # Hyperparameters.
@@ -36,6 +38,11 @@ NUM_WORKERS = 4
 N_EPOCHS = 2000
 N_BATCHES = 10
 ETA = 1e-3
+CHECKPOINT_DIR = "checkpoints/arch_1"
+CHECKPOINT_EVERY = 100
+METRICS_FNAME = "checkpoints/arch_1.metrics.jsonl"
+PREVIEW_DIR = "checkpoints/arch_1.previews"
+PREVIEW_EVERY = 100
 
 
 # Data setup.
@@ -45,7 +52,8 @@ dataloader = DataLoader(
     dataset,
     batch_size=BATCH_SIZE,
     shuffle=SHUFFLE,
-    num_workers=NUM_WORKERS
+    num_workers=NUM_WORKERS,
+    collate_fn=ToTensorCollate()
 )
 
 
@@ -62,30 +70,22 @@ optimizer = torch.optim.Adam(
 )
 
 
-# Train.
-# TODO: Make this a method on the Autoencoder class.
-min_loss = float("inf")
-for epoch in range(N_EPOCHS):
-    for i_batch, sample_batched in enumerate(dataloader):
-        watermarked = sample_batched["watermarked"]
-        original = sample_batched["original"]
-        original = model.resize(sample=original)
-        # NOTE: This resizing operation is __inverting__ the colours.
-        # It's fine given that our task is still to remove watermarks, but
-        # we'll want to fix this going forwards.
-
-        output = model(x=watermarked)
-        loss = criterion(output, original)
-
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
-
-    # TODO: Move this into `debug()` method.
-    if epoch == 0 or epoch % 100 == 0:
-        print(">> epoch # {}: {}".format(epoch, loss.data))
-        display(output)
-        if loss < min_loss:
-            print(">> updating weights.")
-            model.save()
-            min_loss = loss
+# Train. If we've been interrupted, we'll pick up from the last checkpoint.
+trainer = Trainer(
+    model=model,
+    optimizer=optimizer,
+    dataloader=dataloader,
+    criterion=criterion,
+    checkpoint_dir=CHECKPOINT_DIR,
+    checkpoint_every=CHECKPOINT_EVERY,
+    preview=PreviewSink(run_dir=PREVIEW_DIR, every=PREVIEW_EVERY),
+    monitor=TrainingMonitor(fname=METRICS_FNAME)
+)
+try:
+    trainer.resume()
+    trainer.fit(n_epochs=N_EPOCHS)
+finally:
+    # Even if we're interrupted, flush the previews & metrics we've got.
+    trainer.preview.close()
+    trainer.monitor.close()
+    trainer.close()
@@ -0,0 +1,162 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import queue
+import threading
+
+import numpy
+import torch
+
+from PIL import Image
+
+from data import DEFAULT_SCALE
+
+
+class PreviewSink:
+    """
+    Saves previews of a model's output during training, as PNG contact
+    sheets with a row per sample: the watermarked input, the model's output,
+    & the original. Encoding & writing happen on a background thread, & if
+    the thread falls behind, previews are dropped rather than making
+    training wait.
+    """
+    FNAME = "preview-{:06d}.png"
+
+    def __init__(
+        self,
+        run_dir,
+        every=100,
+        max_images=4,
+        scale=DEFAULT_SCALE,
+        max_pending=2
+    ):
+        """
+        Args:
+            run_dir (str): The directory to write previews to.
+            every (int): The number of epochs between previews.
+            max_images (int): The maximum number of samples per preview.
+            scale (float): The scale that pixel values were trained on, as
+                given to `data.ToTensorCollate`.
+            max_pending (int): The number of previews that can be waiting to
+                be written before we start dropping them.
+        """
+        self.run_dir = run_dir
+        self.every = every
+        self.max_images = max_images
+        self.scale = scale
+        self.n_dropped = 0
+        self._error = None
+        os.makedirs(run_dir, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, epoch, output, batch=None):
+        """
+        Queue a preview of the model's output, if one is due this epoch.
+        Only a detached copy of the first few samples is kept, so this is
+        cheap enough to call every epoch.
+        Args:
+            epoch (int): The current epoch.
+            output (Tensor): The model's (N, C, H, W) output on a batch.
+            batch (dict of Tensor): Optionally, the batch that the output
+                was produced from, to show alongside it.
+        """
+        self._raise_error()
+        if epoch % self.every != 0:
+            return False
+
+        images = [output]
+        if batch is not None:
+            images = [batch["watermarked"], output, batch["original"]]
+        images = [
+            image[:self.max_images].detach().to("cpu", copy=True)
+            for image in images
+        ]
+
+        try:
+            self._queue.put_nowait((epoch, images))
+        except queue.Full:
+            self.n_dropped += 1
+            return False
+
+        return True
+
+    def close(self):
+        """
+        Write any queued previews, & stop the background thread.
+        """
+        # The queue may be full, so we keep offering the sentinel while the
+        # thread drains it, & give up if the thread has already exited
+        while self._thread.is_alive():
+            try:
+                self._queue.put((None, None), timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._thread.join()
+        self._raise_error()
+
+    def _run(self):
+        while True:
+            epoch, images = self._queue.get()
+            if epoch is None:
+                return
+
+            # A failed preview shouldn't stop later ones, so we keep going
+            # & report the error from the training thread
+            try:
+                sheet = self._contact_sheet(images)
+                fname = os.path.join(self.run_dir, self.FNAME.format(epoch))
+                sheet.save(fname + ".tmp", format="PNG")
+                os.replace(fname + ".tmp", fname)
+            except Exception as error:
+                self._error = error
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Failed to write preview.") from error
+
+    def _contact_sheet(self, images):
+        """
+        Lay out a grid of images, with a row per sample, & a column for
+        each of the given batches.
+        """
+        columns = [self._to_pixels(image) for image in images]
+        rows = [numpy.concatenate(row, axis=1) for row in zip(*columns)]
+        return Image.fromarray(numpy.concatenate(rows, axis=0))
+
+    def _to_pixels(self, images):
+        """
+        Convert a batch to (N, H, W, 3) uint8 pixels. Float batches are
+        (N, C, H, W) at our scale, as is the model's output, while uint8
+        batches are still (N, H, W, C), straight from the dataset.
+        """
+        if images.is_floating_point():
+            images = images.permute(0, 2, 3, 1) / self.scale
+            images = images.clamp(0, 255).round().to(torch.uint8)
+
+        return images.numpy()
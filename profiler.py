@@ -0,0 +1,232 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import json
+import statistics
+import time
+import weakref
+
+import torch
+from torch import nn
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from autoencoder import ARCHITECTURES
+
+
+class _ActivationMemory(TorchDispatchMode):
+    """
+    Tracks the bytes held by every tensor created while it's active, &
+    the most that were ever alive at once. Parameters exist before we
+    start, so they aren't counted, only the activations (& any scratch
+    tensors the ops allocate).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.current = 0
+        self.peak = 0
+        self._live = {}
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        output = func(*args, **(kwargs or {}))
+        for tensor in tree_flatten(output)[0]:
+            if not isinstance(tensor, torch.Tensor):
+                continue
+
+            # Views & in-place ops hand back storage we've already seen.
+            storage = tensor.untyped_storage()
+            key = storage.data_ptr()
+            if key in self._live:
+                continue
+
+            self._live[key] = storage.nbytes()
+            self.current += storage.nbytes()
+            self.peak = max(self.peak, self.current)
+            weakref.finalize(storage, self._free, key)
+
+        return output
+
+    def _free(self, key):
+        self.current -= self._live.pop(key, 0)
+
+
+def count_macs(model, x):
+    """
+    Count the multiply-accumulates in a forward pass of the given model,
+    over its convolutions (which is where nearly all of its compute goes).
+    Args:
+        model (Module): The model to count the MACs of.
+        x (Tensor): The input to run the model on.
+    """
+    macs = 0
+
+    def hook(module, inputs, output):
+        nonlocal macs
+        kernel = module.weight[0, 0].numel()
+        if isinstance(module, nn.ConvTranspose2d):
+            # Each input element is scattered through the whole kernel.
+            per_element = module.out_channels // module.groups * kernel
+            macs += inputs[0].numel() * per_element
+        else:
+            per_element = module.in_channels // module.groups * kernel
+            macs += output.numel() * per_element
+
+    handles = [
+        module.register_forward_hook(hook)
+        for module in model.modules()
+        if isinstance(module, (nn.Conv2d, nn.ConvTranspose2d))
+    ]
+    try:
+        with torch.no_grad():
+            model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return macs
+
+
+def peak_activation_memory(model, x):
+    """
+    Measure the most memory held by activations at any one point during
+    a forward pass of the given model, in bytes.
+    Args:
+        model (Module): The model to measure.
+        x (Tensor): The input to run the model on.
+    """
+    with torch.no_grad(), _ActivationMemory() as memory:
+        model(x)
+
+    return memory.peak
+
+
+def measure_latency(model, x, n_runs=5):
+    """
+    Get the median time a forward pass of the given model takes, after a
+    warm-up run.
+    Args:
+        model (Module): The model to time.
+        x (Tensor): The input to run the model on.
+        n_runs (int): The number of runs to take the median over.
+    """
+    times = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(n_runs):
+            start = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - start)
+
+    return statistics.median(times)
+
+
+def profile(archs=None, resolutions=(128, 256, 512), n_runs=5, channels=3):
+    """
+    Profile the given architectures at each of the given resolutions.
+    Returns a row of results per architecture & resolution, with its
+    parameter count, MACs, peak activation memory (in bytes) & median CPU
+    latency (in seconds) on a single, square image.
+    Args:
+        archs (list of str): The architectures to profile. Default is
+            every registered architecture.
+        resolutions (iterable of int): The image sizes to profile at.
+        n_runs (int): The number of runs to take the median latency over.
+        channels (int): The number of channels in the images.
+    """
+    results = []
+    for arch in archs or ARCHITECTURES:
+        model = ARCHITECTURES[arch]((1, 1, channels)).eval()
+        n_params = sum(param.numel() for param in model.parameters())
+        for resolution in resolutions:
+            x = torch.rand(1, channels, resolution, resolution)
+            results.append({
+                "arch": arch,
+                "resolution": resolution,
+                "params": n_params,
+                "macs": count_macs(model, x),
+                "peak_memory": peak_activation_memory(model, x),
+                "latency": measure_latency(model, x, n_runs=n_runs)
+            })
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Profile the cost of each autoencoder architecture."
+    )
+    parser.add_argument(
+        "--arch",
+        nargs="+",
+        choices=ARCHITECTURES,
+        help="The architectures to profile. Default is all of them."
+    )
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=int,
+        default=[128, 256, 512]
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--threads", type=int, help="CPU threads to use.")
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the results as JSON, rather than a table."
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = profile(
+        archs=args.arch,
+        resolutions=args.resolutions,
+        n_runs=args.runs
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    print("{:>6} {:>6} {:>10} {:>10} {:>12} {:>12}".format(
+        "arch", "size", "params", "GMACs", "peak mem MB", "latency ms"
+    ))
+    for result in results:
+        print("{:>6} {:>6} {:>10} {:>10.3f} {:>12.2f} {:>12.2f}".format(
+            result["arch"],
+            result["resolution"],
+            result["params"],
+            result["macs"] / 1e9,
+            result["peak_memory"] / 2 ** 20,
+            result["latency"] * 1000
+        ))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import os
+
+import torch
+import torch.nn as nn
+
+from torch.utils.data import DataLoader
+
+from autoencoder import ARCHITECTURES, ConvAutoencoder
+from data import DeWatermarkerDataset, ToTensorCollate
+from inference import load_model
+from quantize import evaluate
+from trainer import Trainer
+
+
+# The ways we can rank channels by.
+METHODS = ("l1", "activation")
+
+
+def _layers(model):
+    """
+    Get the convolutions of a plain convolutional autoencoder (i.e. ARCH0-3,
+    or an already pruned model), in the order they're applied. Each layer's
+    output channels are the next layer's input channels, across the
+    encoder/decoder boundary, too.
+    """
+    layers = []
+    for half, layer_type in [
+        (model.encoder, nn.Conv2d),
+        (model.decoder, nn.ConvTranspose2d)
+    ]:
+        for layer in half:
+            if isinstance(layer, (nn.Conv2d, nn.ConvTranspose2d)):
+                if type(layer) is not layer_type or layer.groups != 1:
+                    raise ValueError(
+                        "Only plain convolutional autoencoders can be pruned."
+                    )
+                layers.append(layer)
+            elif not isinstance(layer, nn.ReLU):
+                raise ValueError(
+                    "Only plain convolutional autoencoders can be pruned."
+                )
+
+    return layers
+
+
+def _out_dim(layer):
+    # Transposed convolution weights are (in, out, ...), & convolution
+    # weights (out, in, ...).
+    return 1 if isinstance(layer, nn.ConvTranspose2d) else 0
+
+
+def channel_importance(
+    model,
+    method="l1",
+    dataloader=None,
+    n_batches=None
+):
+    """
+    Score the output channels of each of a model's layers, but the last
+    (whose outputs are the image). Returns a tensor of scores per layer,
+    where higher is more important.
+    Args:
+        model (Module): The plain convolutional autoencoder to score.
+        method (str): Either "l1", to score channels by the L1 norm of their
+            weights, or "activation", to score them by their mean activation
+            over a sample of the data.
+        dataloader (iterable of dict): Batches to measure activations over,
+            as collated by `data.ToTensorCollate`. Only needed for
+            "activation".
+        n_batches (int): Optionally, the number of batches to use.
+    """
+    layers = _layers(model)[:-1]
+    if method == "l1":
+        return [
+            layer.weight.detach().abs().transpose(0, _out_dim(layer))
+            .flatten(1).sum(1)
+            for layer in layers
+        ]
+    if method != "activation":
+        raise ValueError("Unknown method {!r}.".format(method))
+
+    # Every layer is followed by a ReLU, so its mean activation is the mean
+    # of its rectified output.
+    totals = [0] * len(layers)
+
+    def hook(index):
+        def record(module, inputs, output):
+            totals[index] += output.detach().relu().mean(dim=(0, 2, 3))
+
+        return record
+
+    handles = [
+        layer.register_forward_hook(hook(index))
+        for index, layer in enumerate(layers)
+    ]
+    model.eval()
+    try:
+        with torch.no_grad():
+            for index, batch in enumerate(dataloader):
+                if n_batches is not None and index >= n_batches:
+                    break
+                model(batch["watermarked"])
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return totals
+
+
+def prune(model, sparsity, importance):
+    """
+    Remove the least important channels from each layer of a model, but
+    the last. Returns a new, smaller, dense model with the channels that
+    are left, while the given model is untouched.
+    Args:
+        model (Module): The plain convolutional autoencoder to prune.
+        sparsity (float): The fraction of each layer's channels to remove.
+            At least one channel is always kept.
+        importance (list of Tensor): The score of each layer's channels, as
+            returned by `channel_importance()`.
+    """
+    layers = _layers(model)
+    keep = []
+    for scores in importance:
+        n_kept = max(round(len(scores) * (1 - sparsity)), 1)
+        keep.append(scores.argsort(descending=True)[:n_kept].sort().values)
+
+    # The input & output channels are the image's, so they're all kept.
+    in_channels = layers[0].in_channels
+    out_channels = layers[-1].out_channels
+    keep = [torch.arange(in_channels)] + keep + [torch.arange(out_channels)]
+    n_encoder = sum(isinstance(layer, nn.Conv2d) for layer in layers)
+    widths = [len(kept) for kept in keep[1:-1]]
+    pruned = ConvAutoencoder(
+        inpt_shape=(None, None, in_channels),
+        encoder_widths=widths[:n_encoder],
+        decoder_widths=widths[n_encoder:],
+        kernel_size=layers[0].kernel_size[0]
+    )
+
+    with torch.no_grad():
+        for layer, new_layer, kept_in, kept_out in zip(
+            layers,
+            _layers(pruned),
+            keep,
+            keep[1:]
+        ):
+            weight = layer.weight.index_select(_out_dim(layer), kept_out)
+            weight = weight.index_select(1 - _out_dim(layer), kept_in)
+            new_layer.weight.copy_(weight)
+            if layer.bias is not None:
+                new_layer.bias.copy_(layer.bias[kept_out])
+
+    return pruned.eval()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prune channels from a trained autoencoder."
+    )
+    parser.add_argument("--arch", default="ARCH2", choices=ARCHITECTURES)
+    parser.add_argument(
+        "--checkpoint",
+        help="The weights to prune. Default is the architecture's FPATH."
+    )
+    parser.add_argument("--dataset", default="data/training/set")
+    parser.add_argument(
+        "--sparsities",
+        nargs="+",
+        type=float,
+        default=[0.25, 0.5, 0.75],
+        help="The fractions of channels to remove, each saved separately."
+    )
+    parser.add_argument("--method", default="l1", choices=METHODS)
+    parser.add_argument(
+        "--calibration-batches",
+        type=int,
+        default=32,
+        help="The number of batches to measure activations over."
+    )
+    parser.add_argument(
+        "--finetune-epochs",
+        type=int,
+        default=0,
+        help="The number of epochs to fine-tune each pruned model for."
+    )
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--eta", type=float, default=1e-4)
+    parser.add_argument("--num-workers", type=int, default=0)
+    parser.add_argument("--checkpoint-dir", default="checkpoints/prune")
+    parser.add_argument(
+        "--eval-batches",
+        type=int,
+        default=32,
+        help="The number of batches to compare the models on."
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    dataset = DeWatermarkerDataset(root_dir=args.dataset)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        generator=torch.Generator().manual_seed(0),
+        num_workers=args.num_workers,
+        collate_fn=ToTensorCollate()
+    )
+
+    channels = dataset[0]["watermarked"].shape[-1]
+    model = load_model(
+        arch=args.arch,
+        checkpoint=args.checkpoint,
+        channels=channels
+    )
+    importance = channel_importance(
+        model=model,
+        method=args.method,
+        dataloader=dataloader,
+        n_batches=args.calibration_batches
+    )
+
+    stem, ext = os.path.splitext(args.checkpoint or model.FPATH)
+    models = {"dense": model}
+    for sparsity in args.sparsities:
+        name = "pruned-{:d}".format(round(sparsity * 100))
+        pruned = prune(model=model, sparsity=sparsity, importance=importance)
+        pruned.FPATH = "{}.{}{}".format(stem, name, ext)
+        if args.finetune_epochs:
+            trainer = Trainer(
+                model=pruned,
+                optimizer=torch.optim.Adam(pruned.parameters(), lr=args.eta),
+                dataloader=dataloader,
+                checkpoint_dir=os.path.join(args.checkpoint_dir, name),
+                checkpoint_every=args.finetune_epochs
+            )
+            trainer.fit(n_epochs=args.finetune_epochs)
+            trainer.wait()
+            pruned.eval()
+
+        pruned.save()
+        print("Saved {} ({} -> {} channels)".format(
+            pruned.FPATH,
+            " ".join(str(layer.out_channels) for layer in _layers(model)),
+            " ".join(str(layer.out_channels) for layer in _layers(pruned))
+        ))
+        models[name] = pruned
+
+    results = evaluate(
+        models=models,
+        dataloader=dataloader,
+        n_batches=args.eval_batches
+    )
+    dense = results[0]
+    for result in results:
+        print(
+            "{:>10}  PSNR {:6.2f}dB ({:+.2f})  latency {:8.2f}ms ({:.2f}x)  "
+            "size {:7.2f}MB ({:.2f}x)".format(
+                result["model"],
+                result["psnr"],
+                result["psnr"] - dense["psnr"],
+                result["latency"] * 1000,
+                dense["latency"] / result["latency"],
+                result["size"] / 2 ** 20,
+                dense["size"] / result["size"]
+            )
+        )
+    return models, results
+
+
+if __name__ == "__main__":
+    main()
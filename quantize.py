@@ -0,0 +1,339 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import copy
+import io
+import math
+import os
+import statistics
+import time
+import warnings
+
+import torch
+import torch.ao.quantization as quantization
+import torch.nn as nn
+
+from torch.utils.data import DataLoader
+
+from autoencoder import ARCHITECTURES
+from data import DeWatermarkerDataset, ToTensorCollate
+
+
+# Post-training int8 quantization of our autoencoders, for CPU inference:
+#   python quantize.py --arch ARCH1 --checkpoint arch_1.pt \
+#       --dataset data/training/set
+# This calibrates on a sample of the dataset, saves the quantized weights
+# next to the float ones (e.g. arch_1.int8.pt), & reports how much quality
+# we lose against how much faster & smaller the model gets.
+
+
+def _default_backend():
+    # Note, the x86 engine's quantized ConvTranspose2d gives badly wrong
+    # results (while its Conv2d is fine), so we stick with fbgemm.
+    engines = torch.backends.quantized.supported_engines
+    return "fbgemm" if "fbgemm" in engines else "qnnpack"
+
+
+def quantized_fpath(fpath):
+    """
+    Get where the int8 version of the given weights is saved.
+    """
+    return "{}.int8{}".format(*os.path.splitext(fpath))
+
+
+class QuantizedAutoencoder(nn.Module):
+    """
+    An int8 version of one of our autoencoders. Each Conv2d is fused with
+    the ReLU after it, & the activations between layers are quantized, with
+    scales calibrated on real data. The model is built in three steps:
+    wrapping the float model, running `calibrate()` on a sample of data, &
+    then `convert()`. Once converted, it can be saved & loaded just like a
+    `BaseAutoencoder`.
+    """
+
+    def __init__(self, model, backend=None):
+        """
+        Args:
+            model (BaseAutoencoder): The trained float model. It's copied,
+                rather than modified.
+            backend (str): The quantized engine to target. Default is
+                fbgemm, where it's supported.
+        """
+        if not model.QUANTIZABLE:
+            raise ValueError(
+                "{} has layers without int8 versions, so can't be "
+                "quantized.".format(type(model).__name__)
+            )
+
+        super().__init__()
+        self.backend = backend or _default_backend()
+        self.FPATH = quantized_fpath(model.FPATH)
+        self.quant = quantization.QuantStub()
+        self.model = copy.deepcopy(model).eval()
+        self.dequant = quantization.DeQuantStub()
+        self.converted = False
+        self.margin = model.receptive_margin()
+        self.ALIGNMENT = model.ALIGNMENT
+        self.eval()
+
+        # Quantized ConvTranspose2d layers only support per-tensor weights.
+        self.qconfig = quantization.get_default_qconfig(self.backend)
+        transposed_qconfig = quantization.QConfig(
+            activation=self.qconfig.activation,
+            weight=quantization.default_weight_observer
+        )
+        for layer in self.model.modules():
+            if isinstance(layer, nn.ConvTranspose2d):
+                layer.qconfig = transposed_qconfig
+
+        quantization.fuse_modules(
+            self.model,
+            self._fusable(self.model),
+            inplace=True
+        )
+        torch.backends.quantized.engine = self.backend
+        quantization.prepare(self, inplace=True)
+
+    def forward(self, x):
+        """
+        Perform the forward pass on the given input.
+        Args:
+            x (Tensor): The input to perform the forward pass on.
+        """
+        x = self.quant(self.model.resize(x))
+        return self.dequant(self.model(x))
+
+    def calibrate(self, dataloader, n_batches=None):
+        """
+        Record the range of the activations on some data, to choose their
+        quantization scales from.
+        Args:
+            dataloader (iterable of dict): Batches to calibrate on, as
+                collated by `data.ToTensorCollate`.
+            n_batches (int): Optionally, the number of batches to use.
+        """
+        with torch.no_grad():
+            for index, batch in enumerate(dataloader):
+                if n_batches is not None and index >= n_batches:
+                    break
+                self(batch["watermarked"])
+
+        return self
+
+    def convert(self):
+        """
+        Swap the calibrated layers for their int8 versions.
+        """
+        torch.backends.quantized.engine = self.backend
+        quantization.convert(self, inplace=True)
+        self.converted = True
+        return self
+
+    def receptive_margin(self):
+        # The int8 layers aren't convolutions as far as the float model's
+        # `receptive_margin()` is concerned, so we remember it from before.
+        return self.margin
+
+    def load(self):
+        """
+        Load in the quantized weights belonging to this model.
+        """
+        if not self.converted:
+            # The quantization scales are loaded along with the weights, so
+            # there's no need to calibrate first.
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                self.convert()
+
+        self.load_state_dict(torch.load(self.FPATH))
+        self.eval()
+
+    def save(self):
+        """
+        Save the current state of this model.
+        """
+        torch.save(self.state_dict(), self.FPATH)
+
+    @classmethod
+    def _fusable(cls, model):
+        """
+        Find the names of every (Conv2d, ReLU) pair in the model.
+        """
+        pairs = []
+        for name, module in model.named_modules():
+            children = list(module.named_children())
+            for (first, layer), (second, activation) in zip(
+                children,
+                children[1:]
+            ):
+                if isinstance(layer, nn.Conv2d) and \
+                        isinstance(activation, nn.ReLU):
+                    prefix = name + "." if name else ""
+                    pairs.append([prefix + first, prefix + second])
+
+        return pairs
+
+
+def model_size(model):
+    """
+    Get the size of a model's serialized weights, in bytes.
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def evaluate(models, dataloader, n_batches=None, n_runs=5):
+    """
+    Compare models by their reconstruction quality, latency & size. Returns
+    a row of results per model, with the MSE & PSNR of its output against
+    the original images, the median time it takes per batch, & the size of
+    its weights.
+    Args:
+        models (dict of Module): The models to compare, by name.
+        dataloader (iterable of dict): Batches to evaluate on, as collated
+            by `data.ToTensorCollate` (so pixels are in [0, 1]).
+        n_batches (int): Optionally, the number of batches to use.
+        n_runs (int): The number of runs to take the median latency over.
+    """
+    batches = []
+    for index, batch in enumerate(dataloader):
+        if n_batches is not None and index >= n_batches:
+            break
+        batches.append(batch)
+
+    results = []
+    with torch.no_grad():
+        for name, model in models.items():
+            model.eval()
+            squared_error, n_pixels = 0.0, 0
+            for batch in batches:
+                output = model(batch["watermarked"]).clamp(0, 1)
+                squared_error += float(
+                    (output - batch["original"]).pow(2).sum()
+                )
+                n_pixels += batch["original"].numel()
+
+            times = []
+            for _ in range(n_runs):
+                start = time.perf_counter()
+                model(batches[0]["watermarked"])
+                times.append(time.perf_counter() - start)
+
+            mse = squared_error / n_pixels
+            results.append({
+                "model": name,
+                "mse": mse,
+                "psnr": 10 * math.log10(1 / mse) if mse else math.inf,
+                "latency": statistics.median(times),
+                "size": model_size(model)
+            })
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Quantize a trained autoencoder to int8."
+    )
+    parser.add_argument(
+        "--arch",
+        default="ARCH1",
+        choices=[
+            arch for arch, model in ARCHITECTURES.items() if model.QUANTIZABLE
+        ]
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="The float weights. Default is the architecture's FPATH."
+    )
+    parser.add_argument("--dataset", default="data/training/set")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument(
+        "--calibration-batches",
+        type=int,
+        default=32,
+        help="The number of batches to calibrate on."
+    )
+    parser.add_argument(
+        "--eval-batches",
+        type=int,
+        default=32,
+        help="The number of batches to compare the models on."
+    )
+    parser.add_argument("--backend", default=_default_backend())
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    # Imported here, as `inference` imports us, to load quantized models.
+    from inference import load_model
+
+    args = parse_args(argv)
+    model = load_model(arch=args.arch, checkpoint=args.checkpoint)
+    if args.checkpoint:
+        model.FPATH = args.checkpoint
+
+    dataset = DeWatermarkerDataset(root_dir=args.dataset)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=True,
+        generator=torch.Generator().manual_seed(0),
+        collate_fn=ToTensorCollate()
+    )
+
+    quantized = QuantizedAutoencoder(model, backend=args.backend)
+    quantized.calibrate(dataloader, n_batches=args.calibration_batches)
+    quantized.convert()
+    quantized.save()
+    print("Saved {}".format(quantized.FPATH))
+
+    results = evaluate(
+        models={"float": model, "int8": quantized},
+        dataloader=dataloader,
+        n_batches=args.eval_batches
+    )
+    for result in results:
+        print(
+            "{:>6}  MSE {:.6f}  PSNR {:6.2f}dB  latency {:8.2f}ms  "
+            "size {:7.2f}MB".format(
+                result["model"],
+                result["mse"],
+                result["psnr"],
+                result["latency"] * 1000,
+                result["size"] / 2 ** 20
+            )
+        )
+    float_result, int8_result = results
+    print("PSNR drop {:.2f}dB, {:.1f}x faster, {:.1f}x smaller".format(
+        float_result["psnr"] - int8_result["psnr"],
+        float_result["latency"] / int8_result["latency"],
+        float_result["size"] / int8_result["size"]
+    ))
+    return quantized, results
+
+
+if __name__ == "__main__":
+    main()
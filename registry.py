@@ -0,0 +1,166 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import collections
+import itertools
+import os
+import threading
+
+from autoencoder import ARCHITECTURES
+from inference import load_model
+from quantize import model_size, quantized_fpath
+
+
+class ModelRegistry:
+    """
+    LRU cache of models, ready for inference, by architecture & checkpoint.
+    Rather than building & loading a model for every use, each is loaded
+    once & handed out again until it's evicted, to keep the models we hold
+    within a memory budget. Float weights are memory-mapped (unless they're
+    in torch's legacy format), so loading is nearly free, & processes
+    serving the same checkpoint share its pages.
+    Note, models are shared between everyone who gets them from the
+    registry, so they mustn't be modified. The registry can be shared
+    between threads, & a model that's being loaded by one thread is waited
+    for by any others that want it, rather than loaded twice.
+    """
+    MEMORY_BUDGET = 2 ** 30
+
+    def __init__(self, root_dir=None, memory_budget=None, channels=3):
+        """
+        Args:
+            root_dir (str): Optionally, the directory relative checkpoint
+                paths (including the architectures' own `FPATH`s) are in.
+                Default is the working directory.
+            memory_budget (int): The most bytes of weights to hold. The most
+                recently used model is always kept, even if it's larger.
+            channels (int): The number of channels the models take.
+        """
+        self.root_dir = root_dir
+        self.memory_budget = memory_budget or self.MEMORY_BUDGET
+        self.channels = channels
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # A lock per model that's being loaded, held while loading it.
+        self._loading = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        """
+        The bytes of weights held by every model in the registry.
+        """
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def get(self, arch, checkpoint=None, quantized=False):
+        """
+        Get a model, in eval mode, loading it if it isn't already loaded.
+        Takes the same arguments as `inference.load_model()`. Raises a
+        FileNotFoundError if the checkpoint doesn't exist, rather than
+        handing out an untrained model.
+        """
+        fname = self.resolve(
+            arch=arch,
+            checkpoint=checkpoint,
+            quantized=quantized
+        )
+        key = (arch, fname, quantized)
+        with self._lock:
+            model = self._lookup(key)
+            if model is not None:
+                return model
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        # Loading can take a while, so we only hold the lock for this model
+        # while we do, & other models can be handed out in the meantime.
+        with loading:
+            with self._lock:
+                model = self._lookup(key)
+            if model is not None:
+                return model
+
+            try:
+                if not os.path.isfile(fname):
+                    raise FileNotFoundError(
+                        "No weights for {} at {}.".format(arch, fname)
+                    )
+
+                model = load_model(
+                    arch=arch,
+                    checkpoint=fname,
+                    channels=self.channels,
+                    quantized=quantized,
+                    mmap=not quantized
+                )
+                nbytes = self._nbytes(model, quantized)
+                with self._lock:
+                    self._entries[key] = (model, nbytes)
+                    self._evict()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+        return model
+
+    def resolve(self, arch, checkpoint=None, quantized=False):
+        """
+        Get the absolute path of the weights we'd load for a model.
+        """
+        if arch not in ARCHITECTURES:
+            raise KeyError("Unknown architecture {!r}.".format(arch))
+
+        fname = checkpoint or ARCHITECTURES[arch].FPATH
+        if quantized and not checkpoint:
+            fname = quantized_fpath(fname)
+
+        return os.path.abspath(os.path.join(self.root_dir or "", fname))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _evict(self):
+        while len(self._entries) > 1 and self.nbytes > self.memory_budget:
+            self._entries.popitem(last=False)
+
+    @classmethod
+    def _nbytes(cls, model, quantized):
+        # Packed int8 weights aren't parameters, so we measure those by
+        # their serialized size instead.
+        if quantized:
+            return model_size(model)
+
+        return sum(
+            tensor.nbytes
+            for tensor in itertools.chain(model.parameters(), model.buffers())
+        )
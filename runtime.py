@@ -0,0 +1,78 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+import torch
+
+
+# A minimal runtime for models exported with `export.py`. It only needs
+# torch (or onnxruntime, for ONNX models), & none of the training code, so
+# it's quick to start, & exported models do all of their pre & post
+# processing inside the graph, so there's no Python overhead per call.
+
+
+class ExportedModel:
+    """
+    Runs an exported model on CPU. Exported models take & return batches
+    of (N, H, W, C) uint8 images, of any size.
+    """
+
+    def __init__(self, fname, threads=None):
+        """
+        Args:
+            fname (str): The exported model. ONNX models (.onnx) are run with
+                ONNX Runtime, & anything else is loaded as TorchScript.
+            threads (int): Optionally, the number of threads to run with.
+        """
+        self.fname = fname
+        self.backend = "onnx" if fname.endswith(".onnx") else "torchscript"
+        if self.backend == "onnx":
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            self._session = onnxruntime.InferenceSession(
+                fname,
+                sess_options=options,
+                providers=["CPUExecutionProvider"]
+            )
+            self._input_name = self._session.get_inputs()[0].name
+        else:
+            if threads:
+                torch.set_num_threads(threads)
+            self._module = torch.jit.load(fname, map_location="cpu")
+
+    def __call__(self, images):
+        """
+        De-watermark a batch of images.
+        Args:
+            images (ndarray): A (N, H, W, C) uint8 batch of images.
+        """
+        images = numpy.ascontiguousarray(images, dtype=numpy.uint8)
+        if self.backend == "onnx":
+            return self._session.run(None, {self._input_name: images})[0]
+
+        with torch.inference_mode():
+            return self._module(torch.from_numpy(images)).numpy()
+
@@ -0,0 +1,514 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import asyncio
+import collections
+import functools
+import io
+import json
+import time
+import urllib.parse
+import weakref
+
+import numpy
+
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from autoencoder import ARCHITECTURES
+from inference import Dewatermarker
+from registry import ModelRegistry
+
+
+# A local HTTP service for de-watermarking, which keeps a model warm in
+# memory, e.g.
+#   python server.py --arch ARCH1 --checkpoint arch_1.pt --port 8080
+#   curl --data-binary @photo.jpg localhost:8080/dewatermark > cleaned.jpg
+#   curl localhost:8080/metrics
+# Other architectures' weights (from --models-dir) can be asked for, too,
+# & are loaded on first use, & kept within --memory-budget, e.g.
+#   curl --data-binary @photo.jpg \
+#       "localhost:8080/dewatermark?arch=ARCH3&quantized=1" > cleaned.jpg
+#
+# Concurrent requests for same-sized images (& the same model) are grouped
+# into micro-batches, so the model runs once per batch, rather than once per
+# request. The model (along with decoding & encoding) runs on executor
+# threads, so the event loop is always free to accept more requests.
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent latencies, to report percentiles over.
+    """
+
+    def __init__(self, maxlen=1000):
+        self.latencies = collections.deque(maxlen=maxlen)
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def percentiles(self, percentiles=(50, 90, 99)):
+        if not self.latencies:
+            return {"p{}".format(p): None for p in percentiles}
+
+        values = numpy.percentile(self.latencies, percentiles)
+        return {
+            "p{}".format(p): float(value)
+            for p, value in zip(percentiles, values)
+        }
+
+
+class MicroBatcher:
+    """
+    Groups concurrent requests for same-sized images into batches. A batch
+    is run as soon as it's full, or once its first request has waited for
+    `max_wait` seconds, whichever comes first.
+    """
+
+    def __init__(self, fn, executor, max_batch_size=8, max_wait=0.01):
+        """
+        Args:
+            fn (callable): Runs a batch, taking a list of same-sized images
+                & returning a list of results.
+            executor (Executor): Where to run batches.
+            max_batch_size (int): The maximum number of images per batch.
+            max_wait (float): The longest a request waits for a batch to
+                fill up, in seconds.
+        """
+        self.fn = fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_batches = 0
+        self.n_batched = 0
+        self.n_running = 0
+        self._pending = {}
+        self._timers = {}
+
+    @property
+    def queue_depth(self):
+        """
+        The number of requests waiting for their batch to run.
+        """
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def submit(self, image, fn=None):
+        """
+        Queue an image, & wait for its result.
+        Args:
+            image (ndarray): The (H, W, C) image.
+            fn (callable): Optionally, what to run the image's batch with,
+                instead of `fn`. Only images for the same function are
+                batched together.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (fn or self.fn, image.shape)
+        pending = self._pending.setdefault(key, [])
+        pending.append((image, future))
+        if len(pending) >= self.max_batch_size:
+            self._dispatch(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(
+                self.max_wait,
+                self._dispatch,
+                key
+            )
+
+        return await future
+
+    def _dispatch(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(key, [])
+        if batch:
+            asyncio.ensure_future(self._run(key[0], batch))
+
+    async def _run(self, fn, batch):
+        self.n_batches += 1
+        self.n_batched += len(batch)
+        self.n_running += 1
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self.executor,
+                fn,
+                [image for image, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.n_running -= 1
+
+
+class InferenceServer:
+    """
+    Serves de-watermarking over HTTP.
+      POST /dewatermark: Upload an image, & get it back de-watermarked, in
+        the same format (or ?format=png, etc.), by the default model (or
+        ?arch=ARCH3, &quantized=1 for its int8 weights, from the registry).
+      GET /metrics: Queue depth, batching & latency percentiles, as JSON.
+    """
+    MAX_BODY_SIZE = 64 * 2 ** 20
+
+    def __init__(
+        self,
+        dewatermarker,
+        max_batch_size=8,
+        max_wait=0.01,
+        io_workers=4,
+        registry=None,
+        tile_size=None
+    ):
+        """
+        Args:
+            dewatermarker (Dewatermarker): The default model to serve.
+            max_batch_size (int): The maximum number of images per batch.
+            max_wait (float): The longest a request waits for a batch to
+                fill up, in seconds.
+            io_workers (int): The number of threads to decode & encode
+                images (& load models) on.
+            registry (ModelRegistry): Optionally, where to get the models
+                that requests ask for by architecture. Without one, only the
+                default model is served.
+            tile_size (int): Optionally, the tile size to run models from
+                the registry with. See `Dewatermarker`.
+        """
+        # The model gets a thread of its own, so that batches run one at a
+        # time, each with all of torch's intra-op threads.
+        self._model_executor = ThreadPoolExecutor(max_workers=1)
+        self._io_executor = ThreadPoolExecutor(max_workers=io_workers)
+        self.batcher = MicroBatcher(
+            fn=dewatermarker,
+            executor=self._model_executor,
+            max_batch_size=max_batch_size,
+            max_wait=max_wait
+        )
+        self.registry = registry
+        self.tile_size = tile_size
+        # A de-watermarker per registry model, kept for as long as any batch
+        # needs it, so that requests for the same model are batched.
+        self._dewatermarkers = weakref.WeakValueDictionary()
+        self.latency = LatencyTracker()
+        self.n_requests = 0
+        self.n_errors = 0
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """
+        Start listening. Returns the (host, port) we're listening on.
+        """
+        self._server = await asyncio.start_server(
+            self._handle_connection,
+            host=host,
+            port=port
+        )
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._model_executor.shutdown()
+        self._io_executor.shutdown()
+
+    def metrics(self):
+        batcher = self.batcher
+        return {
+            "queue_depth": batcher.queue_depth,
+            "running_batches": batcher.n_running,
+            "requests": self.n_requests,
+            "errors": self.n_errors,
+            "batches": batcher.n_batches,
+            "mean_batch_size": (
+                batcher.n_batched / batcher.n_batches
+                if batcher.n_batches else None
+            ),
+            "latency": self.latency.percentiles()
+        }
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                request_line = request_line.decode("latin-1")
+                method, target, _ = request_line.split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > self.MAX_BODY_SIZE:
+                    await self._respond(writer, *self._error(
+                        HTTPError(413, "Images must be under 64MB.")
+                    ))
+                    break
+
+                body = await reader.readexactly(length)
+                status, content_type, payload = await self._route(
+                    method=method,
+                    target=target,
+                    body=body
+                )
+                await self._respond(writer, status, content_type, payload)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            if url.path == "/metrics":
+                if method != "GET":
+                    raise HTTPError(405, "Use GET.")
+                return 200, "application/json", json.dumps(self.metrics())
+
+            if url.path == "/dewatermark":
+                if method != "POST":
+                    raise HTTPError(405, "POST an image to de-watermark.")
+                return await self._dewatermark(
+                    body=body,
+                    image_format=query.get("format", [None])[0],
+                    arch=query.get("arch", [None])[0],
+                    quantized=query.get("quantized", ["0"])[0]
+                )
+
+            raise HTTPError(404, "No such endpoint.")
+        except HTTPError as e:
+            return self._error(e)
+        except Exception as e:
+            return self._error(HTTPError(500, repr(e)))
+
+    async def _dewatermark(
+        self,
+        body,
+        image_format=None,
+        arch=None,
+        quantized="0"
+    ):
+        start = time.perf_counter()
+        self.n_requests += 1
+        loop = asyncio.get_running_loop()
+        dewatermarker = None
+        if arch is not None:
+            dewatermarker = await self._dewatermarker(
+                arch=arch,
+                quantized=quantized.lower() in ("1", "true", "yes")
+            )
+        pixels, image_format = await loop.run_in_executor(
+            self._io_executor,
+            self._decode,
+            body,
+            image_format
+        )
+        output = await self.batcher.submit(pixels, fn=dewatermarker)
+        payload = await loop.run_in_executor(
+            self._io_executor,
+            self._encode,
+            output,
+            image_format
+        )
+        self.latency.record(time.perf_counter() - start)
+        return 200, Image.MIME.get(image_format, "image/png"), payload
+
+    async def _dewatermarker(self, arch, quantized):
+        """
+        Get a de-watermarker for a model from the registry, loading the
+        model on an I/O thread if it isn't already loaded.
+        """
+        if self.registry is None:
+            raise HTTPError(400, "Only the default model is served.")
+
+        loop = asyncio.get_running_loop()
+        try:
+            model = await loop.run_in_executor(
+                self._io_executor,
+                functools.partial(
+                    self.registry.get,
+                    arch=arch,
+                    quantized=quantized
+                )
+            )
+        except (KeyError, FileNotFoundError) as e:
+            raise HTTPError(404, "No such model: {}".format(e))
+        except ValueError as e:
+            raise HTTPError(400, "Couldn't load the model: {}".format(e))
+
+        # The model is kept alive by its de-watermarker, so its id can't be
+        # reused while it's in here.
+        dewatermarker = self._dewatermarkers.get(id(model))
+        if dewatermarker is None:
+            dewatermarker = Dewatermarker(model=model, tile_size=self.tile_size)
+            self._dewatermarkers[id(model)] = dewatermarker
+
+        return dewatermarker
+
+    def _error(self, error):
+        self.n_errors += 1
+        payload = json.dumps({"error": str(error)})
+        return error.status, "application/json", payload
+
+    @classmethod
+    def _decode(cls, body, image_format=None):
+        try:
+            with Image.open(io.BytesIO(body)) as image:
+                pixels = numpy.asarray(image.convert("RGB"))
+                image_format = image_format or image.format or "PNG"
+        except OSError as e:
+            raise HTTPError(400, "Couldn't read the image: {}".format(e))
+
+        return pixels, image_format.upper()
+
+    @classmethod
+    def _encode(cls, pixels, image_format):
+        buffer = io.BytesIO()
+        try:
+            Image.fromarray(pixels).save(buffer, format=image_format)
+        except (KeyError, OSError, ValueError) as e:
+            raise HTTPError(400, "Couldn't encode the image: {}".format(e))
+
+        return buffer.getvalue()
+
+    @classmethod
+    async def _respond(cls, writer, status, content_type, payload):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+
+        head = (
+            "HTTP/1.1 {} {}\r\n"
+            "Content-Type: {}\r\n"
+            "Content-Length: {}\r\n"
+            "\r\n"
+        ).format(status, STATUS_REASONS[status], content_type, len(payload))
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve de-watermarking over HTTP."
+    )
+    parser.add_argument("--arch", default="ARCH1", choices=ARCHITECTURES)
+    parser.add_argument(
+        "--checkpoint",
+        help="The weights to serve by default, relative to --models-dir. "
+             "Default is the architecture's FPATH."
+    )
+    parser.add_argument(
+        "--quantized",
+        action="store_true",
+        help="Serve int8 weights, as saved by quantize.py."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=0.01,
+        help="The longest a request waits for its batch to fill, in seconds."
+    )
+    parser.add_argument("--io-workers", type=int, default=4)
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=0,
+        help="Run the model on tiles of this size. Default is whole images."
+    )
+    parser.add_argument(
+        "--models-dir",
+        help="The directory the architectures' weights are in, for requests "
+             "that ask for one. Default is the working directory."
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=ModelRegistry.MEMORY_BUDGET // 2 ** 20,
+        help="The most MB of weights to keep loaded."
+    )
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    registry = ModelRegistry(
+        root_dir=args.models_dir,
+        memory_budget=args.memory_budget * 2 ** 20
+    )
+    model = registry.get(
+        arch=args.arch,
+        checkpoint=args.checkpoint,
+        quantized=args.quantized
+    )
+    server = InferenceServer(
+        dewatermarker=Dewatermarker(model=model, tile_size=args.tile_size),
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait,
+        io_workers=args.io_workers,
+        registry=registry,
+        tile_size=args.tile_size
+    )
+    host, port = await server.start(host=args.host, port=args.port)
+    print("Serving {} on http://{}:{}".format(args.arch, host, port))
+    await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(parse_args()))
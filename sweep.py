@@ -0,0 +1,604 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import random
+import time
+
+import numpy
+import torch
+import torch.multiprocessing as mp
+
+from torch.utils.data import DataLoader, Dataset, Subset
+
+from autoencoder import ARCHITECTURES
+from data import DeWatermarkerDataset, ToTensorCollate
+from distributed import process_cpus
+from trainer import Trainer
+
+
+# Hyperparameter search across CPU cores. Each trial trains in its own
+# process, with its torch threads (& optionally CPUs) pinned to its share of
+# the machine, & every trial reads from one copy of the dataset in shared
+# memory. Trials are run in rounds of successive halving: every surviving
+# trial is trained up to the round's number of epochs & scored on held-out
+# data, & only the best 1 / `--reduction` of them go on to the next round.
+#
+# To try two architectures & three learning rates, on 4 trials at a time:
+#   python sweep.py --parallel 4 --space arch=ARCH1,ARCH3 \
+#       eta=1e-2,1e-3,1e-4
+# To try 16 random settings instead:
+#   python sweep.py --search random --trials 16 --space arch=ARCH1,ARCH3 \
+#       eta=log:1e-4:1e-2 weight_decay=log:1e-6:1e-4 batch_size=2:16
+
+
+# The hyperparameters we can search over, with their types & defaults (as
+# in `nnet.py`).
+PARAMS = {
+    "arch": (str, "ARCH1"),
+    "batch_size": (int, 4),
+    "eta": (float, 1e-3),
+    "weight_decay": (float, 1e-5)
+}
+SUMMARY_FNAME = "summary.csv"
+TRIAL_DIR = "trial-{:03d}"
+# The statuses of trials that stop early without a usable score.
+FAILED_STATUSES = ("diverged", "failed")
+
+
+class SharedDataset(Dataset):
+    """
+    An in-memory copy of a dataset, packed into a single buffer in shared
+    memory. Passing it to another process (e.g. through a
+    `torch.multiprocessing` pool) only sends a handle to the buffer, so any
+    number of processes can read the same copy of the data. Samples are
+    views onto the buffer, which must be treated as read-only.
+    """
+    IMAGE_KEYS = ("watermarked", "original")
+
+    def __init__(self, dataset):
+        """
+        Args:
+            dataset (Dataset): The dataset to copy, e.g. a
+                `DeWatermarkerDataset`. Every sample is read once.
+        """
+        samples = [
+            [numpy.asarray(dataset[index][key]) for key in self.IMAGE_KEYS]
+            for index in range(len(dataset))
+        ]
+        self.shapes = [
+            [image.shape for image in sample] for sample in samples
+        ]
+        n_bytes = sum(image.nbytes for sample in samples for image in sample)
+        self.buffer = torch.empty(n_bytes, dtype=torch.uint8).share_memory_()
+
+        array = self.buffer.numpy()
+        self.offsets = []
+        offset = 0
+        for sample in samples:
+            self.offsets.append([])
+            for image in sample:
+                if image.dtype != numpy.uint8:
+                    raise ValueError("Shared datasets only support uint8.")
+                array[offset:offset + image.nbytes] = image.reshape(-1)
+                self.offsets[-1].append(offset)
+                offset += image.nbytes
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        array = self.buffer.numpy()
+        sample = {}
+        for key, offset, shape in zip(
+            self.IMAGE_KEYS,
+            self.offsets[index],
+            self.shapes[index]
+        ):
+            n_bytes = int(numpy.prod(shape))
+            sample[key] = array[offset:offset + n_bytes].reshape(shape)
+
+        return sample
+
+
+def parse_space(specs):
+    """
+    Parse a search space, from "name=spec" strings. A spec is either a
+    comma-separated list of values to choose from, "low:high" for a uniform
+    range, or "log:low:high" for a log-uniform one. Only lists of values can
+    be searched by grid. Returns a dict of name to either a list of values,
+    or a (low, high, log) range.
+    Args:
+        specs (list of str): The spec of each hyperparameter to search.
+    """
+    space = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMS or not values:
+            raise ValueError("Expected one of {}=SPEC, got {!r}.".format(
+                "/".join(PARAMS),
+                spec
+            ))
+
+        cast = PARAMS[name][0]
+        parts = values.split(":")
+        if len(parts) == 1:
+            space[name] = [cast(value) for value in values.split(",")]
+        elif cast is str or len(parts) > 3 or (
+            len(parts) == 3 and parts[0] != "log"
+        ):
+            raise ValueError("Invalid range for {}: {!r}.".format(
+                name,
+                values
+            ))
+        else:
+            space[name] = (
+                float(parts[-2]),
+                float(parts[-1]),
+                len(parts) == 3
+            )
+
+    for arch in space.get("arch", []):
+        if arch not in ARCHITECTURES:
+            raise ValueError("Unknown architecture {!r}.".format(arch))
+
+    return space
+
+
+def grid_configs(space):
+    """
+    Get every combination of the values in a search space. Anything not in
+    the space keeps its default.
+    Args:
+        space (dict): The search space, as returned by `parse_space()`.
+    """
+    if any(isinstance(values, tuple) for values in space.values()):
+        raise ValueError("Ranges can only be searched at random.")
+
+    defaults = {name: default for name, (_, default) in PARAMS.items()}
+    names = list(space)
+    return [
+        dict(defaults, **dict(zip(names, values)))
+        for values in itertools.product(*(space[name] for name in names))
+    ]
+
+
+def random_configs(space, n_trials, seed=0):
+    """
+    Sample configurations from a search space at random. Anything not in
+    the space keeps its default.
+    Args:
+        space (dict): The search space, as returned by `parse_space()`.
+        n_trials (int): The number of configurations to sample.
+        seed (int): The seed to sample with.
+    """
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(n_trials):
+        config = {name: default for name, (_, default) in PARAMS.items()}
+        for name, values in space.items():
+            if isinstance(values, list):
+                config[name] = rng.choice(values)
+                continue
+
+            low, high, log = values
+            if log:
+                value = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                value = rng.uniform(low, high)
+            if PARAMS[name][0] is int:
+                value = round(value)
+            config[name] = value
+        configs.append(config)
+
+    return configs
+
+
+def schedule(min_epochs, max_epochs, reduction):
+    """
+    Get the number of epochs each round of successive halving trains up
+    to. Each round trains `reduction` times longer than the last, & the last
+    round always trains for `max_epochs`.
+    """
+    if min_epochs < 1 or reduction < 2:
+        raise ValueError(
+            "Rounds must train for at least 1 epoch, & cut the trials by a "
+            "factor of at least 2."
+        )
+
+    budgets = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        budgets.append(epochs)
+        epochs *= reduction
+
+    return budgets + [max_epochs]
+
+
+# The dataset & validation indices, in each worker process.
+_worker_state = {}
+
+
+def _init_worker(dataset, val_indices, threads, pin, slots, n_slots):
+    """
+    Set up a worker process. Each takes the next free slot, which decides
+    its share of CPUs when pinning.
+    """
+    with slots.get_lock():
+        slot = slots.value
+        slots.value += 1
+
+    if pin:
+        cpus = process_cpus(local_rank=slot % n_slots, nprocs=n_slots)
+        os.sched_setaffinity(0, cpus)
+        threads = len(cpus)
+    torch.set_num_threads(threads)
+
+    held_out = set(val_indices)
+    _worker_state["train"] = Subset(
+        dataset,
+        [index for index in range(len(dataset)) if index not in held_out]
+    )
+    _worker_state["val"] = Subset(dataset, val_indices)
+
+
+def _validation_loss(model, dataset, batch_size):
+    """
+    Get a model's mean squared error over a dataset.
+    """
+    dataloader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        collate_fn=ToTensorCollate()
+    )
+    model.eval()
+    squared_error, n_values = 0.0, 0
+    with torch.no_grad():
+        for batch in dataloader:
+            output = model(batch["watermarked"])
+            squared_error += float(
+                (output - batch["original"]).pow(2).sum()
+            )
+            n_values += batch["original"].numel()
+
+    return squared_error / n_values
+
+
+def run_trial(trial, config, n_epochs, trial_dir, seed=0):
+    """
+    Train a trial up to the given number of epochs, picking up from where
+    its last round left off, & score it on the held-out data. This runs in
+    a worker process. A trial that raises an error, or whose loss isn't
+    finite, is scored as infinitely bad, with the error, rather than
+    stopping the sweep.
+    Args:
+        trial (int): The trial's number.
+        config (dict): The trial's hyperparameters.
+        n_epochs (int): The total number of epochs to train up to.
+        trial_dir (str): The directory to keep the trial's checkpoints &
+            weights in.
+        seed (int): The seed to initialize the model & shuffle with.
+    """
+    start = time.perf_counter()
+    epochs, error = 0, None
+    try:
+        epochs, val_loss = _train_trial(config, n_epochs, trial_dir, seed)
+        if not math.isfinite(val_loss):
+            val_loss, error = math.inf, "diverged"
+    except Exception as exception:
+        val_loss, error = math.inf, repr(exception)
+
+    return {
+        "trial": trial,
+        "epochs": epochs,
+        "val_loss": val_loss,
+        "time": time.perf_counter() - start,
+        "error": error
+    }
+
+
+def _train_trial(config, n_epochs, trial_dir, seed):
+    """
+    Train a trial for `run_trial()`, returning the epochs it's been trained
+    for & its validation loss.
+    """
+    dataset = _worker_state["train"]
+    dataloader = DataLoader(
+        dataset,
+        batch_size=config["batch_size"],
+        shuffle=True,
+        collate_fn=ToTensorCollate()
+    )
+
+    torch.manual_seed(seed)
+    model = ARCHITECTURES[config["arch"]](
+        inpt_shape=dataset[0]["watermarked"].shape
+    )
+    os.makedirs(trial_dir, exist_ok=True)
+    model.FPATH = os.path.join(trial_dir, "weights.pt")
+    trainer = Trainer(
+        model=model,
+        optimizer=torch.optim.Adam(
+            model.parameters(),
+            lr=config["eta"],
+            weight_decay=config["weight_decay"]
+        ),
+        dataloader=dataloader,
+        checkpoint_dir=os.path.join(trial_dir, "checkpoints"),
+        checkpoint_every=n_epochs,
+        keep_last=1
+    )
+    trainer.resume()
+    trainer.fit(n_epochs=n_epochs)
+    trainer.wait()
+
+    return trainer.epoch, _validation_loss(
+        model=model,
+        dataset=_worker_state["val"],
+        batch_size=config["batch_size"]
+    )
+
+
+def sweep(
+    dataset,
+    configs,
+    sweep_dir,
+    max_epochs,
+    min_epochs=1,
+    reduction=3,
+    parallel=None,
+    threads=None,
+    pin=False,
+    val_fraction=0.1,
+    seed=0
+):
+    """
+    Run a successive halving sweep over the given configurations. Returns
+    a row of results per trial, best (i.e. furthest trained, then lowest
+    loss) first, with its hyperparameters, the
+    epochs it was trained for, its final validation loss, the time it spent
+    training & whether it was stopped early. Trials that diverge or fail
+    are stopped straight away, & come last.
+    Args:
+        dataset (Dataset): The dataset to train & validate on. It's copied
+            into shared memory once, for every trial to read from.
+        configs (list of dict): The hyperparameters of each trial.
+        sweep_dir (str): The directory to keep each trial's checkpoints &
+            weights in, & to write the summary to.
+        max_epochs (int): The epochs the best trials are trained for.
+        min_epochs (int): The epochs every trial is trained for, before
+            the first are stopped.
+        reduction (int): The factor the trials are cut by each round, & the
+            epochs are extended by. Must be at least 2.
+        parallel (int): The number of trials to train at once. Default is
+            one per CPU.
+        threads (int): Torch threads per trial, if not pinning. Default is
+            an even share of our CPUs.
+        pin (bool): Whether to pin each trial to its own share of CPUs.
+        val_fraction (float): The fraction of the dataset to hold out, to
+            score trials on.
+        seed (int): The seed to split the dataset & train with.
+    """
+    budgets = schedule(min_epochs, max_epochs, reduction)
+    n_cpus = len(os.sched_getaffinity(0))
+    parallel = min(parallel or n_cpus, len(configs))
+    threads = threads or max(n_cpus // parallel, 1)
+
+    shared = dataset if isinstance(dataset, SharedDataset) else \
+        SharedDataset(dataset)
+    n_val = max(round(len(shared) * val_fraction), 1)
+    val_indices = sorted(
+        random.Random(seed).sample(range(len(shared)), n_val)
+    )
+
+    results = {
+        trial: dict(config, trial=trial, epochs=0, val_loss=math.inf,
+                    time=0.0, status="running")
+        for trial, config in enumerate(configs)
+    }
+    survivors = list(results)
+    context = mp.get_context("spawn")
+    with context.Pool(
+        processes=parallel,
+        initializer=_init_worker,
+        initargs=(
+            shared,
+            val_indices,
+            threads,
+            pin,
+            context.Value("i", 0),
+            parallel
+        )
+    ) as pool:
+        for round_index, n_epochs in enumerate(budgets):
+            for result in pool.starmap(run_trial, [
+                (
+                    trial,
+                    configs[trial],
+                    n_epochs,
+                    os.path.join(sweep_dir, TRIAL_DIR.format(trial)),
+                    seed
+                )
+                for trial in survivors
+            ]):
+                row = results[result["trial"]]
+                row.update(
+                    epochs=max(result["epochs"], row["epochs"]),
+                    val_loss=result["val_loss"],
+                    time=row["time"] + result["time"]
+                )
+                if result["error"] == "diverged":
+                    row["status"] = "diverged"
+                elif result["error"]:
+                    row["status"] = "failed"
+                    print("Trial {} failed: {}".format(
+                        result["trial"], result["error"]
+                    ))
+
+            survivors = [
+                trial for trial in survivors
+                if results[trial]["status"] not in FAILED_STATUSES
+            ]
+            if not survivors:
+                break
+
+            survivors.sort(key=lambda trial: results[trial]["val_loss"])
+            if round_index == len(budgets) - 1:
+                break
+
+            n_kept = max(len(survivors) // reduction, 1)
+            for trial in survivors[n_kept:]:
+                results[trial]["status"] = "stopped"
+            survivors = survivors[:n_kept]
+
+    for trial in survivors:
+        results[trial]["status"] = "completed"
+
+    # Trials that went further beat every trial stopped before them.
+    rows = sorted(
+        results.values(),
+        key=lambda row: (
+            row["status"] in FAILED_STATUSES, -row["epochs"], row["val_loss"]
+        )
+    )
+    write_summary(rows, os.path.join(sweep_dir, SUMMARY_FNAME))
+    return rows
+
+
+def write_summary(rows, fname):
+    """
+    Write the results of a sweep to a CSV table.
+    Args:
+        rows (list of dict): The results, as returned by `sweep()`.
+        fname (str): The file to write them to.
+    """
+    os.makedirs(os.path.dirname(fname) or ".", exist_ok=True)
+    columns = ["trial"] + list(PARAMS) + \
+        ["epochs", "val_loss", "time", "status"]
+    with open(fname, "w", newline="") as fp:
+        writer = csv.DictWriter(fp, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Search for good training hyperparameters, in parallel."
+    )
+    parser.add_argument("--dataset", default="data/training/set")
+    parser.add_argument(
+        "--space",
+        nargs="+",
+        default=[],
+        metavar="NAME=SPEC",
+        help="The values to search for each of {}, as a comma-separated "
+             "list, or (for random search) a low:high or log:low:high "
+             "range.".format(", ".join(PARAMS))
+    )
+    parser.add_argument("--search", default="grid", choices=["grid", "random"])
+    parser.add_argument(
+        "--trials",
+        type=int,
+        default=16,
+        help="The number of configurations to sample, for random search."
+    )
+    parser.add_argument("--max-epochs", type=int, default=2000)
+    parser.add_argument("--min-epochs", type=int, default=100)
+    parser.add_argument("--reduction", type=int, default=3)
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=0,
+        help="Trials to train at once. Default is one per CPU."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="Torch threads per trial, if not pinning. Default is an even "
+             "share of this machine's CPUs."
+    )
+    parser.add_argument(
+        "--pin",
+        action="store_true",
+        help="Pin each trial to its own share of CPUs."
+    )
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sweep-dir", default="checkpoints/sweep")
+    args = parser.parse_args(argv)
+    if args.min_epochs < 1:
+        parser.error("--min-epochs must be at least 1.")
+    if args.reduction < 2:
+        parser.error("--reduction must be at least 2.")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    space = parse_space(args.space)
+    if args.search == "grid":
+        configs = grid_configs(space)
+    else:
+        configs = random_configs(space, n_trials=args.trials, seed=args.seed)
+
+    rows = sweep(
+        dataset=DeWatermarkerDataset(root_dir=args.dataset),
+        configs=configs,
+        sweep_dir=args.sweep_dir,
+        max_epochs=args.max_epochs,
+        min_epochs=args.min_epochs,
+        reduction=args.reduction,
+        parallel=args.parallel,
+        threads=args.threads,
+        pin=args.pin,
+        val_fraction=args.val_fraction,
+        seed=args.seed
+    )
+    print("{:>5} {:>6} {:>10} {:>10} {:>12} {:>6} {:>12} {:>9}".format(
+        "trial", "arch", "batch_size", "eta", "weight_decay", "epochs",
+        "val_loss", "status"
+    ))
+    for row in rows:
+        print(
+            "{:>5} {:>6} {:>10} {:>10.2e} {:>12.2e} {:>6} {:>12.6f} "
+            "{:>9}".format(
+                row["trial"],
+                row["arch"],
+                row["batch_size"],
+                row["eta"],
+                row["weight_decay"],
+                row["epochs"],
+                row["val_loss"],
+                row["status"]
+            )
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,24 @@
 from .tests_generator import TestDSGenerator
 from .tests_dataset import TestDeWatermarkerDataset
-
+from .tests_shards import TestShards
+from .tests_watermarks import TestWatermarkCache
+from .tests_compositor import TestBatchCompositor
+from .tests_synthetic import TestSyntheticDataset
+from .tests_patches import TestPatchDataset
+from .tests_transforms import TestToTensorCollate
+from .tests_trainer import TestTrainer
+from .tests_distributed import TestDistributed
+from .tests_instrumentation import TestTrainingMonitor
+from .tests_preview import TestPreviewSink
+from .tests_dewatermark import TestDewatermark
+from .tests_inference import TestRegionInference, TestTiledInference
+from .tests_export import TestExport
+from .tests_quantize import TestQuantize
+from .tests_server import TestInferenceServer
+from .tests_distill import TestDistillation
+from .tests_autoencoder import TestUNet
+from .tests_profiler import TestProfiler
+from .tests_benchmarks import TestBenchmarks
+from .tests_prune import TestPrune
+from .tests_sweep import TestSweep
+from .tests_registry import TestModelRegistry
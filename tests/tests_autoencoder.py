@@ -0,0 +1,87 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import torch
+
+from unittest import TestCase
+
+from autoencoder import (
+    ARCHITECTURES,
+    UNET0Autoencoder,
+    UNET1Autoencoder,
+    UNetAutoencoder
+)
+
+
+class TestUNet(TestCase):
+    """
+    Test suite for the U-Net architectures.
+    """
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = UNET0Autoencoder(inpt_shape=(None, None, 3)).eval()
+
+    def test_output_shape(self):
+        """
+        Ensure that inputs of any size come out the same size.
+        """
+        for height, width in [(64, 64), (37, 51), (8, 3)]:
+            with torch.no_grad():
+                output = self.model(torch.rand(2, 3, height, width))
+            self.assertEqual(tuple(output.shape), (2, 3, height, width))
+
+    def test_configurable(self):
+        """
+        Ensure that width & depth set the channels & the alignment.
+        """
+        model = UNetAutoencoder((None, None, 3), width=4, depth=2)
+        self.assertEqual(model.ALIGNMENT, 4)
+        self.assertEqual(UNET1Autoencoder((None, None, 3)).ALIGNMENT, 16)
+        self.assertEqual(len(model.encoder), 2)
+        self.assertEqual(model.stem[0].out_channels, 4)
+        self.assertIn("UNET0", ARCHITECTURES)
+        self.assertIn("UNET1", ARCHITECTURES)
+
+    def test_receptive_margin(self):
+        """
+        Ensure that output pixels don't see past the receptive margin,
+        wherever they lie on the model's grid.
+        """
+        margin = self.model.receptive_margin()
+        batch = torch.rand(1, 3, 64, 2 * margin + 24)
+        with torch.no_grad():
+            expected = self.model(batch)
+
+        for column in range(margin, margin + self.model.ALIGNMENT):
+            changed = batch.clone()
+            changed[:, :, 32, column + margin + 1] += 10
+            changed[:, :, 32, column - margin - 1] += 10
+            with torch.no_grad():
+                output = self.model(changed)
+            torch.testing.assert_close(
+                output[:, :, 32, column],
+                expected[:, :, 32, column],
+                rtol=0,
+                atol=0
+            )
@@ -0,0 +1,146 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+
+from unittest import TestCase
+
+from benchmarks import compare, run_suite
+from benchmarks.suite import main
+
+
+class TestBenchmarks(TestCase):
+    """
+    Test suite for the benchmark suite.
+    """
+
+    def setUp(self):
+        self.baseline = {
+            "results": {
+                "getitem/64/1": {"median": 1.0},
+                "train_step/ARCH0/64/1": {"median": 1.0},
+                "train_step/ARCH1/64/1": {"median": 1.0}
+            }
+        }
+
+    def test_run_suite(self):
+        """
+        Ensure that every benchmark is run at every resolution & batch size.
+        """
+        results = run_suite(
+            groups=["generate", "loading"],
+            resolutions=[16, 24],
+            batch_sizes=[1, 2],
+            n_runs=1
+        )
+        self.assertEqual(len(results["results"]), 4 * 2 * 2)
+        self.assertIn("dataloader/24/2", results["results"])
+        for result in results["results"].values():
+            self.assertGreater(result["median"], 0)
+            self.assertLessEqual(result["min"], result["median"])
+        self.assertIn("threads", results["machine"])
+
+    def test_model_benchmarks(self):
+        """
+        Ensure that we time training & inference for every architecture, &
+        that we don't leave any trainer's checkpoint thread running.
+        """
+        n_threads = threading.active_count()
+        results = run_suite(
+            groups=["model"],
+            resolutions=[16],
+            batch_sizes=[1],
+            n_runs=1
+        )
+        self.assertIn("train_step/ARCH0/16/1", results["results"])
+        self.assertIn("inference/UNET0/16/1", results["results"])
+        self.assertEqual(threading.active_count(), n_threads)
+
+    def test_compare(self):
+        """
+        Ensure that we flag slowdowns beyond their threshold, & only those.
+        """
+        results = {
+            "results": {
+                "getitem/64/1": {"median": 1.05},
+                "train_step/ARCH0/64/1": {"median": 1.3},
+                "train_step/ARCH1/64/1": {"median": 1.3},
+                "inference/ARCH0/64/1": {"median": 9.0}
+            }
+        }
+        regressions = compare(results=results, baseline=self.baseline)
+        self.assertEqual(
+            [key for key, _, _ in regressions],
+            ["train_step/ARCH0/64/1", "train_step/ARCH1/64/1"]
+        )
+
+        # The longest matching prefix wins.
+        regressions = compare(
+            results=results,
+            baseline=self.baseline,
+            threshold=0.01,
+            thresholds={"train_step": 0.5, "train_step/ARCH1": 0.1}
+        )
+        self.assertEqual(
+            regressions,
+            [("getitem/64/1", 1.0, 1.05), ("train_step/ARCH1/64/1", 1.0, 1.3)]
+        )
+
+    def test_main(self):
+        """
+        Ensure that results are saved as JSON, & that a regression against
+        the baseline, or a missing baseline, fails the run.
+        """
+        args = ["--groups", "loading", "--resolutions", "16"]
+        args += ["--batch-sizes", "1", "--runs", "1"]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out = os.path.join(tmp_dir, "results.json")
+            baseline = os.path.join(tmp_dir, "baseline.json")
+            args += ["--baseline", baseline]
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                self.assertEqual(main(args), 1)
+            self.assertIn("--save-baseline", stdout.getvalue())
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(main(args + ["--save-baseline"]), 0)
+                self.assertEqual(
+                    main(args + ["--out", out, "--threshold", "1000"]),
+                    0
+                )
+            with open(out) as fp:
+                self.assertIn("getitem/16/1", json.load(fp)["results"])
+
+            with open(baseline) as fp:
+                saved = json.load(fp)
+            for result in saved["results"].values():
+                result["median"] = 1e-9
+            with open(baseline, "w") as fp:
+                json.dump(saved, fp)
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                self.assertEqual(main(args), 1)
+            self.assertIn("REGRESSION getitem/16/1", stdout.getvalue())
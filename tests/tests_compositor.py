@@ -0,0 +1,139 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import copy
+
+import numpy
+
+from unittest import TestCase
+from PIL import Image
+
+from data import BatchCompositor, DSGenerator
+
+
+class TestBatchCompositor(TestCase):
+    """
+    Test suite for the batched watermark compositor.
+    """
+
+    def setUp(self):
+        TEST_WATERMARK_PATH = "tests/images/test-watermark.png"
+        self.watermark = Image.open(TEST_WATERMARK_PATH)
+
+        TEST_IMG_PATH = "tests/images/test-image.jpg"
+        self.primary_image = Image.open(TEST_IMG_PATH)
+        self.N_IMAGES = 4
+        self.images = numpy.repeat(
+            numpy.asarray(self.primary_image)[None],
+            self.N_IMAGES,
+            axis=0
+        )
+
+    def test_composite_matches_generator(self):
+        """
+        Ensure that compositing at the generator's position & scale gives
+        the same result as pasting the watermark with PIL.
+        """
+        expected = DSGenerator._add_watermark(
+            watermark=self.watermark,
+            image=copy.deepcopy(self.primary_image)
+        )
+        watermarked, boxes = BatchCompositor.composite(
+            images=self.images,
+            watermark=self.watermark,
+            positions=numpy.zeros((self.N_IMAGES, 2))
+        )
+
+        for image in watermarked:
+            numpy.testing.assert_array_equal(image, numpy.asarray(expected))
+        numpy.testing.assert_array_equal(boxes[0], [0, 0, 400, 73])
+
+    def test_composite_placements(self):
+        """
+        Ensure that each image is only changed within its watermark's box,
+        & that watermarks are kept within their images.
+        """
+        positions = [(10, 20), (5000, 5000), (300, 900), (0, 0)]
+        opacities = [1.0, 0.5, 1.0, 0.0]
+        scales = [0.5, 0.25, 0.1, 0.5]
+        watermarked, boxes = BatchCompositor.composite(
+            images=self.images,
+            watermark=self.watermark,
+            positions=positions,
+            opacities=opacities,
+            scales=scales
+        )
+
+        height, width = self.images.shape[1:3]
+        self.assertTrue((boxes[:, 2] <= width).all())
+        self.assertTrue((boxes[:, 3] <= height).all())
+        numpy.testing.assert_array_equal(boxes[0, :2], [10, 20])
+        numpy.testing.assert_array_equal(boxes[1, 2:], [width, height])
+
+        for image, original, box in zip(watermarked, self.images, boxes):
+            left, top, right, bottom = box
+            outside = image.copy()
+            outside[top:bottom, left:right] = original[top:bottom, left:right]
+            numpy.testing.assert_array_equal(outside, original)
+
+        self.assertTrue((watermarked[0] != self.images[0]).any())
+        numpy.testing.assert_array_equal(watermarked[3], self.images[3])
+
+    def test_random_placements(self):
+        """
+        Ensure that random placements are reproducible, & within range.
+        """
+        width, height = self.primary_image.size
+        placements = BatchCompositor.random_placements(
+            n_images=64,
+            image_size=(width, height),
+            rng=numpy.random.default_rng(0)
+        )
+        positions, opacities, scales = placements
+        self.assertTrue(((scales >= 0.25) & (scales <= 0.5)).all())
+        self.assertTrue(((opacities >= 0.5) & (opacities <= 1.0)).all())
+        self.assertTrue((positions[:, 0] <= width * (1 - scales)).all())
+        self.assertTrue((positions[:, 1] <= height * (1 - scales)).all())
+
+        same_placements = BatchCompositor.random_placements(
+            n_images=64,
+            image_size=(width, height),
+            rng=numpy.random.default_rng(0)
+        )
+        for expected, actual in zip(placements, same_placements):
+            numpy.testing.assert_array_equal(expected, actual)
+
+        # Scales come in a few steps, so resized watermarks can be reused,
+        # unless we ask for continuous scales.
+        self.assertLessEqual(
+            len(numpy.unique(scales)),
+            BatchCompositor.SCALE_STEPS
+        )
+        self.assertIn(0.25, scales)
+        _, _, scales = BatchCompositor.random_placements(
+            n_images=64,
+            image_size=(width, height),
+            rng=numpy.random.default_rng(0),
+            scale_steps=0
+        )
+        self.assertEqual(len(numpy.unique(scales)), 64)
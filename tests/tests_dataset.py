@@ -21,9 +21,14 @@
 # SOFTWARE.
 # ================================================================
 
+import os
+import tempfile
+
+import numpy
+
 from unittest import TestCase, mock
 
-from data import DeWatermarkerDataset
+from data import DeWatermarkerDataset, ShardWriter
 
 
 class TestDeWatermarkerDataset(TestCase):
@@ -48,6 +53,26 @@ class TestDeWatermarkerDataset(TestCase):
         mock_cPickle.assert_called_with(MOCK_FILE)
         self.assertEqual(dataset.dewatermarker_frame, MOCK_DATAFRAME)
 
+    def test_dataset__init__sharded(self):
+        """
+        Ensure that we memory-map a sharded dataset directory.
+        """
+        datapoint = {
+            "watermarked": numpy.full((2, 3, 3), 7, dtype=numpy.uint8),
+            "original": numpy.full((2, 3, 3), 9, dtype=numpy.uint8)
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_dir = os.path.join(tmp_dir, "set")
+            with ShardWriter(root_dir=root_dir) as writer:
+                writer.write(datapoint)
+
+            dataset = DeWatermarkerDataset(root_dir=root_dir)
+            self.assertEqual(len(dataset), 1)
+            numpy.testing.assert_array_equal(
+                dataset[0]["original"],
+                datapoint["original"]
+            )
+
     @mock.patch.object(DeWatermarkerDataset, "__init__", return_value=None)
     def test_dataset__len__(self, mock__init__):
         """
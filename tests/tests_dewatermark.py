@@ -0,0 +1,178 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import tempfile
+
+import numpy
+import torch
+
+from unittest import TestCase, mock
+from PIL import Image
+
+import dewatermark
+from autoencoder import ARCH0Autoencoder
+from inference import Dewatermarker, load_model
+
+
+class TestDewatermark(TestCase):
+    """
+    Test suite for batch de-watermarking.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.tmp_dir.name, "in")
+        self.output_dir = os.path.join(self.tmp_dir.name, "out")
+        os.makedirs(os.path.join(self.input_dir, "nested"))
+
+        rng = numpy.random.default_rng(0)
+        self.images = {}
+        shapes = [(8, 8, 3), (6, 10, 3), (8, 8, 3), (6, 10, 3), (8, 8, 3)]
+        for index, shape in enumerate(shapes):
+            name = "image-{}.png".format(index)
+            if index % 2:
+                name = os.path.join("nested", name)
+            pixels = rng.integers(0, 256, shape, dtype=numpy.uint8)
+            Image.fromarray(pixels).save(os.path.join(self.input_dir, name))
+            self.images[name] = pixels
+
+        torch.manual_seed(0)
+        self.checkpoint = os.path.join(self.tmp_dir.name, "arch_0.pt")
+        torch.save(ARCH0Autoencoder((8, 8, 3)).state_dict(), self.checkpoint)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_main(self):
+        """
+        Ensure that every image found is de-watermarked by the model, &
+        written to the same relative path.
+        """
+        with open(os.path.join(self.input_dir, "notes.txt"), "w") as fp:
+            fp.write("Not an image.")
+
+        n_written = dewatermark.main([
+            self.input_dir,
+            "--out", self.output_dir,
+            "--arch", "ARCH0",
+            "--checkpoint", self.checkpoint,
+            "--batch-size", "2",
+            "--io-workers", "2"
+        ])
+
+        self.assertEqual(n_written, len(self.images))
+        dewatermarker = Dewatermarker(
+            load_model(arch="ARCH0", checkpoint=self.checkpoint)
+        )
+        for name, pixels in self.images.items():
+            with Image.open(os.path.join(self.output_dir, name)) as image:
+                numpy.testing.assert_array_equal(
+                    numpy.asarray(image),
+                    dewatermarker([pixels])[0]
+                )
+
+    def test_find_images(self):
+        """
+        Ensure that we expand both directories & glob patterns.
+        """
+        pattern = os.path.join(self.input_dir, "nested", "*.png")
+        self.assertEqual(
+            [name for _, name in dewatermark.find_images([pattern])],
+            ["image-1.png", "image-3.png"]
+        )
+        self.assertEqual(
+            sorted(name for _, name in dewatermark.find_images(
+                [self.input_dir]
+            )),
+            sorted(self.images)
+        )
+
+        # Matches in different directories mustn't share an output name.
+        os.makedirs(os.path.join(self.input_dir, "copy"))
+        Image.fromarray(self.images["image-0.png"]).save(
+            os.path.join(self.input_dir, "copy", "image-1.png")
+        )
+        pattern = os.path.join(self.input_dir, "*", "*.png")
+        self.assertEqual(
+            [name for _, name in dewatermark.find_images([pattern])],
+            [
+                os.path.join("copy", "image-1.png"),
+                os.path.join("nested", "image-1.png"),
+                os.path.join("nested", "image-3.png")
+            ]
+        )
+
+    def test_find_images_collisions(self):
+        """
+        Ensure that we refuse to write two images to the same output name.
+        """
+        other_dir = os.path.join(self.tmp_dir.name, "other")
+        os.makedirs(other_dir)
+        Image.fromarray(self.images["image-0.png"]).save(
+            os.path.join(other_dir, "image-0.png")
+        )
+        with self.assertRaises(ValueError):
+            dewatermark.find_images([self.input_dir, other_dir])
+
+        # The same image found twice is only a duplicate, not a collision.
+        images = dewatermark.find_images([other_dir, other_dir])
+        self.assertEqual([name for _, name in images], ["image-0.png"])
+
+    def test_encode(self):
+        """
+        Ensure that images we can't write in their own format are written
+        as PNGs instead.
+        """
+        pixels = self.images["image-0.png"]
+        fname = os.path.join(self.output_dir, "image.cur")
+        with mock.patch("sys.stderr"):
+            dewatermark.encode(pixels=pixels, fname=fname)
+
+        self.assertFalse(os.path.exists(fname))
+        with Image.open(fname + ".png") as image:
+            self.assertEqual(image.format, "PNG")
+            numpy.testing.assert_array_equal(numpy.asarray(image), pixels)
+
+    def test_batch_by_size(self):
+        """
+        Ensure that batches only ever hold same-sized images, & that we
+        flush batches early rather than buffering too many images.
+        """
+        decoded = [
+            (index, numpy.zeros((1 + index % 3, 1, 3), dtype=numpy.uint8))
+            for index in range(10)
+        ]
+        decoded.insert(5, ("unreadable", None))
+        batches = list(dewatermark.batch_by_size(
+            decoded=decoded,
+            batch_size=4,
+            max_buffered=5
+        ))
+
+        items = [item for batch in batches for item, _ in batch]
+        self.assertEqual(sorted(items), list(range(10)))
+        for batch in batches:
+            self.assertLessEqual(len(batch), 4)
+            self.assertEqual(len({pixels.shape for _, pixels in batch}), 1)
+        self.assertEqual(len(batches[0]), 2)
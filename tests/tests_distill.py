@@ -0,0 +1,134 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import tempfile
+
+import numpy
+import torch
+
+from unittest import TestCase
+
+import distill
+from autoencoder import ARCH0Autoencoder, ARCH3Autoencoder
+from data import ShardWriter
+from distill import DistillationTrainer
+
+
+class TestDistillation(TestCase):
+    """
+    Test suite for distilling a teacher model into a student.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset_dir = os.path.join(self.tmp_dir.name, "set")
+        rng = numpy.random.default_rng(0)
+        with ShardWriter(root_dir=self.dataset_dir) as writer:
+            for _ in range(4):
+                writer.write({
+                    "watermarked": rng.integers(0, 256, (8, 8, 3), numpy.uint8),
+                    "original": rng.integers(0, 256, (8, 8, 3), numpy.uint8)
+                })
+
+        torch.manual_seed(0)
+        self.teacher = ARCH0Autoencoder(inpt_shape=(None, None, 3))
+        self.teacher_fpath = os.path.join(self.tmp_dir.name, "teacher.pt")
+        self.teacher.save(fpath=self.teacher_fpath)
+        self.batch = {
+            "watermarked": torch.rand(2, 3, 8, 8),
+            "original": torch.rand(2, 3, 8, 8)
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _trainer(self, alpha):
+        student = ARCH3Autoencoder(inpt_shape=(None, None, 3))
+        return DistillationTrainer(
+            model=student,
+            teacher=self.teacher,
+            alpha=alpha,
+            optimizer=torch.optim.Adam(student.parameters()),
+            dataloader=[self.batch],
+            checkpoint_dir=os.path.join(self.tmp_dir.name, "checkpoints")
+        )
+
+    def test_compute_loss(self):
+        """
+        Ensure that the loss mixes the teacher's output & the ground truth.
+        """
+        teacher_output = self.teacher(self.batch["watermarked"]).detach()
+        for alpha in (0, 0.25, 1):
+            trainer = self._trainer(alpha=alpha)
+            output = trainer.model(self.batch["watermarked"])
+            loss = trainer.compute_loss(output=output, batch=self.batch)
+            mse = torch.nn.functional.mse_loss
+            torch.testing.assert_close(
+                loss,
+                alpha * mse(output, teacher_output) +
+                (1 - alpha) * mse(output, self.batch["original"])
+            )
+
+    def test_teacher_is_frozen(self):
+        """
+        Ensure that only the student is trained.
+        """
+        teacher_state = {
+            key: value.clone()
+            for key, value in self.teacher.state_dict().items()
+        }
+        trainer = self._trainer(alpha=0.5)
+        student_weight = trainer.model.encoder[0].weight.clone()
+        trainer.train_step(batch=self.batch)
+
+        for key, value in self.teacher.state_dict().items():
+            torch.testing.assert_close(value, teacher_state[key])
+        self.assertFalse(
+            torch.equal(trainer.model.encoder[0].weight, student_weight)
+        )
+
+    def test_main(self):
+        """
+        Ensure that the student's weights load like any other model's, &
+        that we report on both models.
+        """
+        weights = os.path.join(self.tmp_dir.name, "student.pt")
+        student, results = distill.main([
+            "--teacher", "ARCH0",
+            "--teacher-checkpoint", self.teacher_fpath,
+            "--student", "ARCH3",
+            "--weights", weights,
+            "--dataset", self.dataset_dir,
+            "--epochs", "2",
+            "--checkpoint-dir", os.path.join(self.tmp_dir.name, "checkpoints")
+        ])
+
+        loaded = ARCH3Autoencoder(inpt_shape=(None, None, 3))
+        loaded.load(fpath=weights)
+        for key, value in student.state_dict().items():
+            torch.testing.assert_close(loaded.state_dict()[key], value)
+        self.assertEqual(
+            [result["model"] for result in results],
+            ["ARCH0", "ARCH3"]
+        )
@@ -0,0 +1,148 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import socket
+import tempfile
+
+import numpy
+import torch
+import torch.multiprocessing as mp
+
+from unittest import TestCase
+
+import distributed
+from data import ShardWriter
+
+
+def _train_and_save(local_rank, args, output_dir):
+    trainer = distributed.train(local_rank, args)
+    torch.save(
+        trainer.module.state_dict(),
+        os.path.join(output_dir, "rank-{}.pt".format(local_rank))
+    )
+
+
+def _resume_and_save(local_rank, args, output_dir):
+    # Only rank 0 can see the checkpoints, as if on another machine
+    if local_rank != 0:
+        args.checkpoint_dir = os.path.join(output_dir, "empty")
+    trainer = distributed.train(local_rank, args)
+    torch.save(
+        {"epoch": trainer.epoch, "model": trainer.module.state_dict()},
+        os.path.join(output_dir, "rank-{}.pt".format(local_rank))
+    )
+
+
+class TestDistributed(TestCase):
+    """
+    Test suite for data-parallel training.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset_dir = os.path.join(self.tmp_dir.name, "set")
+        rng = numpy.random.default_rng(0)
+        with ShardWriter(root_dir=self.dataset_dir) as writer:
+            for _ in range(8):
+                writer.write({
+                    "watermarked": rng.integers(0, 256, (8, 8, 3), numpy.uint8),
+                    "original": rng.integers(0, 256, (8, 8, 3), numpy.uint8)
+                })
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _args(self, *argv):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        return distributed.parse_args([
+            "--dataset", self.dataset_dir,
+            "--arch", "ARCH0",
+            "--batch-size", "2",
+            "--nprocs", "2",
+            "--master-port", str(port),
+            "--weights", os.path.join(self.tmp_dir.name, "arch_0.pt"),
+            *argv
+        ])
+
+    def test_train(self):
+        """
+        Ensure that training with several local ranks keeps every replica
+        of the model in sync, & checkpoints from rank 0 only.
+        """
+        checkpoint_dir = os.path.join(self.tmp_dir.name, "checkpoints")
+        args = self._args("--epochs", "2", "--checkpoint-dir", checkpoint_dir)
+        mp.spawn(
+            _train_and_save,
+            args=(args, self.tmp_dir.name),
+            nprocs=args.nprocs,
+            join=True
+        )
+
+        states = [
+            torch.load(os.path.join(self.tmp_dir.name, "rank-{}.pt".format(r)))
+            for r in range(args.nprocs)
+        ]
+        for key, value in states[0].items():
+            torch.testing.assert_close(states[1][key], value)
+
+        self.assertEqual(os.listdir(checkpoint_dir), ["checkpoint-000002.pt"])
+        self.assertTrue(
+            os.path.exists(os.path.join(self.tmp_dir.name, "arch_0.pt"))
+        )
+
+    def test_resume(self):
+        """
+        Ensure that every rank resumes from rank 0's checkpoint, even when
+        the others can't see it.
+        """
+        checkpoint_dir = os.path.join(self.tmp_dir.name, "checkpoints")
+        args = self._args("--epochs", "2", "--checkpoint-dir", checkpoint_dir)
+        mp.spawn(
+            _train_and_save,
+            args=(args, self.tmp_dir.name),
+            nprocs=args.nprocs,
+            join=True
+        )
+        args = self._args("--epochs", "3", "--checkpoint-dir", checkpoint_dir)
+        mp.spawn(
+            _resume_and_save,
+            args=(args, self.tmp_dir.name),
+            nprocs=args.nprocs,
+            join=True
+        )
+
+        states = [
+            torch.load(os.path.join(self.tmp_dir.name, "rank-{}.pt".format(r)))
+            for r in range(args.nprocs)
+        ]
+        self.assertEqual([state["epoch"] for state in states], [3, 3])
+        for key, value in states[0]["model"].items():
+            torch.testing.assert_close(states[1]["model"][key], value)
+        self.assertEqual(
+            sorted(os.listdir(checkpoint_dir)),
+            ["checkpoint-000002.pt", "checkpoint-000003.pt"]
+        )
@@ -0,0 +1,108 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import importlib.util
+import os
+import tempfile
+import unittest
+
+import numpy
+import torch
+
+from unittest import TestCase
+
+import export
+from autoencoder import ARCH0Autoencoder, ARCH1Autoencoder
+from inference import Dewatermarker
+from runtime import ExportedModel
+
+
+class TestExport(TestCase):
+    """
+    Test suite for exporting models, & running them with the runtime.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+        self.models = [
+            ARCH0Autoencoder(inpt_shape=(None, None, 3)).eval(),
+            ARCH1Autoencoder(inpt_shape=(None, None, 3)).eval()
+        ]
+        rng = numpy.random.default_rng(0)
+        self.batches = [
+            rng.integers(0, 256, shape, dtype=numpy.uint8)
+            for shape in [(2, 32, 32, 3), (3, 45, 71, 3)]
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertParity(self, exporter, extension):
+        for index, model in enumerate(self.models):
+            fname = os.path.join(self.tmp_dir.name, str(index) + extension)
+            exporter(model=model, fname=fname)
+            runtime = ExportedModel(fname)
+            for images in self.batches:
+                expected = numpy.stack(Dewatermarker(model)(list(images)))
+                output = runtime(images)
+                self.assertEqual(output.dtype, numpy.uint8)
+                self.assertEqual(output.shape, images.shape)
+                self.assertLessEqual(
+                    numpy.abs(output.astype(int) - expected).max(),
+                    1
+                )
+
+    def test_torchscript(self):
+        """
+        Ensure that TorchScript models match the eager model, at any size.
+        """
+        self.assertParity(export.export_torchscript, ".torchscript.pt")
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("onnx") and
+        importlib.util.find_spec("onnxruntime"),
+        "ONNX export needs onnx & onnxruntime."
+    )
+    def test_onnx(self):
+        """
+        Ensure that ONNX models match the eager model, at any size.
+        """
+        self.assertParity(export.export_onnx, ".onnx")
+
+    def test_main(self):
+        """
+        Ensure that we export a checkpoint under its own name.
+        """
+        checkpoint = os.path.join(self.tmp_dir.name, "weights.pt")
+        torch.save(self.models[0].state_dict(), checkpoint)
+        fnames = export.main([
+            "--arch", "ARCH0",
+            "--checkpoint", checkpoint,
+            "--out-dir", self.tmp_dir.name
+        ])
+        self.assertEqual(
+            fnames,
+            [os.path.join(self.tmp_dir.name, "weights.torchscript.pt")]
+        )
+        self.assertTrue(os.path.exists(fnames[0]))
@@ -22,11 +22,17 @@
 # ================================================================
 
 import copy
+import glob
+import os
+import tempfile
+
+import numpy
 
 from unittest import mock, TestCase
 from PIL import Image
 
-from data import DSGenerator
+from data import DSGenerator, ShardReader
+from data.shards import SHARD_FNAME, SHARD_GLOB
 
 
 class TestDSGenerator(TestCase):
@@ -41,6 +47,7 @@ class TestDSGenerator(TestCase):
         self.primary_image = Image.open(TEST_IMG_PATH)
         self.N_IMAGES = 3
         self.images = [self.primary_image for _ in range(self.N_IMAGES)]
+        self.image_paths = [TEST_IMG_PATH for _ in range(self.N_IMAGES)]
 
     @mock.patch("data.generator.DSGenerator._add_watermark")
     @mock.patch("data.generator.DSGenerator._save_dataset")
@@ -74,6 +81,266 @@ class TestDSGenerator(TestCase):
             fname=DSGenerator.TRAINING_FNAME
         )
 
+    @mock.patch("data.generator.DSGenerator._add_watermark")
+    @mock.patch("data.generator.DSGenerator._save_shards")
+    @mock.patch("data.generator.DSGenerator._create_datapoint")
+    def test_generate_dataset_sharded(
+        self,
+        mock_create_datapoint,
+        mock_save_shards,
+        mock_add_watermark
+    ):
+        """
+        Ensure that we can generate a dataset in the sharded format.
+        """
+        MOCK_CREATE_DATAPOINT = {"watermarked": None, "original": None}
+        mock_create_datapoint.return_value = MOCK_CREATE_DATAPOINT
+
+        DSGenerator.generate_dataset(
+            watermark=self.watermark,
+            images=self.images,
+            sharded=True
+        )
+
+        expected_dataset = [MOCK_CREATE_DATAPOINT for _ in range(self.N_IMAGES)]
+        mock_save_shards.assert_called_with(
+            dataset=expected_dataset,
+            root_dir=DSGenerator.TRAINING_DIR
+        )
+
+    def test_generate_stream(self):
+        """
+        Ensure that we can stream a dataset to disk, & that an interrupted
+        run resumes from the last committed datapoint.
+        """
+        def interrupted_images():
+            yield from self.image_paths[:2]
+            raise KeyboardInterrupt
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_dir = os.path.join(tmp_dir, "set")
+            with self.assertRaises(KeyboardInterrupt):
+                DSGenerator.generate_stream(
+                    watermark=self.watermark,
+                    images=interrupted_images(),
+                    root_dir=root_dir,
+                    batch_size=1
+                )
+            self.assertEqual(len(ShardReader(root_dir)), 2)
+
+            with mock.patch.object(
+                DSGenerator,
+                "_add_watermark",
+                wraps=DSGenerator._add_watermark
+            ) as mock_add_watermark:
+                n_datapoints = DSGenerator.generate_stream(
+                    watermark=self.watermark,
+                    images=self.image_paths,
+                    root_dir=root_dir
+                )
+                self.assertEqual(len(mock_add_watermark.mock_calls), 1)
+
+            self.assertEqual(n_datapoints, self.N_IMAGES)
+            dataset = ShardReader(root_dir)
+            self.assertEqual(len(dataset), self.N_IMAGES)
+            numpy.testing.assert_array_equal(
+                dataset[2]["box"],
+                [0, 0, 400, 73]
+            )
+            numpy.testing.assert_array_equal(
+                dataset[2]["original"],
+                numpy.asarray(self.primary_image)
+            )
+
+    def test_generate_stream_parallel(self):
+        """
+        Ensure that generating a dataset across several processes gives
+        the same dataset as generating it serially.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            serial_dir = os.path.join(tmp_dir, "serial")
+            DSGenerator.generate_stream(
+                watermark=self.watermark,
+                images=self.image_paths,
+                root_dir=serial_dir
+            )
+
+            parallel_dir = os.path.join(tmp_dir, "parallel")
+            n_datapoints = DSGenerator.generate_stream(
+                watermark=self.watermark,
+                images=self.image_paths,
+                root_dir=parallel_dir,
+                batch_size=2,
+                workers=2
+            )
+
+            self.assertEqual(n_datapoints, self.N_IMAGES)
+            serial = ShardReader(serial_dir)
+            parallel = ShardReader(parallel_dir)
+            self.assertEqual(len(parallel), len(serial))
+            for index in range(len(serial)):
+                for key in ("watermarked", "original"):
+                    numpy.testing.assert_array_equal(
+                        parallel[index][key],
+                        serial[index][key]
+                    )
+
+    def test_update_dataset(self):
+        """
+        Ensure that updating a dataset only generates the datapoints whose
+        inputs have changed, & gives the same dataset as generating it
+        from scratch.
+        """
+        def assertDatasetEqual(actual, expected):
+            self.assertEqual(len(actual), len(expected))
+            for index in range(len(expected)):
+                for key in ("watermarked", "original", "box"):
+                    numpy.testing.assert_array_equal(
+                        actual[index][key],
+                        expected[index][key]
+                    )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for index, box in enumerate([(0, 0, 64, 48), (64, 0, 128, 48)]):
+                paths.append(os.path.join(tmp_dir, "{}.png".format(index)))
+                self.primary_image.crop(box).save(paths[-1])
+
+            root_dir = os.path.join(tmp_dir, "set")
+            self.assertEqual(
+                DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                (0, 2)
+            )
+            with mock.patch.object(
+                DSGenerator,
+                "_generate_datapoint"
+            ) as mock_generate_datapoint:
+                self.assertEqual(
+                    DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                    (2, 0)
+                )
+                mock_generate_datapoint.assert_not_called()
+
+            # Change one image, & add a new one.
+            self.primary_image.crop((0, 48, 64, 96)).save(paths[1])
+            paths.append(os.path.join(tmp_dir, "2.png"))
+            self.primary_image.crop((64, 48, 128, 96)).save(paths[2])
+            self.assertEqual(
+                DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                (1, 2)
+            )
+
+            expected_dir = os.path.join(tmp_dir, "expected")
+            DSGenerator.generate_stream(self.watermark, paths, expected_dir)
+            assertDatasetEqual(
+                ShardReader(root_dir),
+                ShardReader(expected_dir)
+            )
+
+            # Changing how we generate datapoints should regenerate them all.
+            with mock.patch.object(DSGenerator, "WATERMARK_POSITION", (1, 1)):
+                self.assertEqual(
+                    DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                    (0, 3)
+                )
+
+    def test_update_dataset_shards(self):
+        """
+        Ensure that updating a dataset leaves only the shards its index
+        points into, & doesn't create a shard when it has nothing new to
+        write.
+        """
+        def shards(root_dir):
+            return {
+                os.path.basename(fname)
+                for fname in glob.glob(os.path.join(root_dir, SHARD_GLOB))
+            }
+
+        def referenced_shards(root_dir):
+            return {
+                SHARD_FNAME.format(shard)
+                for shard in ShardReader(root_dir).index["shard"]
+            }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for index, box in enumerate([(0, 0, 64, 48), (64, 0, 128, 48)]):
+                paths.append(os.path.join(tmp_dir, "{}.png".format(index)))
+                self.primary_image.crop(box).save(paths[-1])
+
+            root_dir = os.path.join(tmp_dir, "set")
+            DSGenerator.update_dataset(self.watermark, paths, root_dir)
+            self.assertEqual(shards(root_dir), referenced_shards(root_dir))
+            before = shards(root_dir)
+
+            # Reordering the images reuses every datapoint.
+            paths.reverse()
+            self.assertEqual(
+                DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                (2, 0)
+            )
+            self.assertEqual(shards(root_dir), before)
+            self.assertEqual(shards(root_dir), referenced_shards(root_dir))
+
+            # Regenerating everything should drop the old shards.
+            with mock.patch.object(DSGenerator, "WATERMARK_POSITION", (1, 1)):
+                self.assertEqual(
+                    DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                    (0, 2)
+                )
+            self.assertTrue(shards(root_dir).isdisjoint(before))
+            self.assertEqual(shards(root_dir), referenced_shards(root_dir))
+
+    def test_update_dataset_crash(self):
+        """
+        Ensure that crashing between swapping in the new index & the new
+        manifest can't leave them out of step.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = []
+            for index, box in enumerate([(0, 0, 64, 48), (64, 0, 128, 48)]):
+                paths.append(os.path.join(tmp_dir, "{}.png".format(index)))
+                self.primary_image.crop(box).save(paths[-1])
+
+            root_dir = os.path.join(tmp_dir, "set")
+            DSGenerator.update_dataset(self.watermark, paths, root_dir)
+
+            # Swap the images over, & crash after the index is replaced.
+            paths.reverse()
+            replace = os.replace
+
+            def crash_on_manifest(src, dst):
+                if dst.endswith(DSGenerator.MANIFEST_FNAME):
+                    raise KeyboardInterrupt
+                replace(src, dst)
+
+            with mock.patch(
+                "data.generator.os.replace",
+                side_effect=crash_on_manifest
+            ):
+                with self.assertRaises(KeyboardInterrupt):
+                    DSGenerator.update_dataset(self.watermark, paths, root_dir)
+
+            # The manifest no longer describes the index, so we can't trust
+            # it to reuse anything.
+            self.assertEqual(
+                DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                (0, 2)
+            )
+            self.assertEqual(
+                DSGenerator.update_dataset(self.watermark, paths, root_dir),
+                (2, 0)
+            )
+            expected_dir = os.path.join(tmp_dir, "expected")
+            DSGenerator.generate_stream(self.watermark, paths, expected_dir)
+            actual, expected = ShardReader(root_dir), ShardReader(expected_dir)
+            self.assertEqual(len(actual), len(expected))
+            for index in range(len(expected)):
+                numpy.testing.assert_array_equal(
+                    actual[index]["watermarked"],
+                    expected[index]["watermarked"]
+                )
+
     @mock.patch("data.generator.numpy.asarray")
     def test__create_datapoint(self, mock_nump_asarray):
         """
@@ -123,6 +390,8 @@ class TestDSGenerator(TestCase):
         """
         # We'll need to test that the watermark resized correclty, that
         # it is 'pasted' onto our image, & that the image is saved.
+        mock_mask = self.watermark.getchannel("A")
+        mock_wm.return_value = (self.watermark, mock_mask)
         with mock.patch.object(
             self.primary_image,
             "paste",
@@ -137,32 +406,47 @@ class TestDSGenerator(TestCase):
             mock_paste.assert_called_with(
                 im=self.watermark,
                 box=(0, 0),
-                mask=self.watermark
+                mask=mock_mask
             )
 
     def test__resize_watermark(self):
         """
         Ensure that we can resize our watermarks.
         """
-        # Note, we really just need to test that the `Image.thumbnail()`
-        # method is called correctly.
+        test_resize_ratio = 2
+        original_size = self.watermark.size
+        resized, mask = DSGenerator._resize_watermark(
+            watermark=self.watermark,
+            dim_boundary=self.primary_image.size,
+            resize_ratio=test_resize_ratio
+        )
+
+        # The resized watermark should fit within the boundary, & keep its
+        # aspect ratio, while the given watermark is left as it was.
+        test_width, test_height = self.primary_image.size
+        self.assertLessEqual(resized.width, test_width // test_resize_ratio)
+        self.assertLessEqual(resized.height, test_height // test_resize_ratio)
+        self.assertAlmostEqual(
+            resized.width / resized.height,
+            original_size[0] / original_size[1],
+            places=1
+        )
+        self.assertEqual(self.watermark.size, original_size)
+        self.assertEqual(resized.mode, "RGBA")
+        self.assertEqual(mask.size, resized.size)
+
+        # Resizing to the same boundary again should hit the cache.
         with mock.patch.object(
             self.watermark,
-            "thumbnail",
-            wraps=self.watermark.thumbnail
-        ) as mock_thumbnail:
-            test_resize_ratio = 2
-            DSGenerator._resize_watermark(
+            "convert",
+            wraps=self.watermark.convert
+        ) as mock_convert:
+            cached, cached_mask = DSGenerator._resize_watermark(
                 watermark=self.watermark,
                 dim_boundary=self.primary_image.size,
                 resize_ratio=test_resize_ratio
             )
+            mock_convert.assert_not_called()
 
-            test_width, test_height = self.primary_image.size
-            mock_thumbnail.assert_called_with(
-                size=(
-                    test_width // test_resize_ratio,
-                    test_height // test_resize_ratio
-                ),
-                resample=DSGenerator.RESAMPLING_FILTER
-            )
+        self.assertIs(cached, resized)
+        self.assertIs(cached_mask, mask)
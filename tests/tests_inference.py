@@ -0,0 +1,232 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+import torch
+
+from unittest import TestCase
+from PIL import Image
+
+from autoencoder import ARCH0Autoencoder, ARCH1Autoencoder, UNET0Autoencoder
+from data import BatchCompositor
+from inference import (
+    TILE_SIZE,
+    Dewatermarker,
+    default_tile_size,
+    locate_watermark,
+    tiled_forward
+)
+
+
+class TestTiledInference(TestCase):
+    """
+    Test suite for tiled inference.
+    """
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = ARCH1Autoencoder(inpt_shape=(None, None, 3)).eval()
+        self.batch = torch.rand(2, 3, 75, 61)
+        with torch.no_grad():
+            self.expected = self.model(self.batch)
+
+    def test_receptive_margin(self):
+        """
+        Ensure that output pixels only see as far as the receptive margin.
+        """
+        self.assertEqual(ARCH0Autoencoder((8, 8, 3)).receptive_margin(), 2)
+        margin = self.model.receptive_margin()
+        self.assertEqual(margin, 6)
+
+        for distance, changed in [(margin, True), (margin + 1, False)]:
+            batch = self.batch.clone()
+            batch[:, :, 30, 30 + distance] += 10
+            with torch.no_grad():
+                output = self.model(batch)
+            center = output[:, :, 30, 30]
+            self.assertEqual(
+                bool((center != self.expected[:, :, 30, 30]).any()),
+                changed
+            )
+
+    def test_tiled_forward(self):
+        """
+        Ensure that tiled inference matches whole-image inference.
+        """
+        for tile_size, overlap, workers in [(48, None, 1), (32, 12, 3)]:
+            output = tiled_forward(
+                model=self.model,
+                batch=self.batch,
+                tile_size=tile_size,
+                overlap=overlap,
+                batch_size=3,
+                workers=workers
+            )
+            torch.testing.assert_close(output, self.expected)
+
+    def test_tiled_forward_aligned(self):
+        """
+        Ensure that tiling a strided model matches whole-image inference,
+        even when the tiles don't line up with its alignment.
+        """
+        torch.manual_seed(0)
+        model = UNET0Autoencoder(inpt_shape=(None, None, 3)).eval()
+        batch = torch.rand(1, 3, 250, 221)
+        with torch.no_grad():
+            expected = model(batch)
+
+        output = tiled_forward(
+            model=model,
+            batch=batch,
+            tile_size=211,
+            overlap=105,
+            batch_size=2
+        )
+        torch.testing.assert_close(output, expected)
+
+    def test_default_tile_size(self):
+        """
+        Ensure that models with a wide receptive field get tiles large
+        enough for it by default.
+        """
+        self.assertEqual(default_tile_size(self.model), TILE_SIZE)
+
+        torch.manual_seed(0)
+        model = UNET0Autoencoder(inpt_shape=(None, None, 3)).eval()
+        tile_size = default_tile_size(model)
+        self.assertGreaterEqual(tile_size, 8 * model.receptive_margin())
+        self.assertEqual(tile_size % model.ALIGNMENT, 0)
+
+        batch = torch.rand(1, 3, tile_size + 24, 40)
+        with torch.no_grad():
+            expected = model(batch)
+        output = tiled_forward(model=model, batch=batch, batch_size=2)
+        torch.testing.assert_close(output, expected)
+
+    def test_invalid_overlap(self):
+        """
+        Ensure that we refuse to blend tiles that can't match.
+        """
+        with self.assertRaises(ValueError):
+            tiled_forward(model=self.model, batch=self.batch, overlap=11)
+        with self.assertRaises(ValueError):
+            tiled_forward(model=self.model, batch=self.batch, tile_size=40)
+
+    def test_dewatermarker(self):
+        """
+        Ensure that tiling doesn't change the de-watermarked pixels.
+        """
+        image = numpy.random.default_rng(0).integers(
+            0, 256, (75, 61, 3), dtype=numpy.uint8
+        )
+        whole = Dewatermarker(self.model)([image])[0]
+        tiled = Dewatermarker(self.model, tile_size=48, workers=2)([image])[0]
+        self.assertLessEqual(
+            numpy.abs(whole.astype(int) - tiled.astype(int)).max(),
+            1
+        )
+
+
+class TestRegionInference(TestCase):
+    """
+    Test suite for de-watermarking only the region a watermark is in.
+    """
+
+    def setUp(self):
+        self.watermark = Image.open("tests/images/test-watermark.png")
+        with Image.open("tests/images/test-image.jpg") as image:
+            self.image = numpy.asarray(image.resize((200, 250)))
+
+        torch.manual_seed(0)
+        self.model = ARCH1Autoencoder(inpt_shape=(None, None, 3)).eval()
+
+    def test_locate_watermark(self):
+        """
+        Ensure that we find watermarks where they were added.
+        """
+        watermarked, boxes = BatchCompositor.composite(
+            images=self.image[None].repeat(3, axis=0),
+            watermark=self.watermark,
+            positions=[(0, 0), (20, 60), (120, 10)],
+            opacities=[1.0, 1.0, 0.7],
+            scales=[0.5, 0.5, 0.3]
+        )
+        for image, box in zip(watermarked, boxes):
+            score, located = locate_watermark(
+                image=image,
+                watermark=self.watermark,
+                scales=[0.3, 0.5]
+            )
+            self.assertGreater(score, 0.5)
+            self.assertEqual(located, tuple(box))
+
+        # By default, we look where the dataset generator adds them.
+        _, located = locate_watermark(watermarked[0], self.watermark)
+        self.assertEqual(located, tuple(boxes[0]))
+
+    def test_region_only(self):
+        """
+        Ensure that only the watermark's region is changed, & that it's
+        changed just as if we'd de-watermarked the whole image.
+        """
+        watermarked, boxes = BatchCompositor.composite(
+            images=self.image[None],
+            watermark=self.watermark,
+            positions=[(120, 10)],
+            scales=[0.3]
+        )
+        dewatermarker = Dewatermarker(
+            model=self.model,
+            watermark=self.watermark,
+            watermark_scales=[0.3]
+        )
+        whole = dewatermarker(images=watermarked, boxes=[None])[0]
+        region = dewatermarker(images=watermarked)[0]
+
+        left, top, right, bottom = boxes[0]
+        inside = numpy.zeros(region.shape[:2], dtype=bool)
+        inside[top:bottom, left:right] = True
+        numpy.testing.assert_array_equal(
+            region[~inside],
+            watermarked[0][~inside]
+        )
+        numpy.testing.assert_array_equal(region[inside], whole[inside])
+
+    def test_region_only_aligned(self):
+        """
+        Ensure that the region comes out just as it would from the whole
+        image for a strided model, too.
+        """
+        torch.manual_seed(0)
+        dewatermarker = Dewatermarker(
+            model=UNET0Autoencoder(inpt_shape=(None, None, 3)).eval()
+        )
+        box = (63, 57, 141, 130)
+        whole = dewatermarker(images=[self.image], boxes=[None])[0]
+        region = dewatermarker(images=[self.image], boxes=[box])[0]
+
+        left, top, right, bottom = box
+        numpy.testing.assert_array_equal(
+            region[top:bottom, left:right],
+            whole[top:bottom, left:right]
+        )
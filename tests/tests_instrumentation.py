@@ -0,0 +1,154 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import csv
+import json
+import os
+import tempfile
+
+import numpy
+import torch
+
+from unittest import TestCase, mock
+from torch.utils.data import DataLoader
+
+from autoencoder import ARCH1Autoencoder, UNET0Autoencoder
+from data import ToTensorCollate
+from instrumentation import TrainingMonitor
+from trainer import Trainer
+
+
+class TestTrainingMonitor(TestCase):
+    """
+    Test suite for the training instrumentation.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(0)
+        self.dataset = [
+            {
+                "watermarked": rng.integers(0, 256, (8, 8, 3), numpy.uint8),
+                "original": rng.integers(0, 256, (8, 8, 3), numpy.uint8)
+            }
+            for _ in range(6)
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _train(self, monitor, n_epochs=2, architecture=ARCH1Autoencoder):
+        model = architecture(inpt_shape=(8, 8, 3))
+        model.FPATH = os.path.join(self.tmp_dir.name, "model.pt")
+        trainer = Trainer(
+            model=model,
+            optimizer=torch.optim.Adam(model.parameters()),
+            dataloader=DataLoader(
+                self.dataset,
+                batch_size=4,
+                collate_fn=ToTensorCollate()
+            ),
+            checkpoint_dir=os.path.join(self.tmp_dir.name, "checkpoints"),
+            monitor=monitor
+        )
+        with mock.patch("builtins.print"):
+            trainer.fit(n_epochs=n_epochs)
+        monitor.close()
+
+    def test_jsonl(self):
+        """
+        Ensure that we record throughput, loader waits, module timings &
+        memory for each epoch.
+        """
+        fname = os.path.join(self.tmp_dir.name, "metrics", "run.jsonl")
+        self._train(TrainingMonitor(fname=fname))
+
+        with open(fname) as fp:
+            records = [json.loads(line) for line in fp]
+
+        self.assertEqual([record["epoch"] for record in records], [0, 1])
+        for record in records:
+            self.assertEqual(record["steps"], 2)
+            self.assertEqual(record["samples"], 6)
+            self.assertGreater(record["samples_per_sec"], 0)
+            self.assertGreaterEqual(record["loader_wait_s"], 0)
+            self.assertGreater(record["peak_rss_mb"], 0)
+            self.assertIn("loss", record)
+            for name in ("encoder", "decoder"):
+                self.assertGreater(record["backward_s." + name], 0)
+                for layer in range(6):
+                    self.assertIn(
+                        "forward_s.{}.{}".format(name, layer),
+                        record
+                    )
+
+                # A backward pass costs about as much as a forward one, so
+                # each share should be within an order of magnitude of it
+                forward_time = sum(
+                    record["forward_s.{}.{}".format(name, layer)]
+                    for layer in range(6)
+                )
+                self.assertGreater(
+                    record["backward_s." + name],
+                    forward_time / 10
+                )
+
+    def test_unet(self):
+        """
+        Ensure that we time each level of a U-Net, whose encoder & decoder
+        are lists of levels, rather than modules that are called.
+        """
+        fname = os.path.join(self.tmp_dir.name, "run.jsonl")
+        self._train(
+            TrainingMonitor(fname=fname),
+            n_epochs=1,
+            architecture=UNET0Autoencoder
+        )
+
+        with open(fname) as fp:
+            record = json.loads(fp.readline())
+
+        for name in ("encoder", "decoder"):
+            for level in range(UNET0Autoencoder.DEPTH):
+                self.assertGreater(
+                    record["backward_s.{}.{}".format(name, level)],
+                    0
+                )
+        self.assertIn("forward_s.encoder.0.0", record)
+        self.assertIn("forward_s.decoder.0.up", record)
+        self.assertIn("forward_s.decoder.0.merge", record)
+
+    def test_csv(self):
+        """
+        Ensure that we can write records as CSV, with a single header.
+        """
+        fname = os.path.join(self.tmp_dir.name, "run.csv")
+        self._train(TrainingMonitor(fname=fname, profile_modules=False))
+        self._train(TrainingMonitor(fname=fname, profile_modules=False))
+
+        with open(fname) as fp:
+            rows = list(csv.DictReader(fp))
+
+        self.assertEqual(len(rows), 4)
+        self.assertNotIn("forward_s.encoder.0", rows[0])
+        self.assertEqual(int(rows[-1]["samples"]), 6)
@@ -0,0 +1,98 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+
+from unittest import TestCase
+
+from data import PatchDataset
+
+
+class TestPatchDataset(TestCase):
+    """
+    Test suite for the patch sampling dataset wrapper.
+    """
+
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        self.box = numpy.array([200, 150, 260, 170])
+        self.dataset = [
+            {
+                "watermarked": rng.integers(0, 256, (300, 400, 3), numpy.uint8),
+                "original": rng.integers(0, 256, (300, 400, 3), numpy.uint8),
+                "box": self.box
+            }
+            for _ in range(2)
+        ]
+
+    def test__getitem__(self):
+        """
+        Ensure that patches are reproducible crops of their datapoint.
+        """
+        patches = PatchDataset(
+            self.dataset,
+            patch_size=(32, 48),
+            patches_per_sample=3
+        )
+        self.assertEqual(len(patches), 6)
+
+        patch = patches[4]
+        self.assertEqual(patch["watermarked"].shape, (32, 48, 3))
+        numpy.testing.assert_array_equal(patch["box"], patches[4]["box"])
+
+        # Find where the patch was cropped from, & check both images line up.
+        original = self.dataset[1]["original"]
+        windows = numpy.lib.stride_tricks.sliding_window_view(
+            original,
+            (32, 48, 3)
+        )[..., 0, :, :, :]
+        matches = (windows == patch["original"]).all(axis=(2, 3, 4))
+        (y, x), = numpy.argwhere(matches)
+        numpy.testing.assert_array_equal(
+            patch["watermarked"],
+            self.dataset[1]["watermarked"][y:y + 32, x:x + 48]
+        )
+
+    def test_watermark_bias(self):
+        """
+        Ensure that a full bias only gives patches overlapping the watermark,
+        with the box moved into the patch's coordinates.
+        """
+        patches = PatchDataset(
+            self.dataset,
+            patch_size=64,
+            watermark_bias=1.0,
+            patches_per_sample=50
+        )
+        for index in range(len(patches)):
+            left, top, right, bottom = patches[index]["box"]
+            self.assertTrue(0 <= left < right <= 64)
+            self.assertTrue(0 <= top < bottom <= 64)
+
+    def test_patch_too_large(self):
+        """
+        Ensure that we reject datapoints smaller than the patch size.
+        """
+        patches = PatchDataset(self.dataset, patch_size=512)
+        with self.assertRaises(ValueError):
+            patches[0]
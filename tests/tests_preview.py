@@ -0,0 +1,166 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import tempfile
+import threading
+import time
+
+import torch
+
+from unittest import TestCase, mock
+from PIL import Image
+
+from preview import PreviewSink
+
+
+class TestPreviewSink(TestCase):
+    """
+    Test suite for the background preview sink.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.output = torch.rand(6, 3, 5, 7)
+        self.batch = {
+            "watermarked": torch.rand(6, 3, 5, 7),
+            "original": torch.rand(6, 3, 5, 7)
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_submit(self):
+        """
+        Ensure that we write a contact sheet for each preview that's due.
+        """
+        sink = PreviewSink(
+            run_dir=self.tmp_dir.name,
+            every=2,
+            max_images=4,
+            max_pending=8
+        )
+        for epoch in range(4):
+            sink.submit(epoch=epoch, output=self.output, batch=self.batch)
+        sink.submit(epoch=4, output=self.output)
+        sink.close()
+
+        self.assertEqual(
+            sorted(os.listdir(self.tmp_dir.name)),
+            ["preview-000000.png", "preview-000002.png", "preview-000004.png"]
+        )
+        fname = os.path.join(self.tmp_dir.name, "preview-000002.png")
+        with Image.open(fname) as sheet:
+            self.assertEqual(sheet.size, (3 * 7, 4 * 5))
+            pixel = self.output[1, :, 2, 3] * 255
+            self.assertEqual(
+                sheet.getpixel((7 + 3, 5 + 2)),
+                tuple(int(value) for value in pixel.round())
+            )
+        fname = os.path.join(self.tmp_dir.name, "preview-000004.png")
+        with Image.open(fname) as sheet:
+            self.assertEqual(sheet.size, (7, 4 * 5))
+
+    def test_submit_never_blocks(self):
+        """
+        Ensure that we drop previews, rather than waiting, if the background
+        thread falls behind.
+        """
+        sink = PreviewSink(run_dir=self.tmp_dir.name, every=1, max_pending=1)
+        unblock = threading.Event()
+        contact_sheet = sink._contact_sheet
+
+        def slow_contact_sheet(images):
+            unblock.wait()
+            return contact_sheet(images)
+
+        with mock.patch.object(sink, "_contact_sheet", slow_contact_sheet):
+            results = [
+                sink.submit(epoch=epoch, output=self.output)
+                for epoch in range(5)
+            ]
+            unblock.set()
+            sink.close()
+
+        self.assertTrue(results[0])
+        self.assertFalse(all(results))
+        self.assertEqual(sink.n_dropped, results.count(False))
+        self.assertEqual(
+            len(os.listdir(self.tmp_dir.name)),
+            results.count(True)
+        )
+
+    def test_errors(self):
+        """
+        Ensure that a failed preview doesn't stop later ones, & that its
+        error is raised on the caller's thread.
+        """
+        sink = PreviewSink(run_dir=self.tmp_dir.name, every=1, max_pending=8)
+        contact_sheet = sink._contact_sheet
+        calls = []
+
+        def failing_contact_sheet(images):
+            calls.append(images)
+            if len(calls) == 1:
+                raise ValueError("Bad preview.")
+            return contact_sheet(images)
+
+        with mock.patch.object(sink, "_contact_sheet", failing_contact_sheet):
+            sink.submit(epoch=0, output=self.output)
+            sink.submit(epoch=1, output=self.output)
+            with self.assertRaises(RuntimeError) as context:
+                sink.close()
+
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["preview-000001.png"])
+
+        # Once the failure has been recorded, the next submit raises it
+        sink = PreviewSink(run_dir=self.tmp_dir.name, every=1, max_pending=8)
+        with mock.patch.object(sink, "_contact_sheet", side_effect=OSError):
+            sink.submit(epoch=2, output=self.output)
+            deadline = time.monotonic() + 5
+            while sink._error is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with self.assertRaises(RuntimeError):
+                sink.submit(epoch=3, output=self.output)
+        sink.close()
+
+    def test_close_dead_thread(self):
+        """
+        Ensure that closing doesn't block on a full queue once the background
+        thread has exited.
+        """
+        with mock.patch.object(PreviewSink, "_run", lambda self: None):
+            sink = PreviewSink(
+                run_dir=self.tmp_dir.name,
+                every=1,
+                max_pending=1
+            )
+        sink._thread.join()
+        self.assertTrue(sink.submit(epoch=0, output=self.output))
+        self.assertFalse(sink.submit(epoch=1, output=self.output))
+
+        closer = threading.Thread(target=sink.close, daemon=True)
+        closer.start()
+        closer.join(timeout=5)
+        self.assertFalse(closer.is_alive())
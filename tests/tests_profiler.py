@@ -0,0 +1,76 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import torch
+
+from unittest import TestCase
+
+from autoencoder import ARCH0Autoencoder, UNET0Autoencoder
+from profiler import count_macs, peak_activation_memory, profile
+
+
+class TestProfiler(TestCase):
+    """
+    Test suite for the architecture profiler.
+    """
+
+    def test_count_macs(self):
+        """
+        Ensure that we count convolution & transposed convolution MACs.
+        """
+        model = ARCH0Autoencoder((None, None, 3)).eval()
+        # The encoder's 6 output channels each take 3 * 3 * 3 MACs over a
+        # 30x30 output, & the decoder scatters those back through 3 * 3 * 3.
+        expected = 2 * 30 * 30 * 6 * 3 * 3 * 3
+        self.assertEqual(count_macs(model, torch.rand(1, 3, 32, 32)), expected)
+
+    def test_peak_activation_memory(self):
+        """
+        Ensure that peak memory scales with the activations, & that the
+        strided model needs less of it than its full-resolution outputs.
+        """
+        model = UNET0Autoencoder((None, None, 3)).eval()
+        small = peak_activation_memory(model, torch.rand(1, 3, 64, 64))
+        large = peak_activation_memory(model, torch.rand(1, 3, 128, 128))
+        # The stem's output alone is 16 channels of float32.
+        self.assertGreaterEqual(small, 16 * 64 * 64 * 4)
+        self.assertAlmostEqual(large / small, 4, delta=0.5)
+
+    def test_profile(self):
+        """
+        Ensure that we get a row per architecture & resolution.
+        """
+        results = profile(
+            archs=["ARCH0", "UNET0"],
+            resolutions=[32, 48],
+            n_runs=1
+        )
+        self.assertEqual(
+            [(result["arch"], result["resolution"]) for result in results],
+            [("ARCH0", 32), ("ARCH0", 48), ("UNET0", 32), ("UNET0", 48)]
+        )
+        for result in results:
+            self.assertGreater(result["params"], 0)
+            self.assertGreater(result["macs"], 0)
+            self.assertGreater(result["peak_memory"], 0)
+            self.assertGreater(result["latency"], 0)
@@ -0,0 +1,194 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import contextlib
+import io
+import os
+import tempfile
+
+import numpy
+import torch
+
+from unittest import TestCase
+
+import prune
+from autoencoder import ARCH1Autoencoder, ConvAutoencoder, UNET0Autoencoder
+from data import ShardWriter
+from inference import load_model
+from prune import channel_importance
+
+
+class TestPrune(TestCase):
+    """
+    Test suite for structured channel pruning.
+    """
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = ARCH1Autoencoder(inpt_shape=(None, None, 3)).eval()
+        self.batch = {"watermarked": torch.rand(2, 3, 16, 16)}
+        with torch.no_grad():
+            self.expected = self.model(self.batch["watermarked"])
+
+    def test_no_sparsity(self):
+        """
+        Ensure that pruning nothing gives back the same model.
+        """
+        pruned = prune.prune(
+            model=self.model,
+            sparsity=0,
+            importance=channel_importance(self.model)
+        )
+        self.assertIsInstance(pruned, ConvAutoencoder)
+        with torch.no_grad():
+            torch.testing.assert_close(
+                pruned(self.batch["watermarked"]),
+                self.expected
+            )
+
+    def test_prune(self):
+        """
+        Ensure that we really remove channels, keeping the layers consistent
+        across the encoder/decoder boundary.
+        """
+        pruned = prune.prune(
+            model=self.model,
+            sparsity=0.5,
+            importance=channel_importance(self.model)
+        )
+        self.assertEqual(pruned.encoder_widths, [3, 6, 12])
+        self.assertEqual(pruned.decoder_widths, [6, 3])
+        self.assertEqual(pruned.encoder[4].out_channels, 12)
+        self.assertEqual(pruned.decoder[0].in_channels, 12)
+        self.assertLess(
+            sum(param.numel() for param in pruned.parameters()),
+            sum(param.numel() for param in self.model.parameters()) / 3
+        )
+        with torch.no_grad():
+            output = pruned(self.batch["watermarked"])
+        self.assertEqual(output.shape, self.expected.shape)
+
+    def test_dead_channels(self):
+        """
+        Ensure that channels which never activate are the ones removed, by
+        activation, & that removing them doesn't change the output.
+        """
+        with torch.no_grad():
+            # Kill a quarter of the channels of every layer, but the last.
+            for layer in prune._layers(self.model)[:-1]:
+                dead = torch.arange(0, layer.out_channels, 4)
+                layer.weight.index_fill_(prune._out_dim(layer), dead, 0)
+                layer.bias[dead] = -1
+            expected = self.model(self.batch["watermarked"])
+
+        importance = channel_importance(
+            model=self.model,
+            method="activation",
+            dataloader=[self.batch]
+        )
+        self.assertEqual(
+            sorted(importance[1].argsort()[:3].tolist()),
+            [0, 4, 8]
+        )
+        pruned = prune.prune(
+            model=self.model,
+            sparsity=0.25,
+            importance=importance
+        )
+        self.assertEqual(pruned.encoder_widths, [4, 9, 18])
+        self.assertEqual(pruned.decoder_widths, [9, 4])
+        with torch.no_grad():
+            torch.testing.assert_close(
+                pruned(self.batch["watermarked"]),
+                expected
+            )
+
+    def test_unsupported_model(self):
+        """
+        Ensure that we refuse to prune models with skip connections.
+        """
+        model = UNET0Autoencoder(inpt_shape=(None, None, 3))
+        with self.assertRaises(ValueError):
+            channel_importance(model)
+
+    def test_main(self):
+        """
+        Ensure that pruned models are saved, & load like any other model's.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dataset_dir = os.path.join(tmp_dir, "set")
+            rng = numpy.random.default_rng(0)
+            with ShardWriter(root_dir=dataset_dir) as writer:
+                for _ in range(4):
+                    writer.write({
+                        "watermarked": rng.integers(0, 256, (8, 8, 3), "u1"),
+                        "original": rng.integers(0, 256, (8, 8, 3), "u1")
+                    })
+
+            checkpoint = os.path.join(tmp_dir, "arch_1.pt")
+            self.model.save(fpath=checkpoint)
+            with contextlib.redirect_stdout(io.StringIO()):
+                models, results = prune.main([
+                    "--arch", "ARCH1",
+                    "--checkpoint", checkpoint,
+                    "--dataset", dataset_dir,
+                    "--sparsities", "0.5",
+                    "--method", "activation",
+                    "--finetune-epochs", "1",
+                    "--checkpoint-dir", os.path.join(tmp_dir, "checkpoints")
+                ])
+
+            self.assertEqual(
+                [result["model"] for result in results],
+                ["dense", "pruned-50"]
+            )
+            self.assertLess(results[1]["size"], results[0]["size"])
+            for mmap in (False, True):
+                loaded = load_model(
+                    arch="ARCH1",
+                    checkpoint=os.path.join(tmp_dir, "arch_1.pruned-50.pt"),
+                    mmap=mmap
+                )
+                self.assertEqual(loaded.encoder_widths, [3, 6, 12])
+                for key, value in models["pruned-50"].state_dict().items():
+                    torch.testing.assert_close(loaded.state_dict()[key], value)
+
+            # So can fine-tuning's own checkpoints of them.
+            loaded = load_model(
+                arch="ARCH1",
+                checkpoint=os.path.join(
+                    tmp_dir,
+                    "checkpoints",
+                    "pruned-50",
+                    "checkpoint-000001.pt"
+                )
+            )
+            self.assertEqual(loaded.encoder_widths, [3, 6, 12])
+
+            # Only weights marked as pruned are built to fit, so that other
+            # mismatched weights are still an error.
+            bare = os.path.join(tmp_dir, "bare.pt")
+            torch.save(models["pruned-50"].state_dict(), bare)
+            for arch, fname in [("ARCH1", bare), ("ARCH2", checkpoint)]:
+                with self.assertRaises(RuntimeError):
+                    load_model(arch=arch, checkpoint=fname)
@@ -0,0 +1,152 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import math
+import os
+import tempfile
+
+import numpy
+import torch
+import torch.nn as nn
+
+from unittest import TestCase, mock
+
+import quantize
+from autoencoder import ARCH1Autoencoder, UNET0Autoencoder
+from data import ShardWriter
+from inference import load_model
+from quantize import QuantizedAutoencoder
+
+
+class TestQuantize(TestCase):
+    """
+    Test suite for int8 quantization.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset_dir = os.path.join(self.tmp_dir.name, "set")
+        rng = numpy.random.default_rng(0)
+        with ShardWriter(root_dir=self.dataset_dir) as writer:
+            for _ in range(8):
+                original = rng.integers(0, 256, (24, 24, 3), numpy.uint8)
+                watermarked = original.copy()
+                watermarked[:6, :12] = 20
+                writer.write({
+                    "watermarked": watermarked,
+                    "original": original
+                })
+
+        torch.manual_seed(0)
+        self.model = ARCH1Autoencoder(inpt_shape=(None, None, 3)).eval()
+        self.model.FPATH = os.path.join(self.tmp_dir.name, "arch_1.pt")
+        torch.save(self.model.state_dict(), self.model.FPATH)
+        self.batches = [
+            {"watermarked": torch.rand(2, 3, 24, 24)} for _ in range(4)
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_quantize(self):
+        """
+        Ensure that every layer is quantized, with each Conv2d fused with
+        its ReLU, & that the output stays close to the float model's.
+        """
+        quantized = QuantizedAutoencoder(self.model)
+        quantized.calibrate(self.batches, n_batches=3).convert()
+
+        layers = [type(layer).__name__ for layer in quantized.model.encoder]
+        self.assertEqual(layers, ["ConvReLU2d", "Identity"] * 3)
+        for layer in quantized.model.modules():
+            self.assertNotIn(type(layer), (nn.Conv2d, nn.ConvTranspose2d))
+
+        batch = torch.rand(2, 3, 31, 17)
+        with torch.no_grad():
+            expected = self.model(batch)
+            output = quantized(batch)
+        self.assertEqual(output.dtype, torch.float32)
+        self.assertLess(
+            float((output - expected).pow(2).mean()),
+            0.01 * float(expected.pow(2).mean())
+        )
+
+        # The float model is left untouched.
+        self.assertIsInstance(self.model.encoder[0], nn.Conv2d)
+
+    def test_save_load(self):
+        """
+        Ensure that quantized weights round-trip, without recalibrating.
+        """
+        quantized = QuantizedAutoencoder(self.model)
+        quantized.calibrate(self.batches).convert().save()
+        self.assertEqual(
+            quantized.FPATH,
+            os.path.join(self.tmp_dir.name, "arch_1.int8.pt")
+        )
+
+        loaded = load_model(
+            arch="ARCH1",
+            checkpoint=quantized.FPATH,
+            quantized=True
+        )
+        batch = torch.randint(0, 256, (2, 20, 20, 3)).to(torch.uint8)
+        batch = batch.float().permute(0, 3, 1, 2) / 255
+        torch.testing.assert_close(loaded(batch), quantized(batch))
+        self.assertEqual(loaded.receptive_margin(), 6)
+
+    def test_unquantizable(self):
+        """
+        Ensure that we refuse to quantize models with layers that have no
+        int8 version.
+        """
+        model = UNET0Autoencoder(inpt_shape=(None, None, 3))
+        with self.assertRaises(ValueError):
+            QuantizedAutoencoder(model)
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+            quantize.parse_args(["--arch", "UNET0"])
+
+    def test_main(self):
+        """
+        Ensure that we save the quantized model, & report on both models.
+        """
+        quantized, results = quantize.main([
+            "--arch", "ARCH1",
+            "--checkpoint", self.model.FPATH,
+            "--dataset", self.dataset_dir,
+            "--calibration-batches", "2",
+            "--eval-batches", "2"
+        ])
+
+        self.assertTrue(os.path.exists(quantized.FPATH))
+        self.assertEqual(
+            [result["model"] for result in results],
+            ["float", "int8"]
+        )
+        for result in results:
+            self.assertAlmostEqual(
+                result["psnr"],
+                10 * math.log10(1 / result["mse"])
+            )
+            self.assertGreater(result["latency"], 0)
+        self.assertLess(results[1]["size"], results[0]["size"])
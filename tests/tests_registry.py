@@ -0,0 +1,188 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import tempfile
+import threading
+import unittest
+
+import torch
+
+from unittest import TestCase, mock
+
+from autoencoder import ARCH0Autoencoder, ARCH1Autoencoder
+import registry
+from registry import ModelRegistry
+
+
+class TestModelRegistry(TestCase):
+    """
+    Test suite for the model registry.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        torch.manual_seed(0)
+        self.models = {
+            "arch_0.pt": ARCH0Autoencoder(inpt_shape=(None, None, 3)),
+            "other.pt": ARCH0Autoencoder(inpt_shape=(None, None, 3)),
+            "arch_1.pt": ARCH1Autoencoder(inpt_shape=(None, None, 3))
+        }
+        for fname, model in self.models.items():
+            model.save(fpath=os.path.join(self.tmp_dir.name, fname))
+        self.registry = ModelRegistry(root_dir=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        """
+        Ensure that models are loaded once, in eval mode, with their weights.
+        """
+        model = self.registry.get("ARCH1")
+        self.assertIs(self.registry.get("ARCH1", checkpoint="arch_1.pt"), model)
+        self.assertFalse(model.training)
+
+        batch = torch.rand(2, 3, 16, 16)
+        with torch.no_grad():
+            torch.testing.assert_close(
+                model(batch),
+                self.models["arch_1.pt"].eval()(batch)
+            )
+
+        other = self.registry.get("ARCH0", checkpoint="other.pt")
+        self.assertIsNot(other, self.registry.get("ARCH0"))
+        self.assertEqual(len(self.registry), 3)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/maps"), "Needs procfs.")
+    def test_memory_mapped(self):
+        """
+        Ensure that the weights are the checkpoint's mapped pages, rather
+        than a copy.
+        """
+        model = self.registry.get("ARCH1")
+        fname = self.registry.resolve("ARCH1")
+        with open("/proc/self/maps") as fp:
+            mappings = [
+                [int(address, 16) for address in line.split()[0].split("-")]
+                for line in fp
+                if line.rstrip().endswith(fname)
+            ]
+
+        for param in model.parameters():
+            self.assertTrue(any(
+                start <= param.data_ptr() < end for start, end in mappings
+            ))
+
+    def test_legacy_checkpoint(self):
+        """
+        Ensure that weights in torch's legacy format, which can't be
+        memory-mapped, are read in instead.
+        """
+        model = self.models["arch_1.pt"]
+        torch.save(
+            model.state_dict(),
+            os.path.join(self.tmp_dir.name, "legacy.pt"),
+            _use_new_zipfile_serialization=False
+        )
+        loaded = self.registry.get("ARCH1", checkpoint="legacy.pt")
+        for key, value in model.state_dict().items():
+            torch.testing.assert_close(loaded.state_dict()[key], value)
+
+    def test_missing_checkpoint(self):
+        """
+        Ensure that we fail loudly, rather than serve an untrained model.
+        """
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get("ARCH2")
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get("ARCH0", checkpoint="missing.pt")
+        with self.assertRaises(KeyError):
+            self.registry.get("ARCH9")
+        self.assertEqual(len(self.registry), 0)
+
+    def test_concurrent_loads(self):
+        """
+        Ensure that a model is only loaded once, however many threads want
+        it, & that loading it doesn't hold up other models.
+        """
+        started, unblock = threading.Event(), threading.Event()
+        calls, unblocked = [], []
+
+        def slow_load_model(**kwargs):
+            calls.append(kwargs["arch"])
+            if kwargs["arch"] == "ARCH1":
+                started.set()
+                unblocked.append(unblock.wait(timeout=10))
+            return load_model(**kwargs)
+
+        load_model = registry.load_model
+        results = []
+        with mock.patch("registry.load_model", slow_load_model):
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(self.registry.get("ARCH1"))
+                )
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+
+            # Another model can be loaded while the first is still loading.
+            started.wait(timeout=10)
+            self.registry.get("ARCH0")
+            unblock.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(unblocked, [True])
+        self.assertEqual(sorted(calls), ["ARCH0", "ARCH1"])
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(model is results[0] for model in results))
+        self.assertEqual(self.registry._loading, {})
+
+    def test_eviction(self):
+        """
+        Ensure that the least recently used models are evicted once we're
+        over the memory budget.
+        """
+        small = self.registry._nbytes(self.registry.get("ARCH0"), False)
+        large = self.registry._nbytes(self.registry.get("ARCH1"), False)
+        registry = ModelRegistry(
+            root_dir=self.tmp_dir.name,
+            memory_budget=large + small
+        )
+        arch_0 = registry.get("ARCH0")
+        arch_1 = registry.get("ARCH1")
+        self.assertIs(registry.get("ARCH0"), arch_0)
+        registry.get("ARCH0", checkpoint="other.pt")
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.nbytes, 2 * small)
+        self.assertIs(registry.get("ARCH0"), arch_0)
+        self.assertIsNot(registry.get("ARCH1"), arch_1)
+
+        # The model we just asked for is kept, even if it's over budget.
+        registry = ModelRegistry(root_dir=self.tmp_dir.name, memory_budget=1)
+        registry.get("ARCH0")
+        registry.get("ARCH1")
+        self.assertEqual(len(registry), 1)
@@ -0,0 +1,233 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import asyncio
+import io
+import json
+import os
+import tempfile
+
+import numpy
+import torch
+
+from unittest import IsolatedAsyncioTestCase, mock
+from PIL import Image
+
+from autoencoder import ARCH0Autoencoder, ARCH1Autoencoder
+from inference import Dewatermarker
+from registry import ModelRegistry
+import server
+from server import InferenceServer
+
+
+async def _request(port, method, path, body=b""):
+    """
+    Make a single HTTP request, returning the status & body.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write((
+        "{} {} HTTP/1.1\r\n"
+        "Host: localhost\r\n"
+        "Content-Length: {}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+    ).format(method, path, len(body)).encode("latin-1") + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), payload
+
+
+def _png(pixels):
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestInferenceServer(IsolatedAsyncioTestCase):
+    """
+    Test suite for the HTTP inference server.
+    """
+
+    async def asyncSetUp(self):
+        torch.manual_seed(0)
+        self.dewatermarker = Dewatermarker(
+            ARCH0Autoencoder(inpt_shape=(None, None, 3))
+        )
+        self.server = InferenceServer(
+            dewatermarker=self.dewatermarker,
+            max_batch_size=4,
+            max_wait=0.2
+        )
+        _, self.port = await self.server.start(port=0)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_micro_batching(self):
+        """
+        Ensure that concurrent requests for same-sized images are batched,
+        & that everyone gets their own image back.
+        """
+        rng = numpy.random.default_rng(0)
+        images = [
+            rng.integers(0, 256, shape, dtype=numpy.uint8)
+            for shape in [(16, 16, 3)] * 6 + [(20, 24, 3)] * 3
+        ]
+        responses = await asyncio.gather(*[
+            _request(self.port, "POST", "/dewatermark", _png(image))
+            for image in images
+        ])
+
+        for image, (status, payload) in zip(images, responses):
+            self.assertEqual(status, 200)
+            with Image.open(io.BytesIO(payload)) as output:
+                self.assertEqual(output.format, "PNG")
+                numpy.testing.assert_array_equal(
+                    numpy.asarray(output),
+                    self.dewatermarker([image])[0]
+                )
+
+        # 6 images fill a batch of 4, & then a batch of 2 at the deadline.
+        status, payload = await _request(self.port, "GET", "/metrics")
+        metrics = json.loads(payload)
+        self.assertEqual(status, 200)
+        self.assertEqual(metrics["requests"], len(images))
+        self.assertEqual(metrics["batches"], 3)
+        self.assertEqual(metrics["mean_batch_size"], 3)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertGreater(metrics["latency"]["p99"], 0)
+
+    async def test_format(self):
+        """
+        Ensure that we can ask for the result in another format.
+        """
+        image = numpy.zeros((8, 8, 3), dtype=numpy.uint8)
+        status, payload = await _request(
+            self.port,
+            "POST",
+            "/dewatermark?format=bmp",
+            _png(image)
+        )
+        self.assertEqual(status, 200)
+        with Image.open(io.BytesIO(payload)) as output:
+            self.assertEqual(output.format, "BMP")
+
+    async def test_registry(self):
+        """
+        Ensure that requests can ask for other models from the registry,
+        & are only batched with requests for the same model.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model = ARCH1Autoencoder(inpt_shape=(None, None, 3))
+            model.save(fpath=os.path.join(tmp_dir, model.FPATH))
+            server = InferenceServer(
+                dewatermarker=self.dewatermarker,
+                max_batch_size=4,
+                max_wait=0.2,
+                registry=ModelRegistry(root_dir=tmp_dir)
+            )
+            _, port = await server.start(port=0)
+            try:
+                image = numpy.random.default_rng(0).integers(
+                    0, 256, (16, 16, 3), dtype=numpy.uint8
+                )
+                responses = await asyncio.gather(*[
+                    _request(port, "POST", path, _png(image))
+                    for path in ["/dewatermark", "/dewatermark?arch=ARCH1"] * 2
+                ])
+                expected = [
+                    self.dewatermarker([image])[0],
+                    Dewatermarker(model.eval())([image])[0]
+                ] * 2
+                for output, (status, payload) in zip(expected, responses):
+                    self.assertEqual(status, 200)
+                    with Image.open(io.BytesIO(payload)) as image_out:
+                        numpy.testing.assert_array_equal(
+                            numpy.asarray(image_out),
+                            output
+                        )
+                self.assertEqual(server.metrics()["batches"], 2)
+
+                status, _ = await _request(
+                    port,
+                    "POST",
+                    "/dewatermark?arch=ARCH2",
+                    _png(image)
+                )
+                self.assertEqual(status, 404)
+            finally:
+                await server.close()
+
+        # Without a registry, only the default model is served.
+        status, _ = await _request(
+            self.port,
+            "POST",
+            "/dewatermark?arch=ARCH1",
+            _png(image)
+        )
+        self.assertEqual(status, 400)
+
+    async def test_serve(self):
+        """
+        Ensure that the command line server starts with weights in torch's
+        legacy format.
+        """
+        async def close(instance):
+            self.assertEqual(len(instance.registry), 1)
+            await instance.close()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = os.path.join(tmp_dir, "arch_1.pt")
+            torch.save(
+                ARCH1Autoencoder(inpt_shape=(None, None, 3)).state_dict(),
+                checkpoint,
+                _use_new_zipfile_serialization=False
+            )
+            args = server.parse_args([
+                "--arch", "ARCH1",
+                "--checkpoint", checkpoint,
+                "--port", "0"
+            ])
+            with mock.patch.object(InferenceServer, "serve_forever", close), \
+                    mock.patch("builtins.print"):
+                await server.serve(args)
+
+    async def test_errors(self):
+        """
+        Ensure that bad requests get an error, rather than a dropped
+        connection.
+        """
+        for method, path, body, expected in [
+            ("POST", "/dewatermark", b"not an image", 400),
+            ("GET", "/dewatermark", b"", 405),
+            ("GET", "/nothing", b"", 404)
+        ]:
+            status, payload = await _request(self.port, method, path, body)
+            self.assertEqual(status, expected)
+            self.assertIn("error", json.loads(payload))
+
+        status, payload = await _request(self.port, "GET", "/metrics")
+        self.assertEqual(json.loads(payload)["errors"], 3)
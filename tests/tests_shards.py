@@ -0,0 +1,246 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import pickle
+import tempfile
+
+import numpy
+
+from unittest import mock, TestCase
+
+from data import ShardReader, ShardWriter
+from data.shards import (
+    INDEX_FNAME,
+    SHARD_FNAME,
+    V1_RECORD_DTYPE,
+    index_version,
+    migrate_index,
+    write_shard
+)
+
+
+class TestShards(TestCase):
+    """
+    Test suite for the sharded dataset format.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root_dir = os.path.join(self.tmp_dir.name, "set")
+        rng = numpy.random.default_rng(0)
+        self.dataset = [
+            {
+                "watermarked": rng.integers(0, 256, shape, dtype=numpy.uint8),
+                "original": rng.integers(0, 256, shape, dtype=numpy.uint8)
+            }
+            for shape in [(4, 5, 3), (6, 2, 3), (3, 3), (4, 5, 4)]
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def assertDatasetEqual(self, reader, dataset):
+        self.assertEqual(len(reader), len(dataset))
+        for index, datapoint in enumerate(dataset):
+            for key in ("watermarked", "original"):
+                numpy.testing.assert_array_equal(
+                    reader[index][key],
+                    datapoint[key]
+                )
+
+    def test_write_read(self):
+        """
+        Ensure that datapoints round-trip through the sharded format.
+        """
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            for datapoint in self.dataset:
+                writer.write(datapoint)
+
+        self.assertDatasetEqual(ShardReader(self.root_dir), self.dataset)
+
+    def test_watermark_box(self):
+        """
+        Ensure that a datapoint's watermark box is kept, if it has one.
+        """
+        datapoint = dict(self.dataset[0], box=numpy.array([1, 2, 3, 4]))
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            writer.write(datapoint)
+            writer.write(self.dataset[1])
+
+        reader = ShardReader(self.root_dir)
+        numpy.testing.assert_array_equal(reader[0]["box"], [1, 2, 3, 4])
+        self.assertNotIn("box", reader[1])
+
+    def test_shard_rollover(self):
+        """
+        Ensure that we start a new shard once the current one is full.
+        """
+        with ShardWriter(root_dir=self.root_dir, shard_size=64) as writer:
+            for datapoint in self.dataset:
+                writer.write(datapoint)
+
+        reader = ShardReader(self.root_dir)
+        self.assertEqual(len(set(reader.index["shard"])), len(self.dataset))
+        self.assertDatasetEqual(reader, self.dataset)
+
+    def test_durability(self):
+        """
+        Ensure that a shard we've rolled over from is synced before it's
+        closed, & that new files' directory entries are synced on commit.
+        """
+        synced = []
+        fsync = os.fsync
+
+        def record_fsync(fd):
+            synced.append(os.readlink("/proc/self/fd/{}".format(fd)))
+            fsync(fd)
+
+        with mock.patch("data.shards.os.fsync", side_effect=record_fsync):
+            with ShardWriter(root_dir=self.root_dir, shard_size=64) as writer:
+                writer.write(self.dataset[0])
+                writer.write(self.dataset[1])
+                first_shard = os.path.realpath(
+                    os.path.join(self.root_dir, SHARD_FNAME.format(0))
+                )
+                self.assertIn(first_shard, synced)
+                del synced[:]
+                writer.commit()
+
+        self.assertIn(os.path.realpath(self.root_dir), synced)
+
+    def test_uncommitted_datapoints_are_discarded(self):
+        """
+        Ensure that only committed datapoints survive a crash, & that we
+        can append to a dataset from where it was last committed.
+        """
+        writer = ShardWriter(root_dir=self.root_dir)
+        writer.write(self.dataset[0])
+        writer.commit()
+        writer.write(self.dataset[1])
+        writer._fp.close()
+
+        # Simulate a torn write of the index, too.
+        with open(os.path.join(self.root_dir, INDEX_FNAME), "ab") as fp:
+            fp.write(b"\x00" * 3)
+
+        self.assertEqual(len(ShardReader(self.root_dir)), 1)
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            self.assertEqual(writer.n_committed, 1)
+            for datapoint in self.dataset[1:]:
+                writer.write(datapoint)
+
+        self.assertDatasetEqual(ShardReader(self.root_dir), self.dataset)
+
+    def test_reserved_shards(self):
+        """
+        Ensure that shards written outside of the writer are interleaved
+        with its own writes in the order they were added.
+        """
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            writer.write(self.dataset[0])
+            shard, fname = writer.reserve_shard()
+            records = write_shard(fname=fname, datapoints=self.dataset[1:3])
+            writer.add_shard(shard=shard, records=records)
+            writer.write(self.dataset[3])
+
+        reader = ShardReader(self.root_dir)
+        self.assertEqual(list(reader.index["shard"]), [0, 1, 1, 2])
+        self.assertDatasetEqual(reader, self.dataset)
+
+    def test_overwrite(self):
+        """
+        Ensure that we can replace an existing dataset.
+        """
+        with ShardWriter(root_dir=self.root_dir, shard_size=100) as writer:
+            for datapoint in self.dataset:
+                writer.write(datapoint)
+
+        with ShardWriter(root_dir=self.root_dir, overwrite=True) as writer:
+            writer.write(self.dataset[0])
+
+        self.assertDatasetEqual(ShardReader(self.root_dir), self.dataset[:1])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.root_dir, SHARD_FNAME.format(1)))
+        )
+
+    def test_invalid_datapoint(self):
+        """
+        Ensure that we reject datapoints the format can't represent.
+        """
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            with self.assertRaises(ValueError):
+                writer.write({
+                    "watermarked": numpy.zeros((2, 2), dtype=numpy.float32),
+                    "original": numpy.zeros((2, 2), dtype=numpy.float32)
+                })
+            with self.assertRaises(ValueError):
+                writer.write({
+                    "watermarked": numpy.zeros((2, 2), dtype=numpy.uint8),
+                    "original": numpy.zeros((2, 3), dtype=numpy.uint8)
+                })
+
+    def test_legacy_index(self):
+        """
+        Ensure that we refuse to misread an index written with the old
+        record layout, & that it can be upgraded in place.
+        """
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            for datapoint in self.dataset:
+                writer.write(datapoint)
+
+        # Rewrite the index as the first version did, with no header & no
+        # watermark boxes.
+        index_fname = os.path.join(self.root_dir, INDEX_FNAME)
+        records = numpy.array(ShardReader(self.root_dir).index)
+        legacy = numpy.empty(len(records), dtype=V1_RECORD_DTYPE)
+        for field in V1_RECORD_DTYPE.names:
+            legacy[field] = records[field]
+        legacy.tofile(index_fname)
+        self.assertEqual(index_version(index_fname), 1)
+
+        with self.assertRaises(ValueError):
+            ShardReader(self.root_dir)
+        with self.assertRaises(ValueError):
+            ShardWriter(root_dir=self.root_dir)
+
+        self.assertTrue(migrate_index(self.root_dir))
+        self.assertFalse(migrate_index(self.root_dir))
+        reader = ShardReader(self.root_dir)
+        self.assertDatasetEqual(reader, self.dataset)
+        self.assertNotIn("box", reader[0])
+
+    def test_reader_pickle(self):
+        """
+        Ensure that a pickled reader re-maps its shards, rather than
+        carrying a copy of the data along with it.
+        """
+        with ShardWriter(root_dir=self.root_dir) as writer:
+            for datapoint in self.dataset:
+                writer.write(datapoint)
+
+        reader = ShardReader(self.root_dir)
+        reader[0]
+        state = pickle.dumps(reader)
+        self.assertLess(len(state), 512)
+        self.assertDatasetEqual(pickle.loads(state), self.dataset)
@@ -0,0 +1,197 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import csv
+import math
+import os
+import tempfile
+
+import numpy
+
+from multiprocessing.reduction import ForkingPickler
+from unittest import TestCase, mock
+
+import sweep
+from data import DeWatermarkerDataset, ShardWriter
+
+
+class TestSweep(TestCase):
+    """
+    Test suite for the hyperparameter sweep.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset_dir = os.path.join(self.tmp_dir.name, "set")
+        rng = numpy.random.default_rng(0)
+        with ShardWriter(root_dir=self.dataset_dir) as writer:
+            for _ in range(6):
+                writer.write({
+                    "watermarked": rng.integers(0, 256, (8, 8, 3), numpy.uint8),
+                    "original": rng.integers(0, 256, (8, 8, 3), numpy.uint8)
+                })
+        self.dataset = DeWatermarkerDataset(root_dir=self.dataset_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_space(self):
+        """
+        Ensure that we parse lists of values & ranges, & reject the rest.
+        """
+        space = sweep.parse_space([
+            "arch=ARCH0,ARCH1",
+            "batch_size=2:8",
+            "eta=log:1e-4:1e-2"
+        ])
+        self.assertEqual(space["arch"], ["ARCH0", "ARCH1"])
+        self.assertEqual(space["batch_size"], (2, 8, False))
+        self.assertEqual(space["eta"], (1e-4, 1e-2, True))
+        for spec in ["arch=ARCH9", "epochs=1,2", "eta=exp:1:2", "arch=a:b"]:
+            with self.assertRaises(ValueError):
+                sweep.parse_space([spec])
+
+    def test_configs(self):
+        """
+        Ensure that grid search covers every combination, & that random
+        search stays within its ranges.
+        """
+        space = sweep.parse_space(["arch=ARCH0,ARCH1", "eta=1e-2,1e-3"])
+        configs = sweep.grid_configs(space)
+        self.assertEqual(len(configs), 4)
+        self.assertEqual(
+            {(config["arch"], config["eta"]) for config in configs},
+            {("ARCH0", 1e-2), ("ARCH0", 1e-3), ("ARCH1", 1e-2),
+             ("ARCH1", 1e-3)}
+        )
+        self.assertTrue(all(config["batch_size"] == 4 for config in configs))
+
+        space = sweep.parse_space(["batch_size=2:8", "eta=log:1e-4:1e-2"])
+        with self.assertRaises(ValueError):
+            sweep.grid_configs(space)
+        configs = sweep.random_configs(space, n_trials=20)
+        self.assertEqual(configs, sweep.random_configs(space, n_trials=20))
+        for config in configs:
+            self.assertIsInstance(config["batch_size"], int)
+            self.assertTrue(2 <= config["batch_size"] <= 8)
+            self.assertTrue(1e-4 <= config["eta"] <= 1e-2)
+
+    def test_schedule(self):
+        """
+        Ensure that each round trains longer, up to the maximum.
+        """
+        self.assertEqual(sweep.schedule(1, 20, 3), [1, 3, 9, 20])
+        self.assertEqual(sweep.schedule(100, 100, 3), [100])
+        for min_epochs, reduction in [(0, 3), (1, 1)]:
+            with self.assertRaises(ValueError):
+                sweep.schedule(min_epochs, 20, reduction)
+            with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+                sweep.parse_args([
+                    "--min-epochs", str(min_epochs),
+                    "--reduction", str(reduction)
+                ])
+
+    def test_shared_dataset(self):
+        """
+        Ensure that the shared copy matches the dataset, & that sending it
+        to another process doesn't send the data along with it.
+        """
+        shared = sweep.SharedDataset(self.dataset)
+        self.assertEqual(len(shared), len(self.dataset))
+        for index in range(len(shared)):
+            for key in ("watermarked", "original"):
+                numpy.testing.assert_array_equal(
+                    shared[index][key],
+                    self.dataset[index][key]
+                )
+
+        self.assertTrue(shared.buffer.is_shared())
+        self.assertLess(
+            len(ForkingPickler.dumps(shared)),
+            shared.buffer.numel()
+        )
+
+    def test_sweep(self):
+        """
+        Ensure that the worst trials are stopped early, & that the results
+        are summarized, best first.
+        """
+        sweep_dir = os.path.join(self.tmp_dir.name, "sweep")
+        configs = sweep.grid_configs(
+            sweep.parse_space(["arch=ARCH0", "eta=1e-1,1e-3"])
+        )
+        rows = sweep.sweep(
+            dataset=self.dataset,
+            configs=configs,
+            sweep_dir=sweep_dir,
+            max_epochs=2,
+            min_epochs=1,
+            reduction=2,
+            parallel=2,
+            threads=1
+        )
+        self.assertEqual(
+            sorted((row["status"], row["epochs"]) for row in rows),
+            [("completed", 2), ("stopped", 1)]
+        )
+        self.assertEqual(rows[0]["status"], "completed")
+        with open(os.path.join(sweep_dir, sweep.SUMMARY_FNAME)) as fp:
+            summary = list(csv.DictReader(fp))
+        self.assertEqual(
+            [int(row["trial"]) for row in summary],
+            [row["trial"] for row in rows]
+        )
+        self.assertTrue(os.path.exists(
+            os.path.join(sweep_dir, "trial-000", "weights.pt")
+        ))
+
+    def test_failed_trials(self):
+        """
+        Ensure that trials that diverge or raise are recorded as such &
+        ranked last, rather than stopping the sweep.
+        """
+        config = {"arch": "ARCH0", "batch_size": 2, "weight_decay": 0.0}
+        configs = [
+            dict(config, eta=math.inf),
+            dict(config, eta=1e-3),
+            dict(config, eta=1e-3, arch="MISSING")
+        ]
+        with mock.patch("builtins.print"):
+            rows = sweep.sweep(
+                dataset=self.dataset,
+                configs=configs,
+                sweep_dir=os.path.join(self.tmp_dir.name, "sweep"),
+                max_epochs=2,
+                min_epochs=1,
+                reduction=2,
+                parallel=2,
+                threads=1
+            )
+
+        self.assertEqual(
+            [(row["trial"], row["status"]) for row in rows],
+            [(1, "completed"), (0, "diverged"), (2, "failed")]
+        )
+        self.assertEqual(rows[0]["epochs"], 2)
+        self.assertEqual(rows[1]["val_loss"], math.inf)
+        self.assertEqual(rows[2]["val_loss"], math.inf)
@@ -0,0 +1,106 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+
+from unittest import TestCase
+from PIL import Image
+from torch.utils.data import DataLoader
+
+from data import BatchCompositor, SyntheticDataset
+
+
+class TestSyntheticDataset(TestCase):
+    """
+    Test suite for the on-the-fly synthetic dataset.
+    """
+
+    def setUp(self):
+        TEST_WATERMARK_PATH = "tests/images/test-watermark.png"
+        TEST_IMG_PATH = "tests/images/test-image.jpg"
+        image = Image.open(TEST_IMG_PATH)
+        self.images = [
+            image.crop((0, 0, 96, 64)),
+            image.crop((100, 100, 196, 164))
+        ]
+        self.dataset = SyntheticDataset(
+            images=self.images,
+            watermarks=[TEST_WATERMARK_PATH],
+            length=6,
+            seed=1
+        )
+
+    def assertSampleEqual(self, actual, expected):
+        for key in ("watermarked", "original", "box"):
+            numpy.testing.assert_array_equal(actual[key], expected[key])
+
+    def test__getitem__(self):
+        """
+        Ensure that datapoints are reproducible, & differ between indices
+        & epochs.
+        """
+        sample = self.dataset[3]
+        self.assertEqual(sample["watermarked"].shape, (64, 96, 3))
+        self.assertSampleEqual(self.dataset[3], sample)
+
+        left, top, right, bottom = sample["box"]
+        changed = sample["watermarked"] != sample["original"]
+        self.assertTrue(changed[top:bottom, left:right].any())
+        changed[top:bottom, left:right] = False
+        self.assertFalse(changed.any())
+
+        self.assertFalse(
+            numpy.array_equal(self.dataset[4]["box"], sample["box"])
+        )
+        self.dataset.set_epoch(1)
+        self.assertFalse(
+            numpy.array_equal(self.dataset[3]["box"], sample["box"])
+        )
+
+    def test_watermark_cache(self):
+        """
+        Ensure that the resized watermarks are reused across datapoints.
+        """
+        BatchCompositor.WATERMARK_CACHE.clear()
+        dataset = SyntheticDataset(
+            images=self.images[:1],
+            watermarks=["tests/images/test-watermark.png"],
+            length=32,
+            scale_steps=4
+        )
+        for index in range(len(dataset)):
+            dataset[index]
+        self.assertLessEqual(len(BatchCompositor.WATERMARK_CACHE), 4)
+
+    def test__iter__(self):
+        """
+        Ensure that the DataLoader workers generate every datapoint of an
+        epoch exactly once between them.
+        """
+        expected = [self.dataset[index] for index in range(len(self.dataset))]
+        dataloader = DataLoader(self.dataset, batch_size=None, num_workers=2)
+        samples = list(dataloader)
+
+        self.assertEqual(len(samples), len(expected))
+        for actual, sample in zip(samples, expected):
+            self.assertSampleEqual(actual, sample)
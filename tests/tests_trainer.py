@@ -0,0 +1,127 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import os
+import tempfile
+
+import numpy
+import torch
+
+from unittest import TestCase
+from torch.utils.data import DataLoader
+
+from autoencoder import ARCH0Autoencoder
+from data import ToTensorCollate
+from trainer import Trainer
+
+
+class TestTrainer(TestCase):
+    """
+    Test suite for the autoencoder trainer.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_dir = os.path.join(self.tmp_dir.name, "checkpoints")
+        rng = numpy.random.default_rng(0)
+        self.dataset = [
+            {
+                "watermarked": rng.integers(0, 256, (8, 8, 3), numpy.uint8),
+                "original": rng.integers(0, 256, (8, 8, 3), numpy.uint8)
+            }
+            for _ in range(6)
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _trainer(self, **kwargs):
+        model = ARCH0Autoencoder(inpt_shape=(8, 8, 3))
+        model.FPATH = os.path.join(self.tmp_dir.name, "arch_0.pt")
+        dataloader = DataLoader(
+            self.dataset,
+            batch_size=2,
+            shuffle=True,
+            collate_fn=ToTensorCollate()
+        )
+        optimizer = torch.optim.Adam(model.parameters(), lr=1e-2)
+        return Trainer(
+            model=model,
+            optimizer=optimizer,
+            dataloader=dataloader,
+            checkpoint_dir=self.checkpoint_dir,
+            **kwargs
+        )
+
+    def test_resume(self):
+        """
+        Ensure that resuming from a checkpoint gives exactly the same
+        result as training without interruption.
+        """
+        torch.manual_seed(0)
+        trainer = self._trainer(checkpoint_every=2)
+        trainer.fit(n_epochs=4)
+        expected = trainer.model.state_dict()
+
+        # Train for half as long, & then resume from the checkpoint with a
+        # different RNG state & a freshly initialized model.
+        torch.manual_seed(0)
+        os.remove(os.path.join(self.checkpoint_dir, "checkpoint-000004.pt"))
+        self._trainer(checkpoint_every=2).fit(n_epochs=2)
+
+        torch.manual_seed(1)
+        trainer = self._trainer(checkpoint_every=2)
+        self.assertTrue(trainer.resume())
+        self.assertEqual(trainer.epoch, 2)
+        trainer.fit(n_epochs=4)
+
+        for key, value in trainer.model.state_dict().items():
+            torch.testing.assert_close(value, expected[key], rtol=0, atol=0)
+
+    def test_checkpoints(self):
+        """
+        Ensure that we only keep the most recent checkpoints, always keeping
+        at least one, & that we save the model's weights as the loss
+        improves.
+        """
+        with self.assertRaises(ValueError):
+            self._trainer(keep_last=0)
+
+        trainer = self._trainer(checkpoint_every=1, keep_last=2)
+        self.assertFalse(trainer.resume())
+        trainer.fit(n_epochs=5)
+
+        self.assertEqual(
+            sorted(os.listdir(self.checkpoint_dir)),
+            ["checkpoint-000004.pt", "checkpoint-000005.pt"]
+        )
+        state = torch.load(
+            os.path.join(self.checkpoint_dir, "checkpoint-000005.pt"),
+            weights_only=False
+        )
+        self.assertEqual(state["epoch"], 5)
+        self.assertIn("state", state["optimizer"])
+
+        model = ARCH0Autoencoder(inpt_shape=(8, 8, 3))
+        model.FPATH = trainer.model.FPATH
+        model.load()
@@ -0,0 +1,77 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import numpy
+import torch
+
+from unittest import TestCase
+
+from data import ToTensorCollate
+
+
+class TestToTensorCollate(TestCase):
+    """
+    Test suite for the tensor collate function.
+    """
+
+    def setUp(self):
+        rng = numpy.random.default_rng(0)
+        self.batch = [
+            {
+                "watermarked": rng.integers(0, 256, (5, 7, 3), numpy.uint8),
+                "original": rng.integers(0, 256, (5, 7, 3), numpy.uint8),
+                "box": numpy.array([0, 1, 2, 3])
+            }
+            for _ in range(3)
+        ]
+
+    def test_collate(self):
+        """
+        Ensure that images are collated into scaled NCHW float batches, &
+        that anything else is collated as usual.
+        """
+        collated = ToTensorCollate()(self.batch)
+        for key in ("watermarked", "original"):
+            images = collated[key]
+            self.assertEqual(images.shape, (3, 3, 5, 7))
+            self.assertEqual(images.dtype, torch.float32)
+            self.assertTrue(images.is_contiguous())
+
+            expected = numpy.stack([sample[key] for sample in self.batch])
+            expected = expected.transpose(0, 3, 1, 2) / 255
+            numpy.testing.assert_allclose(images.numpy(), expected, rtol=1e-6)
+
+        self.assertEqual(collated["box"].shape, (3, 4))
+
+    def test_collate_channels_last(self):
+        """
+        Ensure that we can collate into the channels-last memory format,
+        without scaling.
+        """
+        collated = ToTensorCollate(scale=1, channels_last=True)(self.batch)
+        images = collated["watermarked"]
+        self.assertTrue(images.is_contiguous(memory_format=torch.channels_last))
+        self.assertEqual(
+            images[1, :, 2, 3].tolist(),
+            self.batch[1]["watermarked"][2, 3].tolist()
+        )
@@ -0,0 +1,85 @@
+# MIT License
+#
+# Copyright (c) 2019 Andrew Tallos
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from PIL import Image
+
+from data import WatermarkCache
+
+
+class TestWatermarkCache(TestCase):
+    """
+    Test suite for the resized watermark cache.
+    """
+
+    def setUp(self):
+        TEST_WATERMARK_PATH = "tests/images/test-watermark.png"
+        self.watermark = Image.open(TEST_WATERMARK_PATH)
+        self.cache = WatermarkCache(maxsize=2)
+
+    def test_get(self):
+        """
+        Ensure that each watermark & target size is only resized once.
+        """
+        resized, mask = self.cache.get(self.watermark, (800, 1000))
+        self.assertEqual(resized.size, (400, 73))
+        self.assertEqual(mask.mode, "L")
+        self.assertIs(self.cache.get(self.watermark, (800, 1000))[0], resized)
+        resized_again, _ = self.cache.get(self.watermark, (600, 1000))
+        self.assertIsNot(resized_again, resized)
+
+        other_watermark = self.watermark.copy()
+        resized_other, _ = self.cache.get(other_watermark, (800, 1000))
+        self.assertIsNot(resized_other, resized)
+
+    def test_eviction(self):
+        """
+        Ensure that we evict the least recently used entries first.
+        """
+        first, _ = self.cache.get(self.watermark, (800, 1000))
+        self.cache.get(self.watermark, (600, 1000))
+        self.cache.get(self.watermark, (800, 1000))
+        self.cache.get(self.watermark, (400, 1000))
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIs(self.cache.get(self.watermark, (800, 1000))[0], first)
+
+    def test_threads(self):
+        """
+        Ensure that the cache stays consistent when shared between threads.
+        """
+        # Images are read lazily, which isn't thread-safe, so callers load
+        # watermarks before sharing them.
+        self.watermark.load()
+        sizes = [(width, 1000) for width in range(200, 1000, 100)] * 8
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(
+                lambda size: self.cache.get(self.watermark, size),
+                sizes
+            ))
+
+        self.assertEqual(len(self.cache), 2)
+        for (width, _), (resized, mask) in zip(sizes, results):
+            self.assertEqual(resized.width, width // 2)
+            self.assertEqual(mask.size, resized.size)
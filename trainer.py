@@ -0,0 +1,399 @@
+# MIT License
+# 
+# Copyright (c) 2019 Andrew Tallos
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+# ================================================================
+
+import copy
+import glob
+import os
+import queue
+import random
+import threading
+import time
+
+import numpy
+import torch
+
+
+def _snapshot(state):
+    # Training carries on updating the model & optimizer in place, so the
+    # background writer needs its own copy of their tensors.
+    return copy.deepcopy(state)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a background thread, so that training never has to
+    wait on serialization or disk I/O. Each checkpoint is written to a
+    temporary file & then renamed into place, so a crash mid-write can never
+    leave a corrupt checkpoint behind.
+    """
+
+    def __init__(self, max_pending=2):
+        """
+        Args:
+            max_pending (int): The number of writes that can be queued before
+                `submit()` blocks. This bounds the memory held by snapshots.
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, state, fname, on_written=None):
+        """
+        Queue a checkpoint to be written. Note, the state must not be
+        modified after it's submitted, so pass a snapshot.
+        Args:
+            state (dict): The state to save.
+            fname (str): The file to save it to.
+            on_written (callable): Optional function to call (on the writer
+                thread) once the checkpoint has been written.
+        """
+        self._raise_error()
+        self._queue.put((state, fname, on_written))
+
+    def wait(self):
+        """
+        Block until every queued checkpoint has been written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Wait for every queued checkpoint to be written, & stop the thread.
+        """
+        try:
+            self.wait()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            state, fname, on_written = item
+            try:
+                tmp_fname = fname + ".tmp"
+                with open(tmp_fname, "wb") as fp:
+                    torch.save(state, fp)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(tmp_fname, fname)
+                if on_written:
+                    on_written()
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Failed to write checkpoint.") from error
+
+
+class Trainer:
+    """
+    Trains an autoencoder, periodically saving full checkpoints of the
+    training state (the model & optimizer, the epoch, the best loss so far &
+    all of the RNG state), so that an interrupted run can be resumed
+    exactly where it left off.
+    """
+    CHECKPOINT_FNAME = "checkpoint-{:06d}.pt"
+    CHECKPOINT_GLOB = "checkpoint-*.pt"
+    LOG_EVERY = 100
+
+    def __init__(
+        self,
+        model,
+        optimizer,
+        dataloader,
+        criterion=None,
+        checkpoint_dir="checkpoints",
+        checkpoint_every=100,
+        keep_last=3,
+        preview=None,
+        main_process=True,
+        monitor=None
+    ):
+        """
+        Args:
+            model (BaseAutoencoder): The model to train.
+            optimizer (Optimizer): The optimizer to train the model with.
+            dataloader (DataLoader): The training data. Batches are expected
+                to have already been prepared by `data.ToTensorCollate`.
+            criterion (callable): The loss function. Default is MSE.
+            checkpoint_dir (str): The directory to save checkpoints to.
+            checkpoint_every (int): The number of epochs between checkpoints.
+            keep_last (int): The number of most recent checkpoints to keep.
+                Must be at least 1.
+            preview (PreviewSink): Optional sink to submit the model's
+                output on the last batch of each epoch to.
+            main_process (bool): Whether this is the process responsible for
+                logging & checkpoints, when training across several
+                processes. Other processes only train.
+            monitor (TrainingMonitor): Optional monitor to record the
+                throughput & timings of each epoch with.
+        """
+        # Note, we'd need the latest checkpoint to resume, & pruning with
+        # `[:-0]` would keep every one anyway.
+        if keep_last < 1:
+            raise ValueError(
+                "keep_last must be at least 1, got {}.".format(keep_last)
+            )
+
+        self.model = model
+        self.optimizer = optimizer
+        self.dataloader = dataloader
+        self.criterion = criterion or torch.nn.MSELoss()
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.keep_last = keep_last
+        self.preview = preview
+        self.main_process = main_process
+        self.monitor = monitor
+        if monitor:
+            monitor.attach(self.module)
+
+        self.epoch = 0
+        self.best_loss = float("inf")
+        self.last_batch = None
+        self._writer = CheckpointWriter()
+
+    def fit(self, n_epochs):
+        """
+        Train the model until it's been trained for `n_epochs` in total.
+        Args:
+            n_epochs (int): The total number of epochs to train for.
+        """
+        for epoch in range(self.epoch, n_epochs):
+            self._set_epoch(epoch)
+            loss, output = self.train_epoch()
+            self.epoch = epoch + 1
+            if self.monitor:
+                self.monitor.end_epoch(epoch=epoch, loss=loss)
+            self.debug(epoch=epoch, loss=loss, output=output)
+            last_epoch = self.epoch == n_epochs
+            if last_epoch or self.epoch % self.checkpoint_every == 0:
+                if self.main_process:
+                    self.checkpoint()
+
+        self._writer.wait()
+        return self.best_loss
+
+    def train_epoch(self):
+        """
+        Train the model for a single epoch, returning the loss & output of
+        the last batch.
+        """
+        self.model.train()
+        loss, output = None, None
+        step_end = time.perf_counter()
+        for batch in self.dataloader:
+            step_start = time.perf_counter()
+            loss, output = self.train_step(batch=batch)
+            self.last_batch = batch
+            if self.monitor:
+                wait_time = step_start - step_end
+                step_end = time.perf_counter()
+                self.monitor.record_step(
+                    n_samples=len(batch["watermarked"]),
+                    wait_time=wait_time,
+                    compute_time=step_end - step_start
+                )
+
+        return loss, output
+
+    def train_step(self, batch):
+        """
+        Perform a single optimization step on a batch.
+        Args:
+            batch (dict of Tensor): A batch of watermarked images, & their
+                originals.
+        """
+        output = self.model(x=batch["watermarked"])
+        loss = self.compute_loss(output=output, batch=batch)
+
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+
+        return loss.item(), output
+
+    def compute_loss(self, output, batch):
+        """
+        Compute the loss of the model's output on a batch.
+        Args:
+            output (Tensor): The model's output.
+            batch (dict of Tensor): The batch the output was produced from.
+        """
+        return self.criterion(output, batch["original"])
+
+    def debug(self, epoch, loss, output):
+        """
+        Log our progress, & save the model's weights whenever the loss
+        improves on the best we've seen.
+        Args:
+            epoch (int): The epoch that just finished.
+            loss (float): The loss of the last batch.
+            output (Tensor): The model's output on the last batch.
+        """
+        if not self.main_process:
+            return
+
+        if self.preview:
+            self.preview.submit(
+                epoch=epoch,
+                output=output,
+                batch=self.last_batch
+            )
+
+        if epoch == 0 or epoch % self.LOG_EVERY == 0:
+            print(">> epoch # {}: {}".format(epoch, loss))
+            if loss < self.best_loss:
+                print(">> updating weights.")
+                self.best_loss = loss
+                self._writer.submit(
+                    state=_snapshot(self.module.state_dict()),
+                    fname=self.module.FPATH
+                )
+
+    @property
+    def module(self):
+        """
+        The model being trained, unwrapped from `DistributedDataParallel`
+        if need be, so that its checkpoints are the same either way.
+        """
+        return getattr(self.model, "module", self.model)
+
+    def state_dict(self):
+        """
+        Get a snapshot of the full training state.
+        """
+        state = {
+            "model": self.module.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "epoch": self.epoch,
+            "best_loss": self.best_loss,
+            "rng": {
+                "python": random.getstate(),
+                "numpy": numpy.random.get_state(),
+                "torch": torch.get_rng_state()
+            }
+        }
+        # Models built to a shape of their own, like pruned ones, keep it
+        # with their weights, so that `inference.load_model()` can load
+        # our checkpoints of them, too.
+        widths = getattr(self.module, "widths", None)
+        if widths is not None:
+            state["widths"] = widths
+        return _snapshot(state)
+
+    def load_state_dict(self, state):
+        """
+        Restore the full training state from a checkpoint.
+        Args:
+            state (dict): The state, as returned by `state_dict()`.
+        """
+        self.module.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.epoch = state["epoch"]
+        self.best_loss = state["best_loss"]
+        random.setstate(state["rng"]["python"])
+        numpy.random.set_state(state["rng"]["numpy"])
+        torch.set_rng_state(state["rng"]["torch"])
+
+    def checkpoint(self):
+        """
+        Save a checkpoint of the current training state in the background,
+        & prune old checkpoints once it's been written.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        fname = os.path.join(
+            self.checkpoint_dir,
+            self.CHECKPOINT_FNAME.format(self.epoch)
+        )
+        self._writer.submit(
+            state=self.state_dict(),
+            fname=fname,
+            on_written=self._prune_checkpoints
+        )
+
+    def resume(self):
+        """
+        Resume training from the latest checkpoint, if there is one.
+        Returns whether a checkpoint was found.
+        """
+        state = self.latest_checkpoint()
+        if state is None:
+            return False
+
+        self.load_state_dict(state)
+        return True
+
+    def latest_checkpoint(self):
+        """
+        Load the latest checkpoint's training state, or None if there are
+        no checkpoints.
+        """
+        fnames = self._checkpoint_fnames()
+        if not fnames:
+            return None
+
+        return torch.load(fnames[-1], weights_only=False)
+
+    def wait(self):
+        """
+        Block until all checkpoints have been written.
+        """
+        self._writer.wait()
+
+    def close(self):
+        """
+        Wait for all checkpoints to be written, & stop the thread that
+        writes them.
+        """
+        self._writer.close()
+
+    def _set_epoch(self, epoch):
+        """
+        Let samplers & datasets that reshuffle or reseed per epoch know
+        which epoch we're on.
+        """
+        sampler = getattr(self.dataloader, "sampler", None)
+        dataset = getattr(self.dataloader, "dataset", None)
+        for source in (sampler, dataset):
+            if hasattr(source, "set_epoch"):
+                source.set_epoch(epoch)
+
+    def _checkpoint_fnames(self):
+        return sorted(glob.glob(
+            os.path.join(self.checkpoint_dir, self.CHECKPOINT_GLOB)
+        ))
+
+    def _prune_checkpoints(self):
+        for fname in self._checkpoint_fnames()[:-self.keep_last]:
+            os.remove(fname)
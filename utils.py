@@ -9,8 +9,8 @@ from torchvision import transforms
 
 def display(image):
     """
-    Display an image.
+    Display the first image of a (N, C, H, W) batch, with values in [0, 1].
     """
-    display = image.resize(3, 1000, 800)
+    display = image[0].detach().clamp(0, 1)
     transforms.ToPILImage(mode="RGB")(display).show()
 